@@ -20,5 +20,27 @@ __all__ = [
     "previews",
     "separation",
     "separation_concat",
+    "jobs",
+    "inference",
+    "cache",
+    "ingest",
+    "models",
+    "batch",
+    "streaming",
+    "metrics",
+    "extraction_engine",
+    "segments",
+    "pipeline",
+    "peaks",
+    "job_store",
+    "storage",
+    "admission",
+    "speaker_index",
+    "demucs_engine",
+    "denoise_engine",
+    "broker",
+    "tasks",
+    "worker",
+    "object_store",
     "zipper",
 ]
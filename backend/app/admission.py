@@ -0,0 +1,185 @@
+import os
+import math
+import time
+import threading
+
+from app.audio_utils import probe_duration
+from app.jobs import JOB_CONCURRENCY
+from app.metrics import ADMISSION_REJECTED
+
+# Admission control for the heavy endpoints. Every job is charged a cost:
+# its audio duration, read from the upload's header, times a factor for
+# the kind of work. A header that tells nothing falls back to size over
+# ASSUMED_BYTES_PER_SECOND.
+#
+# A request is checked twice. Before its body is read, on the client's
+# request rate and on job counts alone, so an overloaded server turns it
+# away without taking the upload; passing takes a job slot right away,
+# so a burst of uploads cannot all pass before any of them is counted.
+# After the upload, with the real cost, when its share of the backlog is
+# reserved until the job ends. A job bigger than a backlog limit on its
+# own is still let in once nothing else is charged against that limit.
+#
+# Global limits answer 503 (the server is busy), per-client limits 429
+# (this client is), both with a Retry-After guessed from how fast the
+# backlog has been draining.
+
+ADMISSION_MAX_JOBS = int(os.getenv("ADMISSION_MAX_JOBS", "64"))
+ADMISSION_MAX_BACKLOG_SECONDS = float(os.getenv("ADMISSION_MAX_BACKLOG_SECONDS", "14400"))
+CLIENT_MAX_JOBS = int(os.getenv("CLIENT_MAX_JOBS", "4"))
+CLIENT_MAX_BACKLOG_SECONDS = float(os.getenv("CLIENT_MAX_BACKLOG_SECONDS", "3600"))
+CLIENT_RATE_PER_MINUTE = float(os.getenv("CLIENT_RATE_PER_MINUTE", "30"))
+# Set to e.g. X-Forwarded-For behind a proxy; its first address is the client
+ADMISSION_CLIENT_HEADER = os.getenv("ADMISSION_CLIENT_HEADER")
+
+# Roughly how much slower than the speech pipeline each kind of job is
+COST_FACTORS = {"speech": 1.0, "music": 2.0, "clean": 0.5, "batch": 1.0}
+ASSUMED_BYTES_PER_SECOND = 32000
+RETRY_AFTER_MAX_SECONDS = 600
+# Idle buckets are full anyway; past this many, they are dropped
+MAX_TRACKED_CLIENTS = 4096
+
+_active = {}
+_buckets = {}
+# Wall seconds per unit of cost, learned from finished jobs
+_seconds_per_cost = 1.0
+_lock = threading.Lock()
+
+
+class Overloaded(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: int = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+def client_id(request) -> str:
+    if ADMISSION_CLIENT_HEADER:
+        value = request.headers.get(ADMISSION_CLIENT_HEADER)
+        if value:
+            return value.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def estimate_cost(job_type: str, paths) -> float:
+    seconds = 0.0
+    for path in paths:
+        duration = probe_duration(path)
+        if duration is None:
+            duration = os.path.getsize(path) / ASSUMED_BYTES_PER_SECOND
+        seconds += duration
+    return round(seconds * COST_FACTORS[job_type], 2)
+
+
+def _retry_after(backlog: float) -> int:
+    # The pools drain the backlog in parallel
+    workers = sum(JOB_CONCURRENCY.values())
+    seconds = backlog * _seconds_per_cost / workers
+    return max(1, min(RETRY_AFTER_MAX_SECONDS, math.ceil(seconds)))
+
+
+def _totals(client: str = None):
+    jobs = [job for job in _active.values() if client is None or job["client"] == client]
+    return len(jobs), sum(job["cost"] for job in jobs)
+
+
+def _reject(status_code: int, reason: str, job_type: str, detail: str, retry_after: int):
+    ADMISSION_REJECTED.inc(reason=reason, type=job_type)
+    raise Overloaded(status_code, detail, retry_after)
+
+
+def _take_token(client: str, job_type: str):
+    now = time.time()
+    rate = CLIENT_RATE_PER_MINUTE / 60.0
+    tokens, updated = _buckets.get(client, (CLIENT_RATE_PER_MINUTE, now))
+    tokens = min(CLIENT_RATE_PER_MINUTE, tokens + (now - updated) * rate)
+    if tokens < 1:
+        _buckets[client] = (tokens, now)
+        _reject(429, "rate", job_type, "Too many requests", math.ceil((1 - tokens) / rate))
+
+    if len(_buckets) >= MAX_TRACKED_CLIENTS and client not in _buckets:
+        # A bucket refills completely within a minute
+        for other in [c for c, (_, t) in _buckets.items() if t < now - 60]:
+            del _buckets[other]
+    _buckets[client] = (tokens - 1, now)
+
+
+def _check_counts(client: str, job_type: str, cost: float = 0.0):
+    jobs, backlog = _totals()
+    if jobs >= ADMISSION_MAX_JOBS or (backlog and backlog + cost > ADMISSION_MAX_BACKLOG_SECONDS):
+        _reject(503, "busy", job_type, "Server is busy, try again later", _retry_after(backlog))
+
+    jobs, backlog = _totals(client)
+    if jobs >= CLIENT_MAX_JOBS or (backlog and backlog + cost > CLIENT_MAX_BACKLOG_SECONDS):
+        _reject(
+            429, "client", job_type,
+            f"Too much work in flight for this client ({jobs} job(s))", _retry_after(backlog)
+        )
+
+
+def check(job_id: str, client: str, job_type: str):
+    """
+    Before the upload: raises Overloaded if the request should not be
+    read, else holds a slot for job_id until reserve() or release().
+    """
+    with _lock:
+        _take_token(client, job_type)
+        _check_counts(client, job_type)
+        _active[job_id] = {"client": client, "type": job_type, "cost": 0.0, "reserved": False}
+
+
+def reserve(job_id: str, cost: float):
+    """
+    After the upload: holds cost against the limits until release().
+    On Overloaded the slot from check() is given up.
+    """
+    with _lock:
+        job = _active.pop(job_id)
+        _check_counts(job["client"], job["type"], cost)
+        _active[job_id] = {**job, "cost": cost, "reserved": True}
+
+
+def release_unreserved(job_id: str):
+    """Gives up a slot from check() that never got to reserve() (e.g. a cache hit)."""
+    with _lock:
+        if job_id in _active and not _active[job_id]["reserved"]:
+            del _active[job_id]
+
+
+def release(job_id: str, seconds: float = None):
+    global _seconds_per_cost
+    with _lock:
+        job = _active.pop(job_id, None)
+        if job and seconds is not None and job["cost"] > 0:
+            _seconds_per_cost = 0.8 * _seconds_per_cost + 0.2 * (seconds / job["cost"])
+
+
+def admitted(job_id: str, fn):
+    """Wraps a job function so its reservation ends with it."""
+    def run(*args, **kwargs):
+        started = time.time()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            release(job_id, time.time() - started)
+    return run
+
+
+def admission_stats() -> dict:
+    with _lock:
+        jobs, backlog = _totals()
+        clients = len({job["client"] for job in _active.values()})
+        return {
+            "jobs": jobs,
+            "backlog_seconds": round(backlog, 2),
+            "clients": clients,
+            "seconds_per_cost": round(_seconds_per_cost, 3),
+            "limits": {
+                "max_jobs": ADMISSION_MAX_JOBS,
+                "max_backlog_seconds": ADMISSION_MAX_BACKLOG_SECONDS,
+                "client_max_jobs": CLIENT_MAX_JOBS,
+                "client_max_backlog_seconds": CLIENT_MAX_BACKLOG_SECONDS,
+                "client_rate_per_minute": CLIENT_RATE_PER_MINUTE,
+            },
+        }
@@ -1,23 +1,196 @@
 import subprocess
 import os
 import uuid
+import shutil
 
 NORMALIZED_DIR = "outputs/normalized"
 os.makedirs(NORMALIZED_DIR, exist_ok=True)
 
-def normalize_audio(input_path: str) -> str:
-    output_path = os.path.join(
-        NORMALIZED_DIR,
-        f"{uuid.uuid4().hex}.wav"
-    )
-
-    subprocess.run([
+def normalize_command(input_path: str, output_path: str) -> list:
+    return [
         "ffmpeg", "-y",
         "-i", input_path,
         "-ac", "1",
         "-ar", "16000",
         "-c:a", "pcm_s16le",
         output_path
-    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    ]
+
+
+def normalize_audio(input_path: str, output_path: str = None) -> str:
+    output_path = output_path or os.path.join(
+        NORMALIZED_DIR,
+        f"{uuid.uuid4().hex}.wav"
+    )
+
+    subprocess.run(
+        normalize_command(input_path, output_path),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True
+    )
 
     return output_path
+
+
+def wav_layout(path: str):
+    """
+    Parses a WAV header without reading the samples.
+
+    Returns dict(format, channels, sample_rate, bits, data_offset,
+    data_size, frames).
+    """
+    import struct
+
+    with open(path, "rb") as f:
+        riff, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            raise ValueError(f"Not a RIFF/WAVE file: {path}")
+
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"No data chunk in {path}")
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+
+            if chunk_id == b"fmt ":
+                fmt = struct.unpack("<HHIIHH", f.read(16))
+                f.seek(chunk_size - 16 + (chunk_size & 1), os.SEEK_CUR)
+            elif chunk_id == b"data":
+                data_offset = f.tell()
+                break
+            else:
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+    if fmt is None:
+        raise ValueError(f"No fmt chunk in {path}")
+
+    audio_format, channels, sample_rate, _, block_align, bits = fmt
+    # ffmpeg leaves chunk_size at 0xFFFFFFFF when it cannot seek back
+    data_size = min(chunk_size, os.path.getsize(path) - data_offset)
+
+    return {
+        "format": audio_format,
+        "channels": channels,
+        "sample_rate": sample_rate,
+        "bits": bits,
+        "data_offset": data_offset,
+        "data_size": data_size,
+        "frames": data_size // block_align if block_align else 0,
+    }
+
+
+def wav_duration(path: str) -> float:
+    layout = wav_layout(path)
+    return layout["frames"] / layout["sample_rate"]
+
+
+def probe_duration(path: str):
+    """
+    Duration in seconds from the file's header alone: parsed directly
+    for WAV, asked of ffprobe otherwise. None when neither can tell.
+    """
+    import struct
+
+    try:
+        return wav_duration(path)
+    except (ValueError, OSError, ZeroDivisionError, struct.error):
+        pass
+
+    try:
+        probe = subprocess.run(
+            [
+                "ffprobe", "-v", "error",
+                "-show_entries", "format=duration",
+                "-of", "default=noprint_wrappers=1:nokey=1",
+                path
+            ],
+            capture_output=True, text=True, timeout=10
+        )
+        return float(probe.stdout.strip())
+    except (OSError, ValueError, subprocess.TimeoutExpired):
+        return None
+
+
+def read_wav_memmap(path: str):
+    """
+    Memory-maps the PCM data chunk of a WAV file.
+
+    Returns (samples, sample_rate) where samples is a read-only
+    numpy array of shape (frames, channels). Nothing is decoded or
+    copied until a slice of it is actually touched.
+    """
+    import numpy as np
+
+    layout = wav_layout(path)
+    channels = layout["channels"]
+    sample_rate = layout["sample_rate"]
+
+    # 0xFFFE = WAVE_FORMAT_EXTENSIBLE, which ffmpeg uses for > 2 channels
+    if layout["format"] not in (1, 0xFFFE) or layout["bits"] != 16:
+        raise ValueError(f"Only 16-bit PCM WAV is supported: {path}")
+
+    frames = layout["data_size"] // (2 * channels)
+
+    if frames == 0:
+        return np.zeros((0, channels), dtype="<i2"), sample_rate
+
+    samples = np.memmap(
+        path,
+        dtype="<i2",
+        mode="r",
+        offset=layout["data_offset"],
+        shape=(frames, channels)
+    )
+    return samples, sample_rate
+
+
+def decode_f32(input_path: str, raw_path: str, sample_rate: int, channels: int):
+    """
+    Decodes any input to interleaved float32 on disk and memory-maps it
+    as (frames, channels).
+    """
+    import numpy as np
+
+    subprocess.run([
+        "ffmpeg", "-y", "-v", "error",
+        "-i", input_path,
+        "-ac", str(channels),
+        "-ar", str(sample_rate),
+        "-f", "f32le",
+        raw_path
+    ], check=True)
+    if os.path.getsize(raw_path) == 0:
+        return np.zeros((0, channels), dtype="<f4")
+    return np.memmap(raw_path, dtype="<f4", mode="r").reshape(-1, channels)
+
+
+def chunk_bounds(total_frames: int, chunk: int, overlap: int):
+    """(start, end) pairs covering total_frames, each overlapping the last."""
+    bounds = []
+    start = 0
+    while start < total_frames:
+        end = min(start + chunk, total_frames)
+        bounds.append((start, end))
+        if end == total_frames:
+            break
+        start = end - overlap
+    return bounds
+
+
+def to_int24(block) -> bytes:
+    """Packs (frames, channels) floats in [-1, 1] as 24-bit PCM frames."""
+    import numpy as np
+
+    ints = np.ascontiguousarray(np.clip(block, -1.0, 1.0) * 8388607, dtype="<i4")
+    return ints.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+
+
+def link_or_copy(src: str, dst: str):
+    """Hardlinks src to dst, replacing dst, or copies it where that fails."""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        # Different filesystem, or one without hardlinks
+        shutil.copyfile(src, dst)
@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import argparse
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from app.orchestrator import process_audio_pipeline
+from app.tasks import diarize
+from app.models import MODEL_REPLICAS
+from app.jobs import new_job_id
+from app import job_store
+
+BATCH_DIR = "outputs/batches"
+CPU_COUNT = os.cpu_count() or 1
+
+# Files are not stacked into shared forward passes: pyannote's pipeline
+# runs segmentation, embedding and clustering for one file per call, and
+# batching across files would mean rewriting it. Throughput scales with
+# cores instead through files diarized side by side, each on its own
+# model replica in the shared inference process (DIARIZATION_REPLICAS,
+# a quarter of the cores by default) or on a diarize worker behind
+# TASK_BROKER, with segmentation and embedding batched within each file
+# (DIARIZATION_BATCH_SIZE).
+#
+# Diarizations a batch has in flight at once; by default one per replica,
+# so a batch keeps every replica busy. Set it to the total diarize worker
+# slots when TASK_BROKER spreads the work over several nodes.
+BATCH_DIARIZATION_WORKERS = int(
+    os.getenv("BATCH_DIARIZATION_WORKERS", str(MODEL_REPLICAS["diarization"]))
+)
+# Files in flight at once; normalization and extraction are ffmpeg/IO
+# bound and overlap with the diarization of other files.
+BATCH_FILE_WORKERS = int(os.getenv("BATCH_FILE_WORKERS", str(CPU_COUNT)))
+
+
+def _no_progress(stage: str, fraction: float):
+    pass
+
+
+def process_batch(audio_paths: list, batch_id: str = None, progress=None):
+    """
+    Runs process_audio_pipeline over many files at once and writes a
+    combined index.json next to the per-job metadata.json files.
+    """
+    progress = progress or _no_progress
+    batch_id = batch_id or new_job_id("batch")
+    batch_dir = os.path.join(BATCH_DIR, batch_id)
+    os.makedirs(batch_dir, exist_ok=True)
+
+    started = time.time()
+    diarization_workers = max(1, min(BATCH_DIARIZATION_WORKERS, len(audio_paths)))
+    file_workers = max(1, min(BATCH_FILE_WORKERS, len(audio_paths)))
+
+    diarizing = threading.Semaphore(diarization_workers)
+
+    def diarizer(audio_path, partial_path=None, return_embeddings=False):
+        with diarizing:
+            return diarize(audio_path, partial_path, return_embeddings)
+
+    finished = []
+
+    def run_one(audio_path):
+        job_id = new_job_id()
+        entry = {"file": os.path.basename(audio_path), "job_id": job_id}
+        job_started = time.time()
+        job_store.create_job(job_id, "speech", status="running", started_at=job_started)
+        try:
+            result = process_audio_pipeline(audio_path, job_id=job_id, diarizer=diarizer)
+            entry.update(status="done", speakers=result["speakers"])
+        except Exception as e:
+            traceback.print_exc()
+            entry.update(status="failed", error=str(e))
+            result = None
+
+        job_finished = time.time()
+        job_store.update_job(
+            job_id, status=entry["status"], result=result, error=entry.get("error"),
+            finished_at=job_finished, processing_seconds=round(job_finished - job_started, 3)
+        )
+
+        finished.append(job_id)
+        progress("files", len(finished) / len(audio_paths))
+        return entry
+
+    with ThreadPoolExecutor(max_workers=file_workers) as files:
+        entries = list(files.map(run_one, audio_paths))
+
+    elapsed = time.time() - started
+    index = {
+        "batch_id": batch_id,
+        "created_at": started,
+        "elapsed_seconds": round(elapsed, 2),
+        "files_per_hour": round(len(audio_paths) / elapsed * 3600, 1) if elapsed else None,
+        "files": entries,
+    }
+
+    with open(os.path.join(batch_dir, "index.json"), "w") as f:
+        json.dump(index, f, indent=2)
+
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Diarize and split many recordings in one run."
+    )
+    parser.add_argument("files", nargs="+", help="audio files to process")
+    parser.add_argument("--batch-id", help="defaults to a random id")
+    args = parser.parse_args()
+
+    def report(stage, fraction):
+        print(f"{stage}: {fraction:.0%}")
+
+    index = process_batch(args.files, batch_id=args.batch_id, progress=report)
+    failed = sum(1 for entry in index["files"] if entry["status"] != "done")
+
+    print(f"Wrote {os.path.join(BATCH_DIR, index['batch_id'], 'index.json')}")
+    if failed:
+        raise SystemExit(f"{failed} file(s) failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Queue between the API host and worker nodes (see app.worker). With
+# TASK_BROKER unset every task runs in the calling process, as before.
+#
+#   sqlite:///outputs/broker.db   one box, or several sharing the file
+#   redis://host:6379/0           any Redis-compatible server
+#
+# A task is claimed by one worker at a time. Workers heartbeat every
+# HEARTBEAT_SECONDS with what they can run and how many slots are free;
+# a running task whose worker has been silent for WORKER_TIMEOUT_SECONDS
+# goes back to the queue. Waiters sweep for those too, and give up with
+# TaskFailed once no live worker advertises the task at all, rather
+# than wait for a worker that is never coming.
+
+TASK_BROKER = os.getenv("TASK_BROKER")
+HEARTBEAT_SECONDS = float(os.getenv("WORKER_HEARTBEAT_SECONDS", "5"))
+WORKER_TIMEOUT_SECONDS = float(os.getenv("WORKER_TIMEOUT_SECONDS", "30"))
+POLL_SECONDS = 0.2
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    task TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    worker_id TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    claimed_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_by_queue ON tasks (status, task, created_at);
+
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    capacity TEXT NOT NULL,
+    heartbeat_at REAL NOT NULL
+);
+"""
+
+
+class TaskFailed(Exception):
+    pass
+
+
+def new_task_id() -> str:
+    return f"task_{uuid.uuid4().hex[:12]}"
+
+
+def _has_worker(broker, task: str) -> bool:
+    return any(task in worker.get("tasks", ()) for worker in broker.workers())
+
+
+def _no_worker(task: str) -> TaskFailed:
+    return TaskFailed(f"No live worker runs '{task}'; start one with python -m app.worker")
+
+
+class SqliteBroker:
+    """The queue is two tables in a SQLite file, polled by the workers."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _db(self) -> sqlite3.Connection:
+        # sqlite3 connections must stay on the thread that made them
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SQLITE_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._db()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def submit(self, task: str, payload: dict, task_id: str = None) -> str:
+        task_id = task_id or new_task_id()
+        self._db().execute(
+            "INSERT INTO tasks (task_id, task, payload, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+            (task_id, task, json.dumps(payload), time.time())
+        )
+        return task_id
+
+    def claim(self, worker_id: str, tasks, timeout: float = 0):
+        """Oldest queued task among `tasks`, as (task_id, task, payload), or None."""
+        deadline = time.time() + timeout
+        marks = ", ".join("?" * len(tasks))
+        while True:
+            with self._transaction() as conn:
+                row = conn.execute(
+                    f"SELECT task_id, task, payload FROM tasks WHERE status = 'queued' AND task IN ({marks}) "
+                    "ORDER BY created_at LIMIT 1",
+                    list(tasks)
+                ).fetchone()
+                if row:
+                    conn.execute(
+                        "UPDATE tasks SET status = 'running', worker_id = ?, claimed_at = ? WHERE task_id = ?",
+                        (worker_id, time.time(), row["task_id"])
+                    )
+                    return row["task_id"], row["task"], json.loads(row["payload"])
+            if time.time() >= deadline:
+                return None
+            time.sleep(POLL_SECONDS)
+
+    def complete(self, task_id: str, result):
+        self._db().execute(
+            "UPDATE tasks SET status = 'done', result = ?, finished_at = ? WHERE task_id = ?",
+            (json.dumps(result), time.time(), task_id)
+        )
+
+    def fail(self, task_id: str, error: str):
+        self._db().execute(
+            "UPDATE tasks SET status = 'failed', error = ?, finished_at = ? WHERE task_id = ?",
+            (error, time.time(), task_id)
+        )
+
+    def wait(self, task_id: str, timeout: float = None):
+        """Blocks until the task finishes; returns its result or raises TaskFailed."""
+        deadline = None if timeout is None else time.time() + timeout
+        next_sweep = time.time()
+        while True:
+            row = self._db().execute(
+                "SELECT task, status, result, error FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+            if row is None:
+                raise KeyError(task_id)
+            if row["status"] in ("done", "failed"):
+                # Nobody reads a finished task twice
+                self._db().execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+                if row["status"] == "failed":
+                    raise TaskFailed(row["error"])
+                return json.loads(row["result"])
+            if time.time() >= next_sweep:
+                self.requeue_stale()
+                if not _has_worker(self, row["task"]):
+                    self._db().execute(
+                        "DELETE FROM tasks WHERE task_id = ? AND status = 'queued'", (task_id,)
+                    )
+                    raise _no_worker(row["task"])
+                next_sweep = time.time() + HEARTBEAT_SECONDS
+            if deadline is not None and time.time() >= deadline:
+                raise TimeoutError(task_id)
+            time.sleep(POLL_SECONDS)
+
+    def heartbeat(self, worker_id: str, capacity: dict):
+        self._db().execute(
+            "INSERT INTO workers (worker_id, capacity, heartbeat_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (worker_id) DO UPDATE SET capacity = excluded.capacity, heartbeat_at = excluded.heartbeat_at",
+            (worker_id, json.dumps(capacity), time.time())
+        )
+
+    def leave(self, worker_id: str):
+        self._db().execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+
+    def workers(self) -> list:
+        cutoff = time.time() - WORKER_TIMEOUT_SECONDS
+        rows = self._db().execute(
+            "SELECT worker_id, capacity, heartbeat_at FROM workers WHERE heartbeat_at >= ? ORDER BY worker_id",
+            (cutoff,)
+        )
+        return [
+            {"worker_id": row["worker_id"], "heartbeat_at": row["heartbeat_at"], **json.loads(row["capacity"])}
+            for row in rows
+        ]
+
+    def requeue_stale(self) -> int:
+        """Puts tasks of workers that stopped heartbeating back in the queue."""
+        cutoff = time.time() - WORKER_TIMEOUT_SECONDS
+        with self._transaction() as conn:
+            requeued = conn.execute(
+                "UPDATE tasks SET status = 'queued', worker_id = NULL, claimed_at = NULL "
+                "WHERE status = 'running' AND worker_id NOT IN "
+                "(SELECT worker_id FROM workers WHERE heartbeat_at >= ?)",
+                (cutoff,)
+            ).rowcount
+            conn.execute("DELETE FROM workers WHERE heartbeat_at < ?", (cutoff,))
+        return requeued
+
+    def queue_depth(self) -> dict:
+        rows = self._db().execute(
+            "SELECT task, COUNT(*) AS n FROM tasks WHERE status = 'queued' GROUP BY task"
+        )
+        return {row["task"]: row["n"] for row in rows}
+
+
+class RedisBroker:
+    """
+    One list per task name as the queue, a hash per task for its state,
+    and a list per task that its result is pushed to for the waiter.
+    A claim moves the task id atomically into the worker's own
+    processing list, so a worker dying mid-claim never loses it.
+    """
+
+    def __init__(self, url: str):
+        import redis
+
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+
+    def submit(self, task: str, payload: dict, task_id: str = None) -> str:
+        task_id = task_id or new_task_id()
+        body = json.dumps({"task_id": task_id, "task": task, "payload": payload})
+        pipe = self.redis.pipeline()
+        pipe.hset(f"task:{task_id}", mapping={"body": body, "status": "queued", "created_at": time.time()})
+        pipe.lpush(f"queue:{task}", task_id)
+        pipe.execute()
+        return task_id
+
+    def claim(self, worker_id: str, tasks, timeout: float = 0):
+        deadline = time.time() + timeout
+        processing = f"processing:{worker_id}"
+        while True:
+            for task in tasks:
+                task_id = self.redis.rpoplpush(f"queue:{task}", processing)
+                if task_id is None:
+                    continue
+                body = self.redis.hget(f"task:{task_id}", "body")
+                if body is None:
+                    # Given up by its waiter while queued
+                    self.redis.lrem(processing, 0, task_id)
+                    continue
+                body = json.loads(body)
+                self.redis.hset(
+                    f"task:{task_id}",
+                    mapping={"status": "running", "worker_id": worker_id, "claimed_at": time.time()}
+                )
+                return task_id, body["task"], body["payload"]
+            if time.time() >= deadline:
+                return None
+            time.sleep(POLL_SECONDS)
+
+    def _finish(self, task_id: str, message: dict):
+        worker_id = self.redis.hget(f"task:{task_id}", "worker_id")
+        pipe = self.redis.pipeline()
+        if worker_id:
+            pipe.lrem(f"processing:{worker_id}", 0, task_id)
+        pipe.delete(f"task:{task_id}")
+        pipe.lpush(f"result:{task_id}", json.dumps(message))
+        # A waiter that died never collects it
+        pipe.expire(f"result:{task_id}", 24 * 3600)
+        pipe.execute()
+
+    def complete(self, task_id: str, result):
+        self._finish(task_id, {"status": "done", "result": result})
+
+    def fail(self, task_id: str, error: str):
+        self._finish(task_id, {"status": "failed", "error": error})
+
+    def wait(self, task_id: str, timeout: float = None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            popped = self.redis.blpop([f"result:{task_id}"], timeout=max(1, int(HEARTBEAT_SECONDS)))
+            if popped is not None:
+                break
+            state = self.redis.hgetall(f"task:{task_id}")
+            if not state:
+                # Finished between the pop and now
+                continue
+            self.requeue_stale()
+            task = json.loads(state["body"])["task"]
+            if not _has_worker(self, task):
+                self.redis.delete(f"task:{task_id}")
+                self.redis.lrem(f"queue:{task}", 0, task_id)
+                raise _no_worker(task)
+            if deadline is not None and time.time() >= deadline:
+                raise TimeoutError(task_id)
+        message = json.loads(popped[1])
+        if message["status"] == "failed":
+            raise TaskFailed(message["error"])
+        return message["result"]
+
+    def heartbeat(self, worker_id: str, capacity: dict):
+        pipe = self.redis.pipeline()
+        pipe.hset("workers", worker_id, json.dumps(capacity))
+        pipe.zadd("heartbeats", {worker_id: time.time()})
+        pipe.execute()
+
+    def leave(self, worker_id: str):
+        pipe = self.redis.pipeline()
+        pipe.hdel("workers", worker_id)
+        pipe.zrem("heartbeats", worker_id)
+        pipe.execute()
+
+    def workers(self) -> list:
+        cutoff = time.time() - WORKER_TIMEOUT_SECONDS
+        alive = self.redis.zrangebyscore("heartbeats", cutoff, "+inf", withscores=True)
+        capacities = self.redis.hmget("workers", [worker_id for worker_id, _ in alive]) if alive else []
+        return [
+            {"worker_id": worker_id, "heartbeat_at": heartbeat_at, **json.loads(capacity)}
+            for (worker_id, heartbeat_at), capacity in zip(alive, capacities)
+            if capacity
+        ]
+
+    def requeue_stale(self) -> int:
+        cutoff = time.time() - WORKER_TIMEOUT_SECONDS
+        alive = {worker["worker_id"] for worker in self.workers()}
+        requeued = 0
+        for key in self.redis.scan_iter("processing:*"):
+            if key.split(":", 1)[1] in alive:
+                continue
+            # rpop decides which of several sweepers requeues each task
+            for task_id in iter(lambda: self.redis.rpop(key), None):
+                body = self.redis.hget(f"task:{task_id}", "body")
+                if body is None:
+                    continue
+                self.redis.hset(f"task:{task_id}", "status", "queued")
+                self.redis.rpush(f"queue:{json.loads(body)['task']}", task_id)
+                requeued += 1
+        for worker_id in self.redis.zrangebyscore("heartbeats", "-inf", cutoff):
+            self.leave(worker_id)
+        return requeued
+
+    def queue_depth(self) -> dict:
+        depth = {}
+        for key in self.redis.scan_iter("queue:*"):
+            depth[key.split(":", 1)[1]] = self.redis.llen(key)
+        return depth
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """The configured broker, or None when tasks run in-process."""
+    global _broker
+    if not TASK_BROKER:
+        return None
+    with _broker_lock:
+        if _broker is None:
+            scheme, _, rest = TASK_BROKER.partition("://")
+            if scheme == "sqlite":
+                # sqlite:///relative/path, sqlite:////absolute/path
+                _broker = SqliteBroker(rest[1:] if rest.startswith("/") else rest)
+            elif scheme in ("redis", "rediss", "unix"):
+                _broker = RedisBroker(TASK_BROKER)
+            else:
+                raise ValueError(f"Unsupported task broker: {TASK_BROKER}")
+        return _broker
@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+from app.cleanup import delete_path, path_size
+
+CACHE_DIR = "outputs/cache"
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_MB", "5120")) * 1024 * 1024
+
+_entries = None
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_lock = threading.Lock()
+
+
+def cache_key(content_hash: str, operation: str, **params) -> str:
+    payload = json.dumps([content_hash, operation, params], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _entry_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, f"{key}.json")
+
+
+def _load_entries():
+    global _entries
+    if _entries is not None:
+        return _entries
+
+    _entries = {}
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(CACHE_DIR, name)) as f:
+                _entries[name[:-5]] = json.load(f)
+        except (OSError, ValueError):
+            continue
+    return _entries
+
+
+def _drop(key: str):
+    entry = _entries.pop(key)
+    for path in entry["paths"]:
+        delete_path(path)
+    if os.path.exists(_entry_path(key)):
+        os.remove(_entry_path(key))
+
+
+def _evict():
+    total = sum(e["size"] for e in _entries.values())
+    for key in sorted(_entries, key=lambda k: _entries[k]["last_used"]):
+        if total <= CACHE_MAX_BYTES:
+            break
+        total -= _entries[key]["size"]
+        _drop(key)
+        _stats["evictions"] += 1
+
+
+def lookup(key: str):
+    """
+    Returns the stored job manifest for key, or None. Entries whose
+    files have disappeared underneath us count as misses.
+    """
+    with _lock:
+        entries = _load_entries()
+        entry = entries.get(key)
+
+        if entry and not all(os.path.exists(p) for p in entry["paths"]):
+            _drop(key)
+            entry = None
+
+        if entry is None:
+            _stats["misses"] += 1
+            return None
+
+        _stats["hits"] += 1
+        entry["last_used"] = time.time()
+        with open(_entry_path(key), "w") as f:
+            json.dump(entry, f)
+        return entry["manifest"]
+
+
+def store(key: str, manifest: dict, paths: list):
+    """
+    Records manifest under key. paths are the job's artifact folders;
+    they are pinned against cleanup until the entry is evicted.
+    """
+    now = time.time()
+    entry = {
+        "manifest": manifest,
+        "paths": [os.path.normpath(p) for p in paths],
+        "size": sum(path_size(p) for p in paths if os.path.exists(p)),
+        "created_at": now,
+        "last_used": now,
+    }
+
+    if entry["size"] > CACHE_MAX_BYTES:
+        # Caching it would only evict everything else, itself included
+        return
+
+    with _lock:
+        entries = _load_entries()
+        entries[key] = entry
+        with open(_entry_path(key), "w") as f:
+            json.dump(entry, f)
+        _evict()
+
+
+def pinned_paths() -> set:
+    """
+    Every path a cache entry holds on to, with each folder above it, so
+    a path is pinned exactly when it is in the set.
+    """
+    pinned = set()
+    with _lock:
+        for entry in _load_entries().values():
+            for path in entry["paths"]:
+                while path not in pinned and path not in ("", os.path.dirname(path)):
+                    pinned.add(path)
+                    path = os.path.dirname(path)
+    return pinned
+
+
+def cache_stats():
+    with _lock:
+        entries = _load_entries()
+        return {
+            **_stats,
+            "entries": len(entries),
+            "bytes": sum(e["size"] for e in entries.values()),
+            "max_bytes": CACHE_MAX_BYTES,
+        }
@@ -1,17 +1,22 @@
 import os
 import shutil
-import threading
-import time
 
 def delete_path(path: str):
-    if os.path.exists(path):
+    if os.path.isdir(path):
         shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
 
-def schedule_job_cleanup(job_dir: str, delay_minutes: int = 30):
-    
-    def _cleanup():
-        time.sleep(delay_minutes * 60)
-        delete_path(job_dir)
 
-    t = threading.Thread(target=_cleanup, daemon=True)
-    t.start()
+def path_size(path: str) -> int:
+    """Bytes in a file, or in every file under a folder; vanished files count as 0."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except FileNotFoundError:
+                pass
+    return total
@@ -0,0 +1,211 @@
+import os
+import wave
+import argparse
+
+import numpy as np
+
+from app.models import get_model, DEMUCS_MODEL
+from app.peaks import PeakBuilder, peaks_path
+from app.audio_utils import decode_f32, chunk_bounds, to_int24
+
+# Runs inside the model process (see app.inference), so the weights are
+# loaded once and stay resident between requests.
+#
+# A track is cut into CHUNK_SECONDS pieces that overlap by
+# OVERLAP_SECONDS. Up to DEMUCS_JOBS pieces go through the model as one
+# batch, from a single thread: the model is not safe to call from
+# several threads, and one call already uses every intra-op thread.
+# Each result is crossfaded into the previous one and spooled to disk,
+# so memory stays flat however long the track is. Like the demucs CLI
+# (clip="rescale"), a stem whose peak goes over full scale is scaled
+# down as a whole when it is written out as 24-bit WAV.
+
+CPU_COUNT = os.cpu_count() or 1
+
+# "cuda", "cpu", or unset to pick whichever is available
+DEMUCS_DEVICE = os.getenv("DEMUCS_DEVICE")
+# Chunks per batch. A GPU is already saturated by one.
+DEMUCS_JOBS = int(os.getenv("DEMUCS_JOBS", "0")) or None
+# torch intra-op threads. This is process-wide, so it is only changed
+# when asked for; diarization shares the process.
+DEMUCS_THREADS = int(os.getenv("DEMUCS_THREADS", "0")) or None
+
+CHUNK_SECONDS = float(os.getenv("DEMUCS_CHUNK_SECONDS", "60"))
+OVERLAP_SECONDS = float(os.getenv("DEMUCS_OVERLAP_SECONDS", "2"))
+# Frames per block when the spooled stems are written out
+WRITE_BLOCK_FRAMES = 1 << 20
+
+
+def params():
+    """The settings that change separate() output, for cache keys."""
+    return {
+        "engine": "in-process",
+        "chunk_seconds": CHUNK_SECONDS,
+        "overlap_seconds": OVERLAP_SECONDS,
+        "clip": "rescale",
+    }
+
+
+def load_model():
+    import torch
+    from demucs.pretrained import get_model as load_pretrained
+
+    device = DEMUCS_DEVICE or ("cuda" if torch.cuda.is_available() else "cpu")
+    if DEMUCS_THREADS:
+        torch.set_num_threads(DEMUCS_THREADS)
+
+    model = load_pretrained(DEMUCS_MODEL)
+    model.eval()
+    model.to(device)
+    model.device_name = device
+    return model
+
+
+def default_jobs(device: str) -> int:
+    if device != "cpu":
+        return 1
+    return max(1, min(4, CPU_COUNT // 4))
+
+
+def _mono_stats(mix, block: int = 10_000_000):
+    # Same reference demucs normalizes by, accumulated block by block
+    total, total_sq, count = 0.0, 0.0, 0
+    for start in range(0, len(mix), block):
+        ref = mix[start:start + block].mean(axis=1, dtype=np.float64)
+        total += ref.sum()
+        total_sq += np.square(ref).sum()
+        count += len(ref)
+    if not count:
+        return 0.0, 1.0
+    mean = total / count
+    std = np.sqrt(max(total_sq / count - mean * mean, 0.0))
+    return mean, std or 1.0
+
+
+def _write_stem(spool: str, path: str, sample_rate: int, channels: int, scale: float):
+    """Writes a spooled stem times scale as 24-bit WAV, with its peak index."""
+    if os.path.getsize(spool):
+        data = np.memmap(spool, dtype="<f4", mode="r").reshape(-1, channels)
+    else:
+        data = np.zeros((0, channels), dtype="<f4")
+    peaks = PeakBuilder(sample_rate)
+    with wave.open(path, "wb") as writer:
+        writer.setnchannels(channels)
+        writer.setsampwidth(3)
+        writer.setframerate(sample_rate)
+        for start in range(0, len(data), WRITE_BLOCK_FRAMES):
+            block = data[start:start + WRITE_BLOCK_FRAMES] * scale
+            writer.writeframesraw(to_int24(block))
+            peaks.add(block)
+    peaks.write(peaks_path(path))
+
+
+def separate(input_audio: str, output_dir: str, jobs: int = None):
+    """
+    Splits input_audio into the model's stems as 24-bit WAVs in
+    output_dir, each with its waveform peak index. Returns {stem: path}
+    in the model's source order.
+    """
+    import torch
+    from demucs.apply import apply_model
+
+    model = get_model("demucs")
+    device = model.device_name
+    jobs = jobs or DEMUCS_JOBS or default_jobs(device)
+    sample_rate = model.samplerate
+    channels = model.audio_channels
+
+    os.makedirs(output_dir, exist_ok=True)
+    raw_path = os.path.join(output_dir, "input.f32")
+    paths = {name: os.path.join(output_dir, f"{name}.wav") for name in model.sources}
+    # Each stem as raw float32 frames, until its peak is known
+    spools = {name: f"{path}.f32" for name, path in paths.items()}
+
+    try:
+        mix = decode_f32(input_audio, raw_path, sample_rate, channels)
+        mean, std = _mono_stats(mix)
+        chunk_frames = int(CHUNK_SECONDS * sample_rate)
+        overlap = min(int(OVERLAP_SECONDS * sample_rate), chunk_frames // 2)
+        bounds = chunk_bounds(len(mix), chunk_frames, overlap)
+
+        def run_batch(spans):
+            batch = torch.from_numpy(np.stack([
+                np.ascontiguousarray(mix[start:end].T) for start, end in spans
+            ]))
+            batch = (batch - mean) / std
+            with torch.no_grad():
+                out = apply_model(
+                    model, batch, device=device,
+                    split=True, overlap=0.25, progress=False
+                )
+            # (chunks, stems, channels, frames) -> (chunks, stems, frames, channels)
+            return (out * std + mean).cpu().numpy().transpose(0, 1, 3, 2)
+
+        def batches():
+            # Consecutive chunks of the same length, up to `jobs` at a time;
+            # only the last chunk is ever shorter
+            group = []
+            for span in bounds:
+                if group and (len(group) == jobs or span[1] - span[0] != group[0][1] - group[0][0]):
+                    yield group
+                    group = []
+                group.append(span)
+            if group:
+                yield group
+
+        peak = {name: 0.0 for name in paths}
+
+        files = {name: open(spool, "wb") for name, spool in spools.items()}
+        try:
+            fade_in = np.linspace(0.0, 1.0, overlap, dtype=np.float32)[:, None]
+            tail = None
+            done = 0
+            for group in batches():
+                for out in run_batch(group):
+                    if tail is not None:
+                        out[:, :overlap] = tail * (1.0 - fade_in) + out[:, :overlap] * fade_in
+                    done += 1
+                    last = done == len(bounds)
+                    keep = out.shape[1] if last else out.shape[1] - overlap
+                    for s, name in enumerate(model.sources):
+                        block = np.ascontiguousarray(out[s, :keep], dtype="<f4")
+                        if len(block):
+                            peak[name] = max(peak[name], float(np.abs(block).max()))
+                        files[name].write(block.tobytes())
+                    tail = None if last else out[:, keep:].copy()
+        finally:
+            for f in files.values():
+                f.close()
+
+        for name, path in paths.items():
+            # clip="rescale": the whole stem is scaled down if it clips
+            _write_stem(spools[name], path, sample_rate, channels, 1.0 / max(1.01 * peak[name], 1.0))
+    finally:
+        mix = None
+        for path in [raw_path, *spools.values()]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Separate a track into stems in-process.")
+    parser.add_argument("input", help="audio file")
+    parser.add_argument("--out", default="outputs/demucs", help="output base folder")
+    parser.add_argument("--jobs", type=int, help="chunks separated in parallel")
+    parser.add_argument("--threads", type=int, help="torch threads")
+    args = parser.parse_args()
+
+    if args.threads:
+        import torch
+        torch.set_num_threads(args.threads)
+
+    name = os.path.splitext(os.path.basename(args.input))[0]
+    stems = separate(args.input, os.path.join(args.out, DEMUCS_MODEL, name), jobs=args.jobs)
+    for stem, path in stems.items():
+        print(f"{stem}: {path}")
+
+
+if __name__ == "__main__":
+    main()
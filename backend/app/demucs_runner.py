@@ -1,27 +1,19 @@
 import os
-import subprocess
 
-def run_demucs(input_audio: str, output_base: str = "outputs/demucs"):
+from app import inference
+from app.models import DEMUCS_MODEL
+
+def run_demucs(input_audio: str, output_base: str = "outputs/demucs", name: str = None):
+    """
+    Separates input_audio into stems with the resident model in the
+    inference process. Stems land in output_base/<model>/<name>, where
+    name defaults to the input file's name. Returns {stem: path}.
+    """
     if not os.path.exists(input_audio):
         raise FileNotFoundError(f"Audio not found: {input_audio}")
 
-    song_name = os.path.splitext(os.path.basename(input_audio))[0]
-    
-    os.makedirs(output_base, exist_ok=True)
-
-    command = [
-        "demucs",
-        "-n", "htdemucs",     # Standard Model (Fastest)
-        "--device", "cuda",   # Use GPU if available
-        "--int24",            # KEEP THIS: Fixes "muted" audio issue
-        "--out", output_base,
-        input_audio
-    ]
-
-    print(f"Running Standard Demucs (24-bit) on {input_audio}...")
-    subprocess.run(command, check=True)
+    name = name or os.path.splitext(os.path.basename(input_audio))[0]
+    output_dir = os.path.join(output_base, DEMUCS_MODEL, name)
 
-    # Return the specific output folder
-    final_output_dir = os.path.join(output_base, "htdemucs", song_name)
-    
-    return final_output_dir
\ No newline at end of file
+    print(f"Running Demucs on {input_audio}...")
+    return inference.separate_music(input_audio, output_dir)
@@ -0,0 +1,215 @@
+import os
+import re
+import json
+import wave
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from app.audio_utils import decode_f32, chunk_bounds, to_int24
+from app.metrics import bind_stages
+from app.peaks import PeakBuilder, peaks_path
+
+# Enhancement in three steps, each over a float32 memory map:
+#   1. the input is decoded once to 44.1 kHz stereo
+#   2. CHUNK_SECONDS pieces overlapping by OVERLAP_SECONDS go through
+#      afftdn on DENOISE_JOBS ffmpeg processes at once, and are
+#      crossfaded back together in order
+#   3. loudnorm's two passes over the joined, denoised audio: one that
+#      only measures it, then one fed those measurements with
+#      linear=true, streamed into the 24-bit WAV. loudnorm itself falls
+#      back to dynamic mode where a single gain would break TARGET_TP
+#      or TARGET_LRA, like the serial engine's one-pass loudnorm always
+#      does; everywhere else the result is a plain gain.
+# afftdn with a fixed noise floor only looks a few milliseconds around
+# each sample, so a short crossfade hides the chunk seams.
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+
+NOISE_FILTER = "afftdn=nf=-25"
+# EBU R128 targets, the same as loudnorm's defaults
+TARGET_I = -24.0
+TARGET_TP = -2.0
+TARGET_LRA = 7.0
+LOUDNORM = f"loudnorm=I={TARGET_I}:TP={TARGET_TP}:LRA={TARGET_LRA}"
+
+DENOISE_JOBS = int(os.getenv("DENOISE_JOBS", "0")) or os.cpu_count() or 1
+CHUNK_SECONDS = float(os.getenv("DENOISE_CHUNK_SECONDS", "30"))
+OVERLAP_SECONDS = float(os.getenv("DENOISE_OVERLAP_SECONDS", "0.5"))
+
+BLOCK_FRAMES = 1 << 20
+
+# loudnorm's accepted ranges for the measured_* options
+MEASURED_RANGES = {
+    "measured_I": ("input_i", -99.0, 0.0),
+    "measured_TP": ("input_tp", -99.0, 99.0),
+    "measured_LRA": ("input_lra", 0.0, 99.0),
+    "measured_thresh": ("input_thresh", -99.0, 0.0),
+    "offset": ("target_offset", -99.0, 99.0),
+}
+
+
+def loudnorm_filter(measured: dict = None) -> str:
+    """loudnorm's first pass, or with the first pass's report, its second."""
+    options = LOUDNORM
+    if measured is None:
+        return f"{options}:print_format=json"
+    for option, (key, low, high) in MEASURED_RANGES.items():
+        options += f":{option}={min(max(measured[key], low), high):.2f}"
+    return f"{options}:linear=true:print_format=none"
+
+
+def params():
+    """The settings that change enhance() output, for cache keys."""
+    return {
+        "engine": "chunked",
+        "filter": f"{NOISE_FILTER},{LOUDNORM}:linear=true",
+        "chunk_seconds": CHUNK_SECONDS,
+        "overlap_seconds": OVERLAP_SECONDS,
+    }
+
+
+def _filter_chunk(block):
+    """Runs one (frames, channels) float block through NOISE_FILTER."""
+    result = subprocess.run([
+        "ffmpeg", "-v", "error",
+        "-f", "f32le", "-ar", str(SAMPLE_RATE), "-ac", str(CHANNELS), "-i", "pipe:0",
+        "-af", NOISE_FILTER,
+        "-f", "f32le", "pipe:1"
+    ], input=np.ascontiguousarray(block, dtype="<f4").tobytes(), stdout=subprocess.PIPE, check=True)
+
+    out = np.frombuffer(result.stdout, dtype="<f4").reshape(-1, CHANNELS)
+    # The filter keeps the length, but never trust a seam to it
+    if len(out) < len(block):
+        out = np.concatenate([out, np.zeros((len(block) - len(out), CHANNELS), dtype="<f4")])
+    return out[:len(block)]
+
+
+def measure_loudness(raw_path: str) -> dict:
+    """
+    loudnorm's first pass over a float32 file: input_i, input_tp,
+    input_lra, input_thresh and target_offset, as floats.
+    """
+    result = subprocess.run([
+        "ffmpeg", "-hide_banner", "-nostats",
+        "-f", "f32le", "-ar", str(SAMPLE_RATE), "-ac", str(CHANNELS), "-i", raw_path,
+        "-af", loudnorm_filter(),
+        "-f", "null", "-"
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+
+    # The report is the last JSON object on stderr
+    found = re.findall(r"\{[^{}]*\}", result.stderr)
+    if not found:
+        raise RuntimeError("loudnorm printed no measurement")
+    return {key: float(value) for key, value in json.loads(found[-1]).items() if key.startswith(("input_", "target_"))}
+
+
+def _is_silent(measured: dict) -> bool:
+    # Nothing to measure, nothing to raise
+    return not np.isfinite(measured["input_i"]) or measured["input_i"] <= -70
+
+
+def _normalized_blocks(raw_path: str, measured: dict):
+    """
+    loudnorm's second pass over a float32 file, as (frames, channels)
+    blocks of float32 at SAMPLE_RATE.
+    """
+    process = subprocess.Popen([
+        "ffmpeg", "-v", "error",
+        "-f", "f32le", "-ar", str(SAMPLE_RATE), "-ac", str(CHANNELS), "-i", raw_path,
+        # loudnorm works at 192 kHz for its true peak limiter
+        "-af", f"{loudnorm_filter(measured)},aresample={SAMPLE_RATE}",
+        "-f", "f32le", "-ar", str(SAMPLE_RATE), "-ac", str(CHANNELS), "pipe:1"
+    ], stdout=subprocess.PIPE)
+    try:
+        while True:
+            data = process.stdout.read(BLOCK_FRAMES * CHANNELS * 4)
+            if not data:
+                break
+            usable = len(data) - len(data) % (CHANNELS * 4)
+            yield np.frombuffer(data[:usable], dtype="<f4").reshape(-1, CHANNELS)
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, "ffmpeg loudnorm")
+
+
+def enhance(input_audio: str, output_path: str, jobs: int = None) -> str:
+    """
+    Denoises and loudness-normalizes input_audio into a 44.1 kHz stereo
+    24-bit WAV at output_path, with its waveform peak index.
+    """
+    jobs = jobs or DENOISE_JOBS
+    work_dir = os.path.dirname(output_path) or "."
+    stem = os.path.splitext(os.path.basename(output_path))[0]
+    raw_path = os.path.join(work_dir, f"{stem}.input.f32")
+    denoised_path = os.path.join(work_dir, f"{stem}.denoised.f32")
+
+    try:
+        mix = decode_f32(input_audio, raw_path, SAMPLE_RATE, CHANNELS)
+        chunk_frames = int(CHUNK_SECONDS * SAMPLE_RATE)
+        overlap = min(int(OVERLAP_SECONDS * SAMPLE_RATE), chunk_frames // 2)
+        bounds = chunk_bounds(len(mix), chunk_frames, overlap)
+        run_chunk = bind_stages(lambda span: _filter_chunk(mix[span[0]:span[1]]))
+
+        with open(denoised_path, "wb") as denoised:
+            fade_in = np.linspace(0.0, 1.0, overlap, dtype=np.float32)[:, None]
+            tail = None
+            with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="denoise") as pool:
+                # map() hands results back in order, which the crossfade needs
+                for i, out in enumerate(pool.map(run_chunk, bounds)):
+                    out = out.copy()
+                    if tail is not None:
+                        out[:overlap] = tail * (1.0 - fade_in) + out[:overlap] * fade_in
+                    last = i == len(bounds) - 1
+                    keep = len(out) if last else len(out) - overlap
+                    denoised.write(out[:keep].astype("<f4").tobytes())
+                    tail = None if last else out[keep:]
+        mix = None
+        os.remove(raw_path)
+
+        if not os.path.getsize(denoised_path):
+            blocks = []
+        else:
+            measured = measure_loudness(denoised_path)
+            if _is_silent(measured):
+                samples = np.memmap(denoised_path, dtype="<f4", mode="r").reshape(-1, CHANNELS)
+                blocks = (samples[start:start + BLOCK_FRAMES] for start in range(0, len(samples), BLOCK_FRAMES))
+            else:
+                blocks = _normalized_blocks(denoised_path, measured)
+
+        peaks = PeakBuilder(SAMPLE_RATE)
+        with wave.open(output_path, "wb") as out:
+            out.setnchannels(CHANNELS)
+            out.setsampwidth(3)
+            out.setframerate(SAMPLE_RATE)
+            for block in blocks:
+                out.writeframesraw(to_int24(block))
+                peaks.add(block)
+        blocks = samples = None
+        peaks.write(peaks_path(output_path))
+    finally:
+        mix = None
+        for path in (raw_path, denoised_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Denoise and loudness-normalize a recording in parallel chunks.")
+    parser.add_argument("input", help="audio file")
+    parser.add_argument("output", help="24-bit WAV to write")
+    parser.add_argument("--jobs", type=int, help="ffmpeg processes at once")
+    args = parser.parse_args()
+
+    print(enhance(args.input, args.output, jobs=args.jobs))
+
+
+if __name__ == "__main__":
+    main()
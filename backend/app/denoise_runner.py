@@ -2,7 +2,27 @@ import os
 import subprocess
 import uuid
 
-def run_denoise(input_audio: str, output_base: str = "outputs/enhanced"):
+from app.peaks import build_peaks
+from app.denoise_engine import enhance, params as engine_params
+
+# FFmpeg Filter Chain:
+# 1. afftdn=nf=-25: Noise Floor reduction (-25dB)
+# 2. loudnorm: Professional Loudness Normalization (EBU R128)
+DENOISE_FILTER = "afftdn=nf=-25,loudnorm"
+
+# "chunked" denoises in parallel pieces and normalizes in two passes
+# (app.denoise_engine), "ffmpeg" is the legacy single serial process
+# kept for comparison.
+DENOISE_ENGINE = os.getenv("DENOISE_ENGINE", "chunked")
+
+
+def params():
+    """The settings that change denoise_file() output, for cache keys."""
+    if DENOISE_ENGINE == "chunked":
+        return engine_params()
+    return {"engine": DENOISE_ENGINE, "filter": DENOISE_FILTER}
+
+def run_denoise(input_audio: str, output_base: str = "outputs/enhanced", job_id: str = None):
     """
     Runs FFmpeg Noise Reduction and Loudness Normalization.
     Creates a specific job folder to make zipping easier.
@@ -10,8 +30,8 @@ def run_denoise(input_audio: str, output_base: str = "outputs/enhanced"):
     if not os.path.exists(input_audio):
         raise FileNotFoundError(f"Audio not found: {input_audio}")
 
-    # Generate unique Job ID
-    job_id = f"clean_{uuid.uuid4().hex[:8]}"
+    # Generate unique Job ID unless the caller already has one
+    job_id = job_id or f"clean_{uuid.uuid4().hex[:8]}"
     
     # Create a specific folder for this job: outputs/enhanced/{job_id}
     job_dir = os.path.join(output_base, job_id)
@@ -25,13 +45,22 @@ def run_denoise(input_audio: str, output_base: str = "outputs/enhanced"):
 
     print(f"Running Audio Enhancement on {input_audio}...")
 
-    # FFmpeg Filter Chain:
-    # 1. afftdn=nf=-25: Noise Floor reduction (-25dB)
-    # 2. loudnorm: Professional Loudness Normalization (EBU R128)
+    denoise_file(input_audio, output_path)
+
+    return output_path, job_id
+
+
+def denoise_file(input_audio: str, output_path: str):
+    if DENOISE_ENGINE == "chunked":
+        return enhance(input_audio, output_path)
+    return denoise_serial(input_audio, output_path)
+
+
+def denoise_serial(input_audio: str, output_path: str):
     command = [
         "ffmpeg", "-y",
         "-i", input_audio,
-        "-af", "afftdn=nf=-25,loudnorm",
+        "-af", DENOISE_FILTER,
         "-ac", "2",           # Stereo
         "-ar", "44100",       # 44.1kHz
         "-c:a", "pcm_s24le",  # 24-bit WAV
@@ -39,5 +68,5 @@ def run_denoise(input_audio: str, output_base: str = "outputs/enhanced"):
     ]
 
     subprocess.run(command, check=True)
-
-    return output_path, job_id
\ No newline at end of file
+    build_peaks(output_path)
+    return output_path
@@ -1,31 +1,261 @@
 import os
-import torch
+import json
+import numpy as np
 from dotenv import load_dotenv
-from pyannote.audio import Pipeline
 
-torch.backends.cuda.matmul.allow_tf32 = True
-torch.backends.cudnn.allow_tf32 = True
+from app.audio_utils import read_wav_memmap
+from app.models import checkout, DIARIZATION_MODEL, MODEL_REPLICAS
 
 load_dotenv()
 HF_TOKEN = os.getenv("HF_TOKEN")
 
-pipeline = Pipeline.from_pretrained(
-    "pyannote/speaker-diarization",
-    use_auth_token=HF_TOKEN
-)
+# Recordings longer than this are diarized window by window so peak
+# memory no longer grows with the length of the input.
+LONGFORM_THRESHOLD_SECONDS = float(os.getenv("DIARIZATION_LONGFORM_THRESHOLD", "1800"))
+WINDOW_SECONDS = float(os.getenv("DIARIZATION_WINDOW_SECONDS", "600"))
+WINDOW_OVERLAP_SECONDS = float(os.getenv("DIARIZATION_WINDOW_OVERLAP_SECONDS", "30"))
 
-DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-pipeline.to(DEVICE)
+# Sliding-window chunks per forward pass. Larger batches keep all CPU
+# cores busy during segmentation and embedding inference.
+INFERENCE_BATCH_SIZE = int(os.getenv("DIARIZATION_BATCH_SIZE", "32"))
 
-def run_diarization(audio_path: str):
-    diarization = pipeline(audio_path)
+# Cosine distance under which two window-level speakers are the same person
+SPEAKER_MERGE_THRESHOLD = float(os.getenv("DIARIZATION_SPEAKER_THRESHOLD", "0.5"))
 
+
+def load_pipeline():
+    # torch and pyannote are only imported by the process that runs the model
+    import torch
+    from pyannote.audio import Pipeline
+
+    replicas = MODEL_REPLICAS["diarization"]
+    if replicas > 1:
+        # Replicas run side by side; each gets its share of the cores
+        # rather than all of them (this also applies to the other models)
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // replicas))
+
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+
+    pipeline = Pipeline.from_pretrained(
+        DIARIZATION_MODEL,
+        use_auth_token=HF_TOKEN
+    )
+
+    pipeline.segmentation_batch_size = INFERENCE_BATCH_SIZE
+    pipeline.embedding_batch_size = INFERENCE_BATCH_SIZE
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    pipeline.to(device)
+    return pipeline
+
+
+def _segments_from_annotation(diarization, offset=0.0, labels=None):
     segments = []
     for turn, _, speaker in diarization.itertracks(yield_label=True):
         segments.append({
-            "speaker": speaker,
-            "start": round(float(turn.start), 2),
-            "end": round(float(turn.end), 2)
+            "speaker": labels[speaker] if labels else speaker,
+            "start": round(float(turn.start) + offset, 2),
+            "end": round(float(turn.end) + offset, 2)
         })
-
     return segments
+
+
+def _windows(total_frames: int, sample_rate: int):
+    """
+    Yields (start, end, core_start, core_end) in frames. Windows overlap
+    by WINDOW_OVERLAP_SECONDS and each keeps only the turns inside its
+    core, which meets the neighbouring core in the middle of the overlap.
+    """
+    size = int(WINDOW_SECONDS * sample_rate)
+    overlap = int(WINDOW_OVERLAP_SECONDS * sample_rate)
+    step = max(size - overlap, 1)
+
+    start = 0
+    while True:
+        end = min(start + size, total_frames)
+        last = end >= total_frames
+        core_start = start + overlap // 2 if start > 0 else 0
+        core_end = total_frames if last else end - overlap // 2
+        yield start, end, core_start, core_end
+        if last:
+            break
+        start += step
+
+
+def _usable(embedding) -> bool:
+    # NaN for speakers too short to embed; all zeros has no direction either
+    return not np.isnan(embedding).any() and np.linalg.norm(embedding) > 0
+
+
+class _OnlineSpeakers:
+    """
+    Running per-speaker centroids, so each window's local labels can be
+    mapped onto stable provisional labels as soon as it finishes.
+    """
+
+    def __init__(self):
+        self.centroids = []
+
+    def assign(self, embedding) -> int:
+        if not _usable(embedding):
+            self.centroids.append(None)
+            return len(self.centroids) - 1
+
+        unit = embedding / np.linalg.norm(embedding)
+        best, best_distance = None, SPEAKER_MERGE_THRESHOLD
+        for i, centroid in enumerate(self.centroids):
+            if centroid is None:
+                continue
+            distance = 1.0 - float(centroid @ unit) / float(np.linalg.norm(centroid))
+            if distance < best_distance:
+                best, best_distance = i, distance
+
+        if best is None:
+            self.centroids.append(unit)
+            return len(self.centroids) - 1
+
+        self.centroids[best] = self.centroids[best] + unit
+        return best
+
+
+def _cluster_globally(embeddings):
+    """
+    Agglomerative clustering of every window-level speaker embedding.
+    Returns one cluster index per row.
+    """
+    from scipy.cluster.hierarchy import linkage, fcluster
+
+    valid = [i for i, e in enumerate(embeddings) if _usable(e)]
+    clusters = list(range(len(embeddings)))
+    if len(valid) < 2:
+        return clusters
+
+    tree = linkage(np.stack([embeddings[i] for i in valid]), method="average", metric="cosine")
+    flat = fcluster(tree, t=SPEAKER_MERGE_THRESHOLD, criterion="distance")
+
+    offset = len(embeddings)
+    for i, label in zip(valid, flat):
+        clusters[i] = offset + int(label)
+    return clusters
+
+
+def _merge_touching(segments):
+    """Joins turns that were split only because they crossed a window edge."""
+    by_speaker = {}
+    for seg in sorted(segments, key=lambda s: s["start"]):
+        turns = by_speaker.setdefault(seg["speaker"], [])
+        if turns and seg["start"] <= turns[-1]["end"]:
+            turns[-1]["end"] = max(turns[-1]["end"], seg["end"])
+        else:
+            turns.append(dict(seg))
+
+    merged = [seg for turns in by_speaker.values() for seg in turns]
+    return sorted(merged, key=lambda s: s["start"])
+
+
+def _speaker_embeddings(diarization, centroids):
+    # NaN centroids belong to speakers too short to embed
+    return {
+        label: [float(x) for x in centroid]
+        for label, centroid in zip(diarization.labels(), centroids)
+        if not np.isnan(centroid).any()
+    }
+
+
+def run_diarization_windowed(audio_path: str, partial_path: str = None, return_embeddings: bool = False):
+    """
+    Long-form diarization: runs the pipeline on overlapping windows read
+    from a memory map, then links speakers across windows by clustering
+    their embeddings globally.
+
+    If partial_path is given, each window's segments (with provisional
+    labels) are appended to it as a JSON line as soon as it completes.
+    """
+    with checkout("diarization") as pipeline:
+        return _run_windowed(pipeline, audio_path, partial_path, return_embeddings)
+
+
+def _run_windowed(pipeline, audio_path, partial_path, return_embeddings):
+    import torch
+
+    samples, sample_rate = read_wav_memmap(audio_path)
+    total_frames = samples.shape[0]
+
+    online = _OnlineSpeakers()
+    online_ids = []
+    embeddings = []
+    window_segments = []
+
+    for start, end, core_start, core_end in _windows(total_frames, sample_rate):
+        chunk = np.asarray(samples[start:end], dtype=np.float32).T / 32768.0
+        diarization, centroids = pipeline(
+            {"waveform": torch.from_numpy(chunk), "sample_rate": sample_rate},
+            return_embeddings=True
+        )
+
+        labels = {}
+        for local, embedding in zip(diarization.labels(), centroids):
+            labels[local] = len(embeddings)
+            embeddings.append(embedding)
+            online_ids.append(online.assign(embedding))
+
+        offset = start / sample_rate
+        lo, hi = core_start / sample_rate, core_end / sample_rate
+        segments = []
+        for seg in _segments_from_annotation(diarization, offset, labels):
+            seg["start"], seg["end"] = max(seg["start"], lo), min(seg["end"], hi)
+            if seg["end"] > seg["start"]:
+                segments.append(seg)
+        window_segments.extend(segments)
+
+        if partial_path:
+            provisional = [
+                {**s, "speaker": f"SPEAKER_{online_ids[s['speaker']]:02d}"}
+                for s in segments
+            ]
+            with open(partial_path, "a") as f:
+                f.write(json.dumps(provisional) + "\n")
+
+        del chunk, diarization
+
+    clusters = _cluster_globally(embeddings)
+
+    # Name final speakers in order of first appearance, like pyannote does
+    names = {}
+    for seg in sorted(window_segments, key=lambda s: s["start"]):
+        cluster = clusters[seg["speaker"]]
+        if cluster not in names:
+            names[cluster] = f"SPEAKER_{len(names):02d}"
+        seg["speaker"] = names[cluster]
+
+    segments = _merge_touching(window_segments)
+    if not return_embeddings:
+        return segments
+
+    # A speaker's voiceprint is the mean direction of its window-level ones
+    members = {}
+    for index, embedding in enumerate(embeddings):
+        if clusters[index] in names and _usable(embedding):
+            members.setdefault(names[clusters[index]], []).append(embedding / np.linalg.norm(embedding))
+    speaker_embeddings = {
+        name: [float(x) for x in np.mean(vectors, axis=0)]
+        for name, vectors in members.items()
+    }
+    return segments, speaker_embeddings
+
+
+def run_diarization(audio_path: str, partial_path: str = None, return_embeddings: bool = False):
+    """
+    Returns the speaker turns, or (turns, {speaker: embedding}) with
+    return_embeddings.
+    """
+    samples, sample_rate = read_wav_memmap(audio_path)
+    if samples.shape[0] / sample_rate > LONGFORM_THRESHOLD_SECONDS:
+        return run_diarization_windowed(audio_path, partial_path, return_embeddings)
+
+    with checkout("diarization") as pipeline:
+        if not return_embeddings:
+            return _segments_from_annotation(pipeline(audio_path))
+        diarization, centroids = pipeline(audio_path, return_embeddings=True)
+    return _segments_from_annotation(diarization), _speaker_embeddings(diarization, centroids)
@@ -0,0 +1,200 @@
+import os
+import sys
+import socket
+import ipaddress
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.connection import Client, Listener
+
+from app import models
+
+# One process owns the models, so web processes never import torch and
+# concurrent jobs share a single copy of the weights.
+#
+# With INFERENCE_ADDRESS set ("host:port" or a unix socket path), every
+# web worker calls into the server started by `python -m app.inference`.
+# Without it, each web process spawns its own private model process.
+INFERENCE_ADDRESS = os.getenv("INFERENCE_ADDRESS")
+# Connections carry pickles, so whoever has the key can run code in the
+# server. The built-in default is public: fine on loopback or a unix
+# socket, refused anywhere else (see serve()).
+DEFAULT_AUTHKEY = "voice-separation"
+INFERENCE_AUTHKEY = os.getenv("INFERENCE_AUTHKEY", DEFAULT_AUTHKEY).encode()
+
+_executor = None
+_lock = threading.Lock()
+# Local mode: model stats as of the model process's last finished call,
+# so /models never queues behind a running job
+_local_stats = None
+
+
+# --- Tasks, executed inside the model process ---
+
+def _diarize(audio_path: str, partial_path: str = None, return_embeddings: bool = False):
+    from app.diarization import run_diarization
+    return run_diarization(audio_path, partial_path, return_embeddings)
+
+
+def _separate_music(input_audio: str, output_dir: str):
+    from app.demucs_engine import separate
+    return separate(input_audio, output_dir)
+
+
+TASKS = {
+    "diarize": _diarize,
+    "separate_music": _separate_music,
+    "warm_up": models.warm_up,
+    "model_stats": models.model_stats,
+}
+
+# A model is not safe to call from several threads at once, but two
+# different models are: a song being separated must not hold up
+# diarization. Diarization takes its own replica from models.checkout(),
+# so up to MODEL_REPLICAS files run at once. Stats reads never queue
+# behind anything.
+_task_locks = {task: threading.Lock() for task in TASKS}
+LOCK_FREE_TASKS = {"model_stats", "diarize"}
+
+
+def _run_task(task: str, args: tuple):
+    if task in LOCK_FREE_TASKS:
+        return TASKS[task](*args)
+    with _task_locks[task]:
+        return TASKS[task](*args)
+
+
+def _run_local_task(task: str, args: tuple):
+    try:
+        return _run_task(task, args), models.model_stats()
+    except Exception as e:
+        # Attach the stats anyway: the model may have loaded before failing
+        e.model_stats = models.model_stats()
+        raise
+
+
+# --- Client side ---
+
+def _parse_address(address: str):
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return host or "127.0.0.1", int(port)
+    return address
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=1,
+                # fork is unsafe once CUDA has been initialised
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+def _call_local(task: str, args: tuple):
+    global _executor, _local_stats
+    try:
+        value, _local_stats = _get_executor().submit(_run_local_task, task, args).result()
+        return value
+    except BrokenProcessPool:
+        # The model process died (usually OOM). Start a fresh one for the
+        # next job instead of failing every job from now on.
+        with _lock:
+            _executor = None
+            _local_stats = None
+        raise
+    except Exception as e:
+        _local_stats = getattr(e, "model_stats", _local_stats)
+        raise
+
+
+def _call_remote(task: str, args: tuple):
+    with Client(_parse_address(INFERENCE_ADDRESS), authkey=INFERENCE_AUTHKEY) as conn:
+        conn.send((task, args))
+        status, value = conn.recv()
+
+    if status == "error":
+        raise RuntimeError(f"Inference server: {value}")
+    return value
+
+
+def _call(task: str, *args):
+    if INFERENCE_ADDRESS:
+        return _call_remote(task, args)
+    return _call_local(task, args)
+
+
+def diarize(audio_path: str, partial_path: str = None, return_embeddings: bool = False):
+    return _call("diarize", audio_path, partial_path, return_embeddings)
+
+
+def separate_music(input_audio: str, output_dir: str):
+    """Returns {stem: path} for the stems written to output_dir."""
+    return _call("separate_music", input_audio, output_dir)
+
+
+def warm_up(names=None):
+    return _call("warm_up", names)
+
+
+def model_stats():
+    if INFERENCE_ADDRESS:
+        return _call_remote("model_stats", ())
+    if _local_stats is None:
+        # No model process yet, or a fresh one: nothing is loaded
+        return {name: {"loaded": False} for name in models.MODEL_LOADERS}
+    return _local_stats
+
+
+# --- Server side ---
+
+def _handle(conn):
+    with conn:
+        try:
+            task, args = conn.recv()
+            conn.send(("ok", _run_task(task, args)))
+        except EOFError:
+            pass
+        except Exception as e:
+            traceback.print_exc()
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+def _is_loopback(address) -> bool:
+    if isinstance(address, str):
+        # A unix socket, guarded by file permissions
+        return True
+    host = address[0]
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except socket.gaierror:
+        return False
+    return all(ipaddress.ip_address(info[4][0]).is_loopback for info in infos)
+
+
+def serve(address: str):
+    if not _is_loopback(_parse_address(address)) and INFERENCE_AUTHKEY == DEFAULT_AUTHKEY.encode():
+        raise SystemExit(
+            f"Refusing to listen on {address} with the default key; set INFERENCE_AUTHKEY"
+        )
+    models.warm_up()
+
+    with Listener(_parse_address(address), authkey=INFERENCE_AUTHKEY) as listener:
+        print(f"Inference server listening on {address}")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception:
+                # A client that fails the auth handshake must not kill us
+                traceback.print_exc()
+                continue
+            threading.Thread(target=_handle, args=(conn,), daemon=True).start()
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1] if len(sys.argv) > 1 else INFERENCE_ADDRESS or "127.0.0.1:6000")
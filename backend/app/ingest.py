@@ -0,0 +1,254 @@
+import os
+import hashlib
+import subprocess
+
+from starlette.concurrency import run_in_threadpool
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from app.audio_utils import normalize_command
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "4096")) * 1024 * 1024
+FILE_FIELD = "file"
+
+# Containers that may keep their index at the end of the file. ffmpeg
+# cannot demux those from a pipe, so they are spooled to disk first.
+NEEDS_SEEKABLE_INPUT = {".mp4", ".m4a", ".m4b", ".mov", ".3gp"}
+
+
+class UploadError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class FileSink:
+    """Writes the upload to disk unchanged."""
+
+    normalized = False
+
+    def __init__(self, path: str):
+        self.path = path
+        self._f = open(path, "wb")
+
+    def write(self, data: bytes):
+        self._f.write(data)
+
+    def close(self):
+        self._f.close()
+
+    def abort(self):
+        self._f.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class NormalizeSink:
+    """Pipes the upload straight into ffmpeg, which writes 16 kHz mono PCM."""
+
+    normalized = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._proc = subprocess.Popen(
+            normalize_command("pipe:0", path),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+
+    def write(self, data: bytes):
+        try:
+            self._proc.stdin.write(data)
+        except BrokenPipeError:
+            # ffmpeg bailed out, almost always because it can't decode it
+            self.abort()
+            raise UploadError(400, "Could not decode uploaded audio")
+
+    def close(self):
+        self._proc.stdin.close()
+        if self._proc.wait() != 0:
+            self.abort()
+            raise UploadError(400, "Could not decode uploaded audio")
+
+    def abort(self):
+        if self._proc.poll() is None:
+            self._proc.kill()
+            self._proc.wait()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def open_normalizing_sink(normalized_path: str, raw_dir: str, stem: str):
+    """
+    Sink factory for the speech pipeline: normalize on the fly when the
+    container allows it, otherwise fall back to spooling the raw file
+    as raw_dir/<stem><ext>, so concurrent uploads of one name stay apart.
+    """
+    def open_sink(filename: str):
+        ext = os.path.splitext(filename)[1].lower()
+        if ext in NEEDS_SEEKABLE_INPUT:
+            return FileSink(os.path.join(raw_dir, stem + ext))
+        return NormalizeSink(normalized_path)
+    return open_sink
+
+
+def open_file_sink(upload_dir: str, stem: str = None):
+    """
+    Keeps the client's file name unless stem is given, in which case
+    only its extension survives (so same-named uploads can't collide).
+    """
+    def open_sink(filename: str):
+        if stem:
+            filename = stem + os.path.splitext(filename)[1].lower()
+        return FileSink(os.path.join(upload_dir, filename))
+    return open_sink
+
+
+class _Part:
+    def __init__(self, filename: str, sink):
+        self.filename = filename
+        self.sink = sink
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > MAX_UPLOAD_BYTES:
+            raise UploadError(413, f"Upload too large: {self.filename}")
+        self.digest.update(data)
+        self.sink.write(data)
+
+    def result(self):
+        return {
+            "filename": self.filename,
+            "path": self.sink.path,
+            "normalized": self.sink.normalized,
+            "content_hash": self.digest.hexdigest(),
+            "size": self.size,
+        }
+
+
+async def receive_uploads(request, open_sink, field: str = FILE_FIELD, max_files: int = 1):
+    """
+    Streams every `field` file part of a multipart request into the sink
+    returned by open_sink(filename), hashing and size-limiting as the
+    bytes arrive. Nothing is buffered beyond one network chunk.
+
+    Returns one dict(filename, path, normalized, content_hash, size)
+    per file, in upload order.
+    """
+    content_type = request.headers.get("content-type", "")
+    media_type, options = parse_options_header(content_type)
+    if media_type != b"multipart/form-data" or b"boundary" not in options:
+        raise UploadError(400, "Expected a multipart/form-data upload")
+
+    state = {"header_field": b"", "header_value": b"", "headers": {}, "in_file": False}
+    # Parser callbacks only record events; the blocking sink work
+    # happens in flush(), off the event loop
+    events = []
+    file_count = 0
+
+    def on_part_begin():
+        state["headers"] = {}
+        state["in_file"] = False
+
+    def on_header_field(data, start, end):
+        state["header_field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["header_value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["header_field"].lower()] = state["header_value"]
+        state["header_field"] = b""
+        state["header_value"] = b""
+
+    def on_headers_finished():
+        nonlocal file_count
+        _, disposition = parse_options_header(
+            state["headers"].get(b"content-disposition")
+        )
+        name = disposition.get(b"name", b"").decode("utf-8", "replace")
+        filename = disposition.get(b"filename")
+
+        if name != field or not filename:
+            return
+
+        file_count += 1
+        if file_count > max_files:
+            raise UploadError(400, f"At most {max_files} file(s) per request")
+
+        # Never trust a client-supplied path
+        filename = os.path.basename(
+            filename.decode("utf-8", "replace").replace("\\", "/")
+        ) or "upload"
+        events.append(("open", filename))
+        state["in_file"] = True
+
+    def on_part_data(data, start, end):
+        if state["in_file"]:
+            events.append(("data", bytes(data[start:end])))
+
+    def on_part_end():
+        if state["in_file"]:
+            events.append(("close", None))
+        state["in_file"] = False
+
+    parser = MultipartParser(options[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    parts = []
+    current = None
+
+    def flush(batch):
+        nonlocal current
+        for kind, value in batch:
+            if kind == "open":
+                current = _Part(value, open_sink(value))
+                parts.append(current)
+            elif kind == "data":
+                current.write(value)
+            else:
+                current.sink.close()
+                current = None
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if events:
+                batch = events[:]
+                events.clear()
+                # Pipe writes block while ffmpeg catches up
+                await run_in_threadpool(flush, batch)
+        parser.finalize()
+        if events:
+            await run_in_threadpool(flush, events[:])
+    except Exception:
+        for part in parts:
+            part.sink.abort()
+        raise
+
+    if not parts:
+        raise UploadError(400, f"Missing '{field}' field")
+    if current is not None:
+        current.sink.abort()
+        raise UploadError(400, "Upload ended before the file was complete")
+
+    return [part.result() for part in parts]
+
+
+async def receive_upload(request, open_sink):
+    """Single-file variant of receive_uploads for the FILE_FIELD part."""
+    return (await receive_uploads(request, open_sink))[0]
@@ -0,0 +1,434 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# One row per job plus one per output file, written when the job is
+# created and when it finishes. Everything that used to find a job by
+# stat()ing candidate folders asks here instead. WAL lets the status
+# endpoints read while a worker thread writes.
+
+JOB_DB = os.getenv("JOB_DB", "outputs/jobs.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    mode TEXT NOT NULL,
+    status TEXT NOT NULL,
+    artifact_dir TEXT,
+    total_bytes INTEGER NOT NULL DEFAULT 0,
+    audio_seconds REAL,
+    processing_seconds REAL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    last_accessed_at REAL,
+    updated_at REAL NOT NULL
+);
+-- job_id breaks ties in created_at, so keyset pages never skip a row
+CREATE INDEX IF NOT EXISTS jobs_by_created ON jobs (created_at, job_id);
+CREATE INDEX IF NOT EXISTS jobs_by_mode ON jobs (mode, created_at, job_id);
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created_at, job_id);
+CREATE INDEX IF NOT EXISTS jobs_by_finished ON jobs (finished_at);
+CREATE INDEX IF NOT EXISTS jobs_by_last_access ON jobs (last_accessed_at);
+
+CREATE TABLE IF NOT EXISTS artifacts (
+    job_id TEXT NOT NULL REFERENCES jobs (job_id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    duration_seconds REAL,
+    PRIMARY KEY (job_id, path)
+);
+CREATE INDEX IF NOT EXISTS artifacts_by_path ON artifacts (path);
+
+-- Everything on disk a job owns (upload, work folder, outputs), which
+-- the storage manager deletes together
+CREATE TABLE IF NOT EXISTS job_paths (
+    job_id TEXT NOT NULL REFERENCES jobs (job_id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    PRIMARY KEY (job_id, path)
+);
+CREATE INDEX IF NOT EXISTS job_paths_by_path ON job_paths (path);
+"""
+
+# Where jobs from before the job store left their files, as (mode,
+# folder, artifact kind), in the order the old download-all probed them
+LEGACY_FOLDERS = [
+    ("speech", "outputs/jobs/{}/speakers", "speaker"),
+    ("music", "outputs/demucs/htdemucs/{}", "stem"),
+    ("music", "outputs/demucs/htdemucs_ft/{}", "stem"),
+    ("clean", "outputs/enhanced/{}", "enhanced"),
+    ("speech", "outputs/jobs/{}/final", "speaker"),
+    ("music", "outputs/demucs/{}", "stem"),
+]
+
+# Columns update_job() may touch
+UPDATABLE = {
+    "status", "artifact_dir", "audio_seconds", "processing_seconds",
+    "result", "error", "started_at", "finished_at",
+}
+
+_local = threading.local()
+
+
+def _db() -> sqlite3.Connection:
+    # sqlite3 connections must stay on the thread that made them
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(JOB_DB) or ".", exist_ok=True)
+        conn = sqlite3.connect(JOB_DB, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+@contextmanager
+def _transaction():
+    conn = _db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def create_job(job_id: str, mode: str, status: str = "queued", created_at: float = None, **fields):
+    """Inserts the job unless it already exists (e.g. a cache hit on it)."""
+    now = time.time()
+    row = {"status": status, "created_at": created_at or now, "updated_at": now}
+    row.update({k: v for k, v in fields.items() if k in UPDATABLE})
+    if isinstance(row.get("result"), dict):
+        row["result"] = json.dumps(row["result"])
+
+    columns = ["job_id", "mode", *row]
+    _db().execute(
+        f"INSERT OR IGNORE INTO jobs ({', '.join(columns)}) "
+        f"VALUES ({', '.join('?' * len(columns))})",
+        (job_id, mode, *row.values())
+    )
+
+
+def update_job(job_id: str, **fields):
+    fields = {k: v for k, v in fields.items() if k in UPDATABLE}
+    if isinstance(fields.get("result"), dict):
+        fields["result"] = json.dumps(fields["result"])
+    if fields.get("finished_at"):
+        # Expiry counts from the later of finishing and the last download
+        fields["last_accessed_at"] = fields["finished_at"]
+    fields["updated_at"] = time.time()
+
+    assignments = ", ".join(f"{k} = ?" for k in fields)
+    _db().execute(
+        f"UPDATE jobs SET {assignments} WHERE job_id = ?",
+        (*fields.values(), job_id)
+    )
+
+
+def record_artifacts(
+    job_id: str,
+    mode: str,
+    artifact_dir: str,
+    files: list,
+    audio_seconds: float = None,
+    owned_paths: list = ()
+):
+    """
+    Replaces the job's artifact list. files holds (path, kind, duration)
+    tuples; sizes and mtimes are read once here so zips never stat again.
+    artifact_dir and owned_paths are deleted with the job.
+    """
+    now = time.time()
+    rows = []
+    for path, kind, duration in files:
+        stat = os.stat(path)
+        rows.append((job_id, os.path.normpath(path), kind, stat.st_size, stat.st_mtime, duration))
+
+    with _transaction() as conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO jobs (job_id, mode, status, created_at, updated_at) "
+            "VALUES (?, ?, 'running', ?, ?)",
+            (job_id, mode, now, now)
+        )
+        conn.execute("DELETE FROM artifacts WHERE job_id = ?", (job_id,))
+        conn.executemany(
+            "INSERT INTO artifacts (job_id, path, kind, size_bytes, mtime, duration_seconds) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        conn.execute(
+            "UPDATE jobs SET artifact_dir = ?, total_bytes = ?, "
+            "audio_seconds = COALESCE(?, audio_seconds), updated_at = ? WHERE job_id = ?",
+            (os.path.normpath(artifact_dir), sum(r[3] for r in rows), audio_seconds, now, job_id)
+        )
+        _insert_paths(conn, job_id, [artifact_dir, *owned_paths])
+
+
+def _insert_paths(conn, job_id: str, paths):
+    conn.executemany(
+        "INSERT OR IGNORE INTO job_paths (job_id, path) VALUES (?, ?)",
+        [(job_id, os.path.normpath(p)) for p in paths]
+    )
+
+
+def add_paths(job_id: str, paths: list):
+    with _transaction() as conn:
+        _insert_paths(conn, job_id, paths)
+
+
+def job_paths(job_id: str) -> list:
+    rows = _db().execute("SELECT path FROM job_paths WHERE job_id = ?", (job_id,))
+    return [row["path"] for row in rows]
+
+
+def path_owner(path: str):
+    """The job owning path or anything above it, or None."""
+    path = os.path.normpath(path)
+    candidates = [path]
+    while os.path.dirname(candidates[-1]) not in ("", candidates[-1]):
+        candidates.append(os.path.dirname(candidates[-1]))
+
+    row = _db().execute(
+        f"SELECT job_id FROM job_paths WHERE path IN ({', '.join('?' * len(candidates))}) LIMIT 1",
+        candidates
+    ).fetchone()
+    return row["job_id"] if row else None
+
+
+def touch(job_id: str):
+    _db().execute(
+        "UPDATE jobs SET last_accessed_at = ? WHERE job_id = ?", (time.time(), job_id)
+    )
+
+
+def touch_path(path: str):
+    """Marks the job that produced artifact path as just downloaded."""
+    _db().execute(
+        "UPDATE jobs SET last_accessed_at = ? WHERE job_id IN "
+        "(SELECT job_id FROM artifacts WHERE path = ?)",
+        (time.time(), os.path.normpath(path))
+    )
+
+
+def _job_dict(row) -> dict:
+    job = dict(row)
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def get_job(job_id: str):
+    conn = _db()
+    row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+
+    job = _job_dict(row)
+    job["artifacts"] = [
+        dict(a) for a in conn.execute(
+            "SELECT path, kind, size_bytes, duration_seconds FROM artifacts "
+            "WHERE job_id = ? ORDER BY path",
+            (job_id,)
+        )
+    ]
+    return job
+
+
+def list_jobs(
+    limit: int = 50,
+    before: float = None,
+    before_id: str = None,
+    mode: str = None,
+    status: str = None
+):
+    """
+    Newest first. Pass the previous page's last created_at and job_id as
+    before and before_id to get the next page; each page is one index
+    range scan. before alone still works, but skips the rest of a page
+    boundary's jobs created in the same instant.
+    """
+    clauses, params = [], []
+    if before is not None and before_id is not None:
+        clauses.append("(created_at, job_id) < (?, ?)")
+        params.extend([before, before_id])
+    elif before is not None:
+        clauses.append("created_at < ?")
+        params.append(before)
+    if mode:
+        clauses.append("mode = ?")
+        params.append(mode)
+    if status:
+        clauses.append("status = ?")
+        params.append(status)
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    rows = _db().execute(
+        f"SELECT job_id, mode, status, artifact_dir, total_bytes, audio_seconds, "
+        f"processing_seconds, error, created_at, started_at, finished_at "
+        f"FROM jobs {where} ORDER BY created_at DESC, job_id DESC LIMIT ?",
+        (*params, limit)
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def artifact_dir(job_id: str):
+    row = _db().execute(
+        "SELECT artifact_dir FROM jobs WHERE job_id = ?", (job_id,)
+    ).fetchone()
+    return row["artifact_dir"] if row else None
+
+
+def _legacy_folder(job_id: str):
+    # Job ids come from URLs: never let one walk out of its folder
+    if not job_id or job_id != os.path.basename(job_id) or job_id.startswith("."):
+        return None
+    for mode, template, kind in LEGACY_FOLDERS:
+        folder = template.format(job_id)
+        if os.path.isdir(folder):
+            return mode, folder, kind
+    return None
+
+
+def adopt_legacy_job(job_id: str) -> bool:
+    """
+    Registers a job from before the job store, found in one of
+    LEGACY_FOLDERS, as done with its files as artifacts. False if the
+    job is already known or has no such folder.
+    """
+    if _db().execute("SELECT 1 FROM jobs WHERE job_id = ?", (job_id,)).fetchone():
+        return False
+    found = _legacy_folder(job_id)
+    if found is None:
+        return False
+    mode, folder, kind = found
+
+    files = []
+    for root, dirs, names in os.walk(folder):
+        dirs.sort()
+        files.extend((os.path.join(root, name), kind, None) for name in sorted(names))
+    finished = os.stat(folder).st_mtime
+    now = time.time()
+    with _transaction() as conn:
+        # Counted as just used, so expiry gives it a full JOB_TTL_HOURS
+        conn.execute(
+            "INSERT OR IGNORE INTO jobs (job_id, mode, status, created_at, finished_at, "
+            "last_accessed_at, updated_at) VALUES (?, ?, 'done', ?, ?, ?, ?)",
+            (job_id, mode, finished, finished, now, now)
+        )
+    owned = [os.path.dirname(folder)] if mode == "speech" else []
+    record_artifacts(job_id, mode, folder, files, owned_paths=owned)
+    return True
+
+
+def adopt_legacy_jobs() -> int:
+    """adopt_legacy_job() for every unknown job in LEGACY_FOLDERS; returns how many."""
+    parents = {template.split("/{}")[0] for _, template, _ in LEGACY_FOLDERS}
+    # outputs/demucs/{} would otherwise take the model folders for jobs
+    reserved = {os.path.basename(parent) for parent in parents}
+
+    candidates = set()
+    for parent in parents:
+        if os.path.isdir(parent):
+            candidates.update(
+                entry.name for entry in os.scandir(parent)
+                if entry.is_dir() and entry.name not in reserved
+            )
+    return sum(adopt_legacy_job(job_id) for job_id in sorted(candidates))
+
+
+def zip_entries(job_id: str, prefix: str = "", kind: str = None):
+    """
+    (full_path, arcname, size, mtime) for the job's artifacts, relative
+    to its artifact_dir, ready for iter_zip_stream. None for unknown jobs.
+    """
+    base = artifact_dir(job_id)
+    if base is None:
+        return None
+
+    query = "SELECT path, size_bytes, mtime FROM artifacts WHERE job_id = ?"
+    params = [job_id]
+    if kind:
+        query += " AND kind = ?"
+        params.append(kind)
+
+    entries = []
+    for row in _db().execute(query + " ORDER BY path", params):
+        arcname = os.path.relpath(row["path"], base)
+        if prefix:
+            arcname = os.path.join(prefix, arcname)
+        entries.append((row["path"], arcname.replace(os.sep, "/"), row["size_bytes"], row["mtime"]))
+    return entries
+
+
+def least_recently_used(before: float = None, limit: int = 100):
+    """
+    Finished jobs that still hold files, least recently downloaded first;
+    only those last used before `before` when it is given.
+    """
+    query = (
+        "SELECT job_id, mode, total_bytes, last_accessed_at FROM jobs "
+        "WHERE status IN ('done', 'failed') AND last_accessed_at IS NOT NULL"
+    )
+    params = []
+    if before is not None:
+        query += " AND last_accessed_at < ?"
+        params.append(before)
+    rows = _db().execute(query + " ORDER BY last_accessed_at LIMIT ?", (*params, limit))
+    return [dict(row) for row in rows]
+
+
+def stored_bytes() -> int:
+    """What the jobs' output files add up to, as recorded when they finished."""
+    row = _db().execute("SELECT COALESCE(SUM(total_bytes), 0) AS total FROM jobs").fetchone()
+    return row["total"]
+
+
+def mark_expired(job_id: str):
+    """
+    Forgets the job's files but keeps its row, so listings still show it.
+    """
+    now = time.time()
+    with _transaction() as conn:
+        conn.execute("DELETE FROM artifacts WHERE job_id = ?", (job_id,))
+        conn.execute("DELETE FROM job_paths WHERE job_id = ?", (job_id,))
+        conn.execute(
+            "UPDATE jobs SET status = 'expired', total_bytes = 0, "
+            "last_accessed_at = NULL, updated_at = ? WHERE job_id = ?",
+            (now, job_id)
+        )
+
+
+def delete_job(job_id: str):
+    # Artifacts and paths go with it through ON DELETE CASCADE
+    _db().execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+
+def fail_interrupted():
+    """
+    Marks jobs that were queued or running when the server stopped as
+    failed; their worker threads are gone. Returns [(job_id, mode)] of
+    the jobs it marked.
+    """
+    now = time.time()
+    with _transaction() as conn:
+        interrupted = [
+            (row["job_id"], row["mode"])
+            for row in conn.execute("SELECT job_id, mode FROM jobs WHERE status IN ('queued', 'running')")
+        ]
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', error = 'Interrupted by a server restart', "
+            "finished_at = ?, last_accessed_at = ?, updated_at = ? "
+            "WHERE status IN ('queued', 'running')",
+            (now, now, now)
+        )
+    return interrupted
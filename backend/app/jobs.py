@@ -0,0 +1,241 @@
+import os
+import time
+import uuid
+import heapq
+import itertools
+import threading
+import traceback
+
+from app.metrics import JOBS
+from app import job_store
+
+# Max jobs of each type running at once. Everything above that waits
+# in the executor queue with status "queued".
+JOB_CONCURRENCY = {
+    "speech": int(os.getenv("JOB_CONCURRENCY_SPEECH", "2")),
+    "music": int(os.getenv("JOB_CONCURRENCY_MUSIC", "1")),
+    "clean": int(os.getenv("JOB_CONCURRENCY_CLEAN", "2")),
+    # A batch already fans out over every core by itself
+    "batch": int(os.getenv("JOB_CONCURRENCY_BATCH", "1")),
+}
+
+# Queued jobs run shortest first: a job's place in line is its arrival
+# time pushed back by JOB_SJF_WEIGHT seconds per unit of estimated cost
+# (see app.admission). A long job still runs before anything that
+# arrives after that delay, so it cannot starve.
+JOB_SJF_WEIGHT = float(os.getenv("JOB_SJF_WEIGHT", "1.0"))
+
+FINISHED = ("done", "failed", "expired")
+
+_jobs = {}
+# Incremental results per job, in publish order: (event, data) pairs
+_events = {}
+_executors = {}
+_lock = threading.Lock()
+
+
+def new_job_id(prefix: str = "job") -> str:
+    return f"{prefix}_{uuid.uuid4().hex[:8]}"
+
+
+class _PriorityExecutor:
+    """A fixed pool of threads taking the lowest-keyed call first."""
+
+    def __init__(self, max_workers: int, thread_name_prefix: str):
+        self._queue = []
+        self._order = itertools.count()
+        self._ready = threading.Condition()
+        for i in range(max_workers):
+            threading.Thread(
+                target=self._work, name=f"{thread_name_prefix}_{i}", daemon=True
+            ).start()
+
+    def submit(self, key: float, fn, *args):
+        with self._ready:
+            # The counter keeps equal keys first-come, first-served
+            heapq.heappush(self._queue, (key, next(self._order), fn, args))
+            self._ready.notify()
+
+    def depth(self) -> int:
+        with self._ready:
+            return len(self._queue)
+
+    def _work(self):
+        while True:
+            with self._ready:
+                while not self._queue:
+                    self._ready.wait()
+                _, _, fn, args = heapq.heappop(self._queue)
+            try:
+                fn(*args)
+            except Exception:
+                traceback.print_exc()
+
+
+def _executor(job_type: str) -> _PriorityExecutor:
+    with _lock:
+        if job_type not in _executors:
+            _executors[job_type] = _PriorityExecutor(
+                max_workers=JOB_CONCURRENCY[job_type],
+                thread_name_prefix=f"{job_type}-worker"
+            )
+        return _executors[job_type]
+
+
+def queue_depth() -> dict:
+    """Jobs waiting for a worker, by type."""
+    with _lock:
+        executors = dict(_executors)
+    return {job_type: executor.depth() for job_type, executor in executors.items()}
+
+
+def update_job(job_id: str, **fields):
+    with _lock:
+        job = _jobs[job_id]
+        job.update(fields)
+        job["updated_at"] = time.time()
+        job["version"] += 1
+        snapshot = dict(job)
+
+    # Progress ticks stay in memory; only status changes are persisted
+    if "status" in fields:
+        persisted = {
+            "status": snapshot["status"],
+            "started_at": snapshot["started_at"],
+            "error": snapshot["error"],
+        }
+        if snapshot["status"] in FINISHED:
+            persisted["finished_at"] = snapshot["updated_at"]
+            persisted["result"] = snapshot["result"]
+            if snapshot["started_at"]:
+                persisted["processing_seconds"] = round(
+                    snapshot["updated_at"] - snapshot["started_at"], 3
+                )
+        job_store.update_job(job_id, **persisted)
+
+
+def publish(job_id: str, event: str, data):
+    """
+    Appends an incremental result (e.g. one finished speaker track) to
+    the job's event log, which /jobs/{id}/events replays to clients.
+    """
+    with _lock:
+        _events.setdefault(job_id, []).append((event, data))
+        job = _jobs[job_id]
+        job["updated_at"] = time.time()
+        job["version"] += 1
+
+
+def get_events(job_id: str, since: int = 0) -> list:
+    with _lock:
+        return _events.get(job_id, [])[since:]
+
+
+def _stored_job(job_id: str):
+    # Jobs from before the last restart only exist in the store
+    stored = job_store.get_job(job_id)
+    if stored is None:
+        return None
+
+    done = stored["status"] == "done"
+    return {
+        "job_id": job_id,
+        "type": stored["mode"],
+        "status": stored["status"],
+        "stage": "done" if done else None,
+        "progress": 1.0 if done else 0.0,
+        "result": stored["result"],
+        "error": stored["error"],
+        "created_at": stored["created_at"],
+        "started_at": stored["started_at"],
+        "updated_at": stored["updated_at"],
+        "version": 0,
+    }
+
+
+def get_job(job_id: str):
+    with _lock:
+        job = _jobs.get(job_id)
+        if job:
+            return dict(job)
+    return _stored_job(job_id)
+
+
+def forget_job(job_id: str):
+    """Drops a finished job from memory; the job store still has it."""
+    with _lock:
+        job = _jobs.get(job_id)
+        if job and job["status"] in FINISHED:
+            del _jobs[job_id]
+            _events.pop(job_id, None)
+
+
+def _run(job_id: str, fn, args, kwargs):
+    update_job(job_id, status="running", started_at=time.time())
+
+    def progress(stage: str, fraction: float, **events):
+        update_job(job_id, stage=stage, progress=round(fraction, 3))
+        for event, data in events.items():
+            publish(job_id, event, data)
+
+    try:
+        result = fn(*args, progress=progress, **kwargs)
+    except Exception as e:
+        traceback.print_exc()
+        update_job(job_id, status="failed", error=str(e))
+        JOBS.inc(type=_jobs[job_id]["type"], status="failed")
+        return
+
+    update_job(job_id, status="done", stage="done", progress=1.0, result=result)
+    JOBS.inc(type=_jobs[job_id]["type"], status="done")
+
+
+def _new_job(job_id: str, job_type: str, **fields) -> dict:
+    now = time.time()
+    job = {
+        "job_id": job_id,
+        "type": job_type,
+        "status": "queued",
+        "stage": None,
+        "progress": 0.0,
+        "result": None,
+        "error": None,
+        "created_at": now,
+        "started_at": None,
+        "updated_at": now,
+        "version": 0,
+    }
+    job.update(fields)
+    with _lock:
+        _jobs[job_id] = job
+    job_store.create_job(
+        job_id, job_type, status=job["status"], created_at=now,
+        started_at=job["started_at"], result=job["result"]
+    )
+    return job
+
+
+def record_finished_job(job_id: str, job_type: str, result: dict):
+    """
+    Registers a job that needed no work (e.g. a cache hit) so the
+    status endpoints can still serve it.
+    """
+    _new_job(
+        job_id, job_type,
+        status="done", stage="done", progress=1.0,
+        result=result, started_at=time.time()
+    )
+
+
+def submit_job(job_type: str, fn, *args, job_id: str = None, cost: float = 0.0, **kwargs) -> str:
+    """
+    Queues fn(*args, progress=..., **kwargs) on the worker pool for
+    job_type and returns the job id straight away. fn may report partial
+    results as progress(stage, fraction, event_name=data). Cheaper jobs
+    are started first.
+    """
+    job_id = job_id or new_job_id()
+    _new_job(job_id, job_type)
+    key = time.time() + cost * JOB_SJF_WEIGHT
+    _executor(job_type).submit(key, _run, job_id, fn, args, kwargs)
+    return job_id
@@ -1,19 +1,75 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import FastAPI, Request, HTTPException, Query
+from fastapi.responses import StreamingResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
+import json
 import os
-import shutil
+import threading
+import time
+from contextlib import asynccontextmanager
+from starlette.concurrency import run_in_threadpool
 from typing import Optional
+from pydantic import BaseModel
 
 # --- App Imports ---
-from app.orchestrator import process_audio_pipeline
-from app.demucs_runner import run_demucs
-from app.denoise_runner import run_denoise
-from app.zipper import zip_folder
+from app.orchestrator import (
+    process_audio_pipeline, resume_pipeline, job_request, load_segments,
+    BASE_DIR, PIPELINE_PARAMS, LAYOUTS, SEGMENTS_FILE
+)
+from app.segments import SegmentTable
+from app.demucs_runner import DEMUCS_MODEL
+from app.demucs_engine import params as demucs_params
+from app.denoise_runner import params as denoise_params
+from app.tasks import run_demucs, run_denoise
+from app.broker import get_broker, TASK_BROKER
+from app.zipper import iter_zip_stream, zip_stream_size
+from app.jobs import (
+    submit_job, get_job, get_events, new_job_id, record_finished_job, forget_job, queue_depth, FINISHED
+)
+from app import cache
+from app import job_store
+from app import storage
+from app import speaker_index
+from app.cleanup import delete_path
+from app import inference
+from app import admission
+from app.models import WARMUP_MODELS
+from app.audio_utils import wav_duration
+from app.metrics import (
+    JobProfile, render_metrics, STAGE_SECONDS, STAGE_BYTES_READ
+)
+from app.ingest import (
+    receive_upload, receive_uploads, open_file_sink, open_normalizing_sink,
+    FileSink, UploadError
+)
+from app.batch import process_batch, BATCH_DIR
+from app.peaks import peaks_path, build_peaks, read_peaks
+from app.streaming import (
+    RangeFileResponse, TRANSCODE_FORMATS, transcoded_path, transcode_stream,
+    content_disposition
+)
 
 
 
-app = FastAPI(title="Voice, Music & Audio Enhancer API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    for job_id, mode in job_store.fail_interrupted():
+        # Speech jobs are checkpointed per stage and carry on where they stopped
+        if RESUME_INTERRUPTED and mode == "speech" and job_request(job_id):
+            submit_job("speech", _resume_audio_job, job_id, job_id=job_id)
+    if WARMUP_MODELS:
+        # Load in the background so light endpoints are served right away
+        threading.Thread(
+            target=inference.warm_up, args=(WARMUP_MODELS,), daemon=True
+        ).start()
+    # Before the first sweep, which would take their folders for scratch
+    job_store.adopt_legacy_jobs()
+    storage.start()
+    yield
+    storage.stop()
+
+
+app = FastAPI(title="Voice, Music & Audio Enhancer API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,111 +77,610 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Accept-Ranges", "Content-Range", "Content-Length"],
+    expose_headers=[
+        "Accept-Ranges", "Content-Range", "Content-Length",
+        "X-Peaks-Sample-Rate", "X-Peaks-Samples-Per-Peak", "X-Peaks-Level",
+        "X-Peaks-Levels", "X-Peaks-Start", "X-Peaks-Duration", "X-Peaks-Peaks",
+    ],
 )
 
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+JOB_EVENTS_POLL_SECONDS = 0.5
+JOBS_PAGE_MAX = 200
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "500"))
+RESUME_INTERRUPTED = os.getenv("RESUME_INTERRUPTED", "1") == "1"
+# Served as-is by /download; anything else is a WAV
+MEDIA_TYPES = {spec["ext"]: spec["media_type"] for spec in TRANSCODE_FORMATS.values()}
+
+
+# Uploads are parsed by app.ingest straight off the request stream, so
+# the body schema has to be declared by hand for the docs.
+UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"]
+                }
+            }
+        }
+    }
+}
+
+
+BATCH_UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "files": {
+                            "type": "array",
+                            "items": {"type": "string", "format": "binary"}
+                        }
+                    },
+                    "required": ["files"]
+                }
+            }
+        }
+    }
+}
+
+
+async def _receive_upload(request: Request, open_sink):
+    try:
+        return await receive_upload(request, open_sink)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+
+def _overloaded(e: admission.Overloaded):
+    headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+    return HTTPException(status_code=e.status_code, detail=e.detail, headers=headers)
+
+
+@asynccontextmanager
+async def _admission(request: Request, job_type: str, job_id: str):
+    """
+    Turns the request away before its upload is read if we are full.
+    Otherwise holds a slot for job_id while the body streams in, given
+    up again unless the job got to _reserve().
+    """
+    try:
+        admission.check(job_id, admission.client_id(request), job_type)
+    except admission.Overloaded as e:
+        raise _overloaded(e)
+    try:
+        yield
+    except BaseException:
+        admission.release(job_id)
+        raise
+    admission.release_unreserved(job_id)
+
+
+async def _reserve(job_id: str, job_type: str, paths: list, owned: list) -> float:
+    """Charges the job's cost from its upload; rejects and cleans up if it does not fit."""
+    cost = await run_in_threadpool(admission.estimate_cost, job_type, paths)
+    try:
+        admission.reserve(job_id, cost)
+    except admission.Overloaded as e:
+        for path in owned:
+            delete_path(path)
+        raise _overloaded(e)
+    return cost
+
+
+def _queued(job_id: str):
+    return {"job_id": job_id, "status": "queued"}
+
+
+def _cached(job_type: str, key: str):
+    """
+    Returns the response for a repeat upload, or None on a cache miss.
+    """
+    result = cache.lookup(key)
+    if result is None:
+        return None
+
+    record_finished_job(result["job_id"], job_type, result)
+    return {
+        "job_id": result["job_id"],
+        "status": "done",
+        "result": result,
+        "cached": True
+    }
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    return cache.cache_stats()
+
+
+@app.get("/admission/stats")
+def admission_stats():
+    return {**admission.admission_stats(), "queued": queue_depth()}
+
+
+@app.get("/storage/stats")
+def storage_stats():
+    return storage.storage_stats()
+
+
+@app.get("/models")
+def model_stats():
+    return inference.model_stats()
+
+
+@app.get("/workers")
+def workers():
+    broker = get_broker()
+    if broker is None:
+        return {"broker": None, "workers": [], "queued": {}}
+    return {
+        "broker": TASK_BROKER.partition("://")[0],
+        "workers": broker.workers(),
+        "queued": broker.queue_depth()
+    }
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 
 # =========================
 # 1. VOICE SEPARATION
 # =========================
-@app.post("/process-audio")
-async def process_audio(file: UploadFile = File(...)):
-    temp = os.path.join(UPLOAD_DIR, file.filename)
-    with open(temp, "wb") as f:
-        shutil.copyfileobj(file.file, f)
-    return process_audio_pipeline(temp)
+def _process_audio_job(upload: dict, job_id: str, key: str, layout: str, progress):
+    if upload["normalized"]:
+        result = process_audio_pipeline(
+            None, job_id=job_id, progress=progress,
+            normalized_path=upload["path"], layout=layout,
+            content_hash=upload["content_hash"]
+        )
+    else:
+        result = process_audio_pipeline(
+            upload["path"], job_id=job_id, progress=progress, layout=layout,
+            content_hash=upload["content_hash"]
+        )
+    cache.store(key, result, [os.path.join(BASE_DIR, job_id)])
+    return result
+
+
+def _resume_audio_job(job_id: str, progress):
+    request = job_request(job_id)
+    result = resume_pipeline(job_id, progress=progress) if request else None
+    if result is None:
+        raise RuntimeError("The job's input is gone; it cannot be resumed")
+    key = cache.cache_key(request["content_hash"], "speech", layout=request["layout"], **PIPELINE_PARAMS)
+    cache.store(key, result, [os.path.join(BASE_DIR, job_id)])
+    return result
+
+
+@app.post("/process-audio", openapi_extra=UPLOAD_BODY)
+async def process_audio(request: Request, layout: str = "concat"):
+    """
+    layout=aligned writes each speaker as a track as long as the
+    recording instead of joining their turns back to back.
+    """
+    if layout not in LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"layout must be one of {', '.join(LAYOUTS)}")
+
+    job_id = new_job_id()
+    async with _admission(request, "speech", job_id):
+        job_dir = os.path.join(BASE_DIR, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+
+        # The upload is decoded to 16 kHz mono while it streams in, directly
+        # into the job folder, so diarization can start as soon as it ends
+        try:
+            upload = await _receive_upload(request, open_normalizing_sink(
+                os.path.join(job_dir, "normalized.wav"), UPLOAD_DIR, stem=job_id
+            ))
+        except Exception:
+            delete_path(job_dir)
+            raise
+        key = cache.cache_key(upload["content_hash"], "speech", layout=layout, **PIPELINE_PARAMS)
+
+        hit = _cached("speech", key)
+        if hit:
+            delete_path(job_dir)
+            delete_path(upload["path"])
+            return hit
+
+        owned = [job_dir] if upload["normalized"] else [job_dir, upload["path"]]
+        cost = await _reserve(job_id, "speech", [upload["path"]], owned)
+        submit_job(
+            "speech", admission.admitted(job_id, _process_audio_job), upload, job_id, key, layout,
+            job_id=job_id, cost=cost
+        )
+    job_store.add_paths(job_id, owned)
+    return _queued(job_id)
+
+
+@app.post("/process-audio/batch", openapi_extra=BATCH_UPLOAD_BODY)
+async def process_audio_batch(request: Request):
+    batch_id = new_job_id("batch")
+    batch_upload_dir = os.path.join(UPLOAD_DIR, batch_id)
+
+    counter = iter(range(BATCH_MAX_FILES))
+
+    def open_sink(filename: str):
+        # Prefix keeps two uploads with the same name apart
+        return FileSink(os.path.join(batch_upload_dir, f"{next(counter):04d}_{filename}"))
+
+    async with _admission(request, "batch", batch_id):
+        os.makedirs(batch_upload_dir, exist_ok=True)
+        try:
+            uploads = await receive_uploads(
+                request, open_sink, field="files", max_files=BATCH_MAX_FILES
+            )
+        except UploadError as e:
+            delete_path(batch_upload_dir)
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+        paths = [upload["path"] for upload in uploads]
+        cost = await _reserve(batch_id, "batch", paths, [batch_upload_dir])
+        submit_job("batch", admission.admitted(batch_id, process_batch), paths, batch_id, job_id=batch_id, cost=cost)
+    job_store.add_paths(batch_id, [batch_upload_dir, os.path.join(BATCH_DIR, batch_id)])
+    return {**_queued(batch_id), "files": len(paths)}
 
 
 # =========================
 # 2. MUSIC SEPARATION
 # =========================
-@app.post("/separate-music")
-async def separate_music(file: UploadFile = File(...)):
-    temp_path = os.path.join(UPLOAD_DIR, file.filename)
-    with open(temp_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+def _separate_music_job(temp_path: str, job_id: str, key: str, progress):
+    progress("demucs", 0.0)
+    profile = JobProfile()
+    with profile.stage("demucs"):
+        stem_paths = run_demucs(temp_path, name=job_id)
+
+    if not stem_paths:
+        raise RuntimeError("Demucs produced no stems")
+    output_folder = os.path.dirname(next(iter(stem_paths.values())))
+
+    stems = []
+    base_path = os.getcwd()
+
+    for name, full_path in stem_paths.items():
+        rel_path = os.path.relpath(full_path, base_path).replace("\\", "/")
+
+        stems.append({
+            "speaker_id": name.capitalize(),
+            "duration": "N/A",
+            "audio": rel_path,
+            "type": "stem"
+        })
+
+    durations = [round(wav_duration(stem["audio"]), 2) for stem in stems]
+    if durations:
+        profile.audio_seconds = durations[0]
+
+    job_store.record_artifacts(
+        job_id, "music", output_folder,
+        [(stem["audio"], "stem", d) for stem, d in zip(stems, durations)],
+        audio_seconds=profile.audio_seconds
+    )
+
+    result = {
+        "job_id": job_id,
+        "speakers": stems,
+        "mode": "music",
+        "profile": profile.as_dict()
+    }
+    cache.store(key, result, [output_folder])
+    return result
 
-    try:
-        output_folder = run_demucs(temp_path)
-        
-        # Robust folder check (Standard vs Fine-Tuned)
-        if not os.path.exists(output_folder):
-            if "htdemucs" in output_folder:
-                ft_folder = output_folder.replace("htdemucs", "htdemucs_ft")
-                if os.path.exists(ft_folder):
-                    output_folder = ft_folder
-                else:
-                    std_folder = output_folder.replace("htdemucs_ft", "htdemucs")
-                    if os.path.exists(std_folder):
-                         output_folder = std_folder
-                    else:
-                        raise HTTPException(500, "Demucs output folder missing")
-
-        stems = []
-        base_path = os.getcwd()
-
-        for filename in os.listdir(output_folder):
-            if filename.endswith(".wav"):
-                full_path = os.path.join(output_folder, filename)
-                rel_path = os.path.relpath(full_path, base_path).replace("\\", "/")
-                
-                stems.append({
-                    "speaker_id": os.path.splitext(filename)[0].capitalize(),
-                    "duration": "N/A", 
-                    "audio": rel_path,
-                    "type": "stem"
-                })
-
-        return {
-            "job_id": os.path.basename(output_folder),
-            "speakers": stems,
-            "mode": "music"
-        }
 
-    except Exception as e:
-        print(f"Separation Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+@app.post("/separate-music", openapi_extra=UPLOAD_BODY)
+async def separate_music(request: Request):
+    # Stored under the job id, so same-named uploads never share a file
+    # or a stems folder
+    job_id = new_job_id("music")
+    async with _admission(request, "music", job_id):
+        upload = await _receive_upload(request, open_file_sink(UPLOAD_DIR, stem=job_id))
+        temp_path = upload["path"]
+        key = cache.cache_key(upload["content_hash"], "music", model=DEMUCS_MODEL, **demucs_params())
+
+        hit = _cached("music", key)
+        if hit:
+            delete_path(temp_path)
+            return hit
+
+        cost = await _reserve(job_id, "music", [temp_path], [temp_path])
+        submit_job(
+            "music", admission.admitted(job_id, _separate_music_job), temp_path, job_id, key,
+            job_id=job_id, cost=cost
+        )
+    job_store.add_paths(job_id, [temp_path])
+    return _queued(job_id)
 
 
 # =========================
 # 3. AUDIO ENHANCER (NEW)
 # =========================
-@app.post("/enhance-audio")
-async def enhance_audio(file: UploadFile = File(...)):
-    temp_path = os.path.join(UPLOAD_DIR, file.filename)
-    with open(temp_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+def _enhance_audio_job(temp_path: str, job_id: str, key: str, progress):
+    progress("denoise", 0.0)
+    profile = JobProfile()
+    with profile.stage("denoise"):
+        output_path, job_id = run_denoise(temp_path, job_id=job_id)
+        profile.audio_seconds = round(wav_duration(output_path), 2)
+
+    job_store.record_artifacts(
+        job_id, "clean", os.path.dirname(output_path),
+        [(output_path, "enhanced", profile.audio_seconds)],
+        audio_seconds=profile.audio_seconds
+    )
+
+    base_path = os.getcwd()
+    rel_path = os.path.relpath(output_path, base_path).replace("\\", "/")
+
+    result = {
+        "job_id": job_id,
+        "speakers": [{
+            "speaker_id": "Enhanced Audio",
+            "duration": "N/A",
+            "audio": rel_path,
+            "type": "enhanced"
+        }],
+        "mode": "clean",
+        "profile": profile.as_dict()
+    }
+    cache.store(key, result, [os.path.dirname(output_path)])
+    return result
+
+
+@app.post("/enhance-audio", openapi_extra=UPLOAD_BODY)
+async def enhance_audio(request: Request):
+    job_id = new_job_id("clean")
+    async with _admission(request, "clean", job_id):
+        upload = await _receive_upload(request, open_file_sink(UPLOAD_DIR, stem=job_id))
+        temp_path = upload["path"]
+        key = cache.cache_key(upload["content_hash"], "clean", **denoise_params())
+
+        hit = _cached("clean", key)
+        if hit:
+            delete_path(temp_path)
+            return hit
+
+        cost = await _reserve(job_id, "clean", [temp_path], [temp_path])
+        submit_job(
+            "clean", admission.admitted(job_id, _enhance_audio_job), temp_path, job_id, key,
+            job_id=job_id, cost=cost
+        )
+    job_store.add_paths(job_id, [temp_path])
+    return _queued(job_id)
+
+
+# =========================
+# JOB STATUS
+# =========================
+def _public_job(job: dict):
+    return {k: v for k, v in job.items() if k != "version"}
+
+
+@app.get("/jobs")
+def list_jobs(
+    limit: int = Query(50, ge=1, le=JOBS_PAGE_MAX),
+    before: Optional[float] = None,
+    before_id: Optional[str] = None,
+    mode: Optional[str] = None,
+    status: Optional[str] = None
+):
+    jobs = job_store.list_jobs(limit=limit, before=before, before_id=before_id, mode=mode, status=status)
+    # A full page means there may be more; pass next and next_id as
+    # ?before=&before_id= to get them
+    last = jobs[-1] if len(jobs) == limit else None
+    return {
+        "jobs": jobs,
+        "next": last["created_at"] if last else None,
+        "next_id": last["job_id"] if last else None,
+    }
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _public_job(job)
+
+
+@app.post("/jobs/{job_id}/retry")
+def retry_job(job_id: str):
+    """
+    Runs a failed speech job again. Stages that finished before it
+    failed are not repeated.
+    """
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != "failed":
+        raise HTTPException(status_code=409, detail="Only failed jobs can be retried")
+    if job["type"] != "speech" or not job_request(job_id):
+        raise HTTPException(status_code=409, detail="This job cannot be resumed")
+
+    # Drops the failed run's events, so clients only see the new one's
+    forget_job(job_id)
+    submit_job("speech", _resume_audio_job, job_id, job_id=job_id)
+    return _queued(job_id)
+
+
+def _known_job_dir(job_id: str) -> str:
+    # job_id comes from the client: only ids the job store issued or
+    # adopted are trusted to name a folder
+    if not get_job(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return os.path.join(BASE_DIR, job_id)
+
+
+@app.get("/jobs/{job_id}/segments")
+def job_segments(job_id: str, format: str = "json"):
+    """
+    format=json is a list of {speaker, start, end}; format=columns is
+    {speakers, start, end, speaker} with speaker indexing speakers, and
+    format=npz the stored table itself (numpy.load it).
+    """
+    job_dir = _known_job_dir(job_id)
+    if not os.path.isdir(job_dir):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if format not in ("json", "columns", "npz"):
+        raise HTTPException(status_code=400, detail="format must be json, columns or npz")
+
+    path = os.path.join(job_dir, SEGMENTS_FILE)
+    if format == "npz":
+        if not os.path.exists(path):
+            segments, complete = load_segments(job_id)
+            if not complete:
+                raise HTTPException(status_code=409, detail="Diarization has not finished")
+            # A job from before SegmentTable: store its turns as one now
+            SegmentTable.from_list(segments).save(path)
+        return RangeFileResponse(
+            path, media_type="application/octet-stream", filename=f"{job_id}_segments.npz"
+        )
+    if format == "columns" and os.path.exists(path):
+        return {"job_id": job_id, "complete": True, **SegmentTable.load(path).to_columns()}
+
+    segments, complete = load_segments(job_id)
+    if format == "columns":
+        return {"job_id": job_id, "complete": complete, **SegmentTable.from_list(segments).to_columns()}
+    return {"job_id": job_id, "complete": complete, "segments": segments}
+
+
+def _sse(data, event: str = None, event_id: int = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """
+    Server-sent events for one job. Plain messages are the job status;
+    named events carry partial results as they appear:
+
+      segments  {"segments": [...], "complete": bool}
+      previews  {speaker: preview clip path}, before any track is written
+      speaker   one entry of result.speakers, once its track is written
+
+    A reconnecting client resumes after the Last-Event-ID it last saw.
+    """
+    if not get_job(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
 
     try:
-        output_path, job_id = run_denoise(temp_path)
-        
-        base_path = os.getcwd()
-        rel_path = os.path.relpath(output_path, base_path).replace("\\", "/")
-        
-        return {
-            "job_id": job_id,
-            "speakers": [{
-                "speaker_id": "Enhanced Audio",
-                "duration": "N/A",
-                "audio": rel_path,
-                "type": "enhanced"
-            }],
-            "mode": "clean"
-        }
+        next_event = int(request.headers.get("last-event-id", "-1")) + 1
+    except ValueError:
+        next_event = 0
+
+    async def stream():
+        nonlocal next_event
+        version = -1
+        provisional = 0
+        while True:
+            job = get_job(job_id)
+            if job["version"] != version:
+                version = job["version"]
+                yield _sse(_public_job(job))
+                for event, data in get_events(job_id, next_event):
+                    yield _sse(data, event=event, event_id=next_event)
+                    next_event += 1
 
-    except Exception as e:
-        print(f"Enhance Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+            # Long recordings are diarized in windows; pass each finished
+            # window on before the final labels exist
+            if job["type"] == "speech" and job["stage"] == "diarize":
+                segments, complete = await run_in_threadpool(load_segments, job_id)
+                if not complete and len(segments) > provisional:
+                    yield _sse({"segments": segments[provisional:], "complete": False}, event="segments")
+                    provisional = len(segments)
+
+            if job["status"] in FINISHED:
+                break
+            await asyncio.sleep(JOB_EVENTS_POLL_SECONDS)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+
+# =========================
+# KNOWN SPEAKERS
+# =========================
+class Enrollment(BaseModel):
+    job_id: str
+    speaker: str
+    name: Optional[str] = None
+    # Add the voice to this known speaker instead of creating a new one
+    speaker_id: Optional[str] = None
+
+
+def _job_embedding(job_id: str, speaker: str):
+    embeddings = speaker_index.load_job_embeddings(_known_job_dir(job_id))
+    if speaker not in embeddings:
+        raise HTTPException(status_code=404, detail="No voiceprint for this speaker")
+    return embeddings[speaker]
+
+
+@app.get("/speakers")
+def list_speakers():
+    return {"speakers": speaker_index.list_speakers()}
+
+
+@app.post("/speakers")
+def enroll_speaker(enrollment: Enrollment):
+    if not enrollment.speaker_id and not enrollment.name:
+        raise HTTPException(status_code=400, detail="A new speaker needs a name")
+
+    embedding = _job_embedding(enrollment.job_id, enrollment.speaker)
+    try:
+        return speaker_index.enroll(
+            enrollment.name, embedding,
+            speaker_id=enrollment.speaker_id,
+            source={"job_id": enrollment.job_id, "speaker": enrollment.speaker}
+        )
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Speaker not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.get("/speakers/query")
+def query_speakers(job_id: str, speaker: str, top_k: int = Query(5, ge=1, le=100)):
+    embedding = _job_embedding(job_id, speaker)
+    try:
+        return {"matches": speaker_index.search(embedding, top_k=top_k)[0]}
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.delete("/speakers/{speaker_id}")
+def remove_speaker(speaker_id: str):
+    try:
+        speaker_index.remove_speaker(speaker_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Speaker not found")
+    return {"deleted": speaker_id}
 
 
 # =========================
 # FILE STREAMING
 # =========================
-@app.get("/download")
-def download(file: str):
+@app.api_route("/download", methods=["GET", "HEAD"])
+def download(request: Request, file: str, format: Optional[str] = None):
     file_path = os.path.normpath(file)
     if not file_path.startswith("outputs"):
          raise HTTPException(status_code=403, detail="Access denied")
@@ -133,55 +688,128 @@ def download(file: str):
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
 
-    return FileResponse(
-        path=file_path,
-        media_type="audio/wav",
-        filename=os.path.basename(file_path)
-    )
+    filename = os.path.basename(file_path)
+    range_header = request.headers.get("range")
+    if request.method == "GET" and not range_header:
+        # Range requests are a player seeking; only count whole fetches
+        job_store.touch_path(file_path)
+
+    if format is None:
+        media_type = MEDIA_TYPES.get(os.path.splitext(filename)[1].lstrip(".").lower(), "audio/wav")
+        return RangeFileResponse(
+            file_path, range_header, media_type=media_type, filename=filename
+        )
+
+    if format not in TRANSCODE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+
+    spec = TRANSCODE_FORMATS[format]
+    filename = f"{os.path.splitext(filename)[0]}.{spec['ext']}"
+
+    # Second and later requests are served, with ranges, from disk
+    cached = transcoded_path(file_path, format)
+    if os.path.exists(cached):
+        return RangeFileResponse(
+            cached, range_header, media_type=spec["media_type"], filename=filename
+        )
+    if request.method == "HEAD":
+        # The length is only known once encoded; a HEAD must not start ffmpeg
+        response = Response(
+            media_type=spec["media_type"],
+            headers={"content-disposition": content_disposition(filename)}
+        )
+        del response.headers["content-length"]
+        return response
+    return transcode_stream(file_path, format, filename=filename)
+
+
+@app.get("/peaks")
+def peaks(
+    file: str,
+    width: Optional[int] = Query(None, ge=1, le=100000),
+    level: Optional[int] = Query(None, ge=0),
+    start: float = Query(0.0, ge=0),
+    end: Optional[float] = None,
+    format: str = "bin"
+):
+    """
+    Min/max waveform peaks of an output track. width asks for the
+    coarsest zoom level with at least that many peaks in [start, end);
+    level picks one directly. The binary body is int16 (min, max) pairs,
+    described by the X-Peaks-* headers.
+    """
+    file_path = os.path.normpath(file)
+    if not file_path.startswith("outputs"):
+        raise HTTPException(status_code=403, detail="Access denied")
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    index_path = peaks_path(file_path)
+    if not os.path.exists(index_path):
+        # Tracks from before peak indexes existed
+        try:
+            build_peaks(file_path)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    info, pairs = read_peaks(index_path, width=width, level=level, start=start, end=end)
+
+    if format == "json":
+        return {**info, "data": pairs.tolist()}
+    if format != "bin":
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+
+    headers = {f"X-Peaks-{key.replace('_', '-').title()}": str(value) for key, value in info.items()}
+    headers["Cache-Control"] = "max-age=3600"
+    return Response(pairs.tobytes(), media_type="application/octet-stream", headers=headers)
 
 
 # =========================
 # ZIP DOWNLOADER (ALL MODES)
 # =========================
+def _timed_zip_stream(entries):
+    # Chunks are pulled from different threadpool threads, so only wall
+    # time and volume are meaningful for this stage
+    started = time.perf_counter()
+    yield from iter_zip_stream(entries)
+    STAGE_SECONDS.observe(time.perf_counter() - started, stage="zip")
+    STAGE_BYTES_READ.inc(sum(entry[2] for entry in entries), stage="zip")
+
+
+def _zip_response(entries, zip_name: str):
+    # Built while it is sent: no archive on disk, no race between two
+    # requests for the same job, and the exact length is known up front
+    return StreamingResponse(
+        _timed_zip_stream(entries),
+        media_type="application/zip",
+        headers={
+            "Content-Length": str(zip_stream_size(entries)),
+            "Content-Disposition": content_disposition(zip_name),
+        }
+    )
+
+
 @app.get("/jobs/{job_id}/download-all")
 def download_all(job_id: str, mode: Optional[str] = "speech"):
-    print(f"DEBUG: ZIP Request -> Job: {job_id} | Mode: {mode}")
-
-    possible_paths = [
-        # 1. Voice Mode
-        os.path.join("outputs", "jobs", job_id, "speakers"),
-        
-        # 2. Music Mode (Standard)
-        os.path.join("outputs", "demucs", "htdemucs", job_id),
-        
-        # 3. Music Mode (Fine-Tuned)
-        os.path.join("outputs", "demucs", "htdemucs_ft", job_id),
-
-        # 4. Enhancer Mode
-        os.path.join("outputs", "enhanced", job_id),
-        
-        # 5. Fallbacks
-        os.path.join("outputs", "jobs", job_id, "final"),
-        os.path.join("outputs", "demucs", job_id)
-    ]
-    
-    target_dir = None
-    for p in possible_paths:
-        if os.path.exists(p):
-            target_dir = p
-            break
-            
-    if not target_dir:
-        print(f"ERROR: Could not find files for {job_id}")
+    # mode is still accepted from older clients; the store knows the job's own
+    entries = job_store.zip_entries(job_id)
+    if entries is None and job_store.adopt_legacy_job(job_id):
+        entries = job_store.zip_entries(job_id)
+    if not entries:
         raise HTTPException(status_code=404, detail="Job files not found.")
+    job_store.touch(job_id)
 
     zip_name = f"{job_id}_files.zip"
-    zip_path = os.path.join("outputs", zip_name)
-    
-    try:
-        zip_folder(target_dir, zip_path)
-    except Exception as e:
-        print(f"Zip Error: {e}")
-        raise HTTPException(status_code=500, detail="Failed to create zip.")
+    return _zip_response(entries, zip_name)
+
+
+@app.get("/jobs/{job_id}/download-speakers")
+def download_speakers(job_id: str):
+    entries = job_store.zip_entries(job_id, prefix="speakers", kind="speaker")
+    if entries is None and job_store.adopt_legacy_job(job_id):
+        entries = job_store.zip_entries(job_id, prefix="speakers", kind="speaker")
+    if not entries:
+        raise HTTPException(status_code=404, detail="Job files not found.")
+    job_store.touch(job_id)
 
-    return FileResponse(zip_path, filename=zip_name)
+    return _zip_response(entries, f"{job_id}_speakers.zip")
@@ -0,0 +1,214 @@
+import sys
+import time
+import resource
+import threading
+from contextlib import contextmanager
+
+# Stage metrics are measured per thread wherever the OS allows it, so
+# concurrent jobs do not pollute each other's numbers. The exception is
+# work done by child processes (ffmpeg, demucs), which is only visible
+# process-wide once they are reaped; under load those figures are an
+# upper bound for the stage. Reads through a memory map are page faults,
+# not read() calls, and do not show up in bytes_read; CPU spent in the
+# shared inference process is not attributed to the calling job. Work a
+# stage fans out to other threads through bind_stages() counts towards
+# its subprocesses, but not its cpu_seconds or bytes. Peak memory is only
+# kept per process, so process_peak_rss_bytes is the high-water mark of
+# the whole server (or of its largest reaped child) as of the stage's
+# end, not of the stage itself.
+
+STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+RTF_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5)
+
+_local = threading.local()
+_lock = threading.Lock()
+
+
+def _audit(event, args):
+    # Counts every subprocess the current thread starts, however it does it
+    if event == "subprocess.Popen":
+        for counters in getattr(_local, "stages", ()):
+            counters["subprocesses"] += 1
+
+
+sys.addaudithook(_audit)
+
+
+def _thread_io():
+    """(bytes read, bytes written) by this thread's syscalls."""
+    try:
+        with open("/proc/thread-self/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def _children_usage():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_inblock/ru_oublock are 512-byte blocks
+    return usage.ru_utime + usage.ru_stime, usage.ru_inblock * 512, usage.ru_oublock * 512
+
+
+def _process_peak_rss_bytes():
+    # ru_maxrss is KiB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) * 1024
+
+
+def bind_stages(fn):
+    """
+    Wraps fn so that, on whichever thread runs it, the subprocesses it
+    starts are counted against the stages open on this thread now.
+    """
+    stages = list(getattr(_local, "stages", ()))
+
+    def bound(*args, **kwargs):
+        previous = getattr(_local, "stages", None)
+        _local.stages = list(stages)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.stages = previous if previous is not None else []
+
+    return bound
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            series = self._series.setdefault(
+                key, {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            for key, series in sorted(self._series.items()):
+                labels = ",".join(f'{k}="{v}"' for k, v in key)
+                sep = "," if labels else ""
+                for bound, count in zip(self.buckets, series["counts"]):
+                    lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="+Inf"}} {series["count"]}')
+                lines.append(f"{self.name}_sum{{{labels}}} {series['sum']:.6f}")
+                lines.append(f"{self.name}_count{{{labels}}} {series['count']}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with _lock:
+            for key, value in sorted(self._values.items()):
+                labels = ",".join(f'{k}="{v}"' for k, v in key)
+                lines.append(f"{self.name}{{{labels}}} {value}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("pipeline_stage_seconds", "Wall time per pipeline stage.", STAGE_BUCKETS)
+STAGE_CPU_SECONDS = Histogram("pipeline_stage_cpu_seconds", "CPU time per stage, including child processes.", STAGE_BUCKETS)
+STAGE_RTF = Histogram("pipeline_stage_real_time_factor", "Stage wall time divided by audio duration.", RTF_BUCKETS)
+STAGE_SUBPROCESSES = Counter("pipeline_stage_subprocesses_total", "Subprocesses started per stage.")
+STAGE_BYTES_READ = Counter("pipeline_stage_read_bytes_total", "Bytes read per stage.")
+STAGE_BYTES_WRITTEN = Counter("pipeline_stage_written_bytes_total", "Bytes written per stage.")
+JOBS = Counter("pipeline_jobs_total", "Finished jobs by type and status.")
+SEGMENT_CUTS_SAVED = Counter("pipeline_segment_cuts_saved_total", "Diarization turns merged or dropped before extraction.")
+ADMISSION_REJECTED = Counter("admission_rejected_total", "Heavy requests turned away, by reason and job type.")
+
+REGISTRY = [
+    STAGE_SECONDS, STAGE_CPU_SECONDS, STAGE_RTF,
+    STAGE_SUBPROCESSES, STAGE_BYTES_READ, STAGE_BYTES_WRITTEN, JOBS,
+    SEGMENT_CUTS_SAVED, ADMISSION_REJECTED,
+]
+
+
+class JobProfile:
+    """
+    Collects per-stage measurements for one job, and feeds the global
+    histograms as each stage finishes.
+    """
+
+    def __init__(self, audio_seconds: float = None):
+        self.audio_seconds = audio_seconds
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        counters = {"subprocesses": 0}
+        stack = getattr(_local, "stages", None)
+        if stack is None:
+            stack = _local.stages = []
+        stack.append(counters)
+
+        read_before, written_before = _thread_io()
+        child_cpu_before, child_read_before, child_written_before = _children_usage()
+        cpu_before = time.thread_time()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - started
+            cpu = time.thread_time() - cpu_before
+            read_after, written_after = _thread_io()
+            child_cpu_after, child_read_after, child_written_after = _children_usage()
+            stack.remove(counters)
+
+            record = {
+                "wall_seconds": round(wall, 4),
+                "cpu_seconds": round(cpu + child_cpu_after - child_cpu_before, 4),
+                "process_peak_rss_bytes": _process_peak_rss_bytes(),
+                "subprocesses": counters["subprocesses"],
+                "bytes_read": (read_after - read_before) + (child_read_after - child_read_before),
+                "bytes_written": (written_after - written_before) + (child_written_after - child_written_before),
+            }
+            if self.audio_seconds:
+                record["real_time_factor"] = round(wall / self.audio_seconds, 4)
+            self.stages[name] = record
+            _observe(name, record)
+
+    def as_dict(self):
+        return {
+            "audio_seconds": self.audio_seconds,
+            "total_wall_seconds": round(sum(s["wall_seconds"] for s in self.stages.values()), 4),
+            "stages": self.stages,
+        }
+
+
+def _observe(name: str, record: dict):
+    STAGE_SECONDS.observe(record["wall_seconds"], stage=name)
+    STAGE_CPU_SECONDS.observe(record["cpu_seconds"], stage=name)
+    if "real_time_factor" in record:
+        STAGE_RTF.observe(record["real_time_factor"], stage=name)
+    STAGE_SUBPROCESSES.inc(record["subprocesses"], stage=name)
+    STAGE_BYTES_READ.inc(record["bytes_read"], stage=name)
+    STAGE_BYTES_WRITTEN.inc(record["bytes_written"], stage=name)
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,126 @@
+import os
+import time
+import resource
+import importlib
+import threading
+from contextlib import contextmanager
+
+# Nothing in here imports torch. Models are registered by the dotted
+# path of their loader and only imported on first use.
+DIARIZATION_MODEL = "pyannote/speaker-diarization"
+DEMUCS_MODEL = "htdemucs"
+
+MODEL_LOADERS = {
+    "diarization": "app.diarization:load_pipeline",
+    "demucs": "app.demucs_engine:load_model",
+}
+
+# Copies of a model that may run at once, each on its own thread (see
+# checkout()). Diarization is one file per pyannote call, so several
+# files only run at once on several copies; the default gives each copy
+# four cores. Set it to 1 on a GPU.
+MODEL_REPLICAS = {
+    "diarization": int(os.getenv("DIARIZATION_REPLICAS", "0")) or max(1, (os.cpu_count() or 1) // 4),
+}
+
+# Comma-separated model names to load as soon as the process starts,
+# e.g. WARMUP_MODELS=diarization
+WARMUP_MODELS = [
+    name.strip()
+    for name in os.getenv("WARMUP_MODELS", "").split(",")
+    if name.strip()
+]
+
+_models = {}
+_stats = {}
+_locks = {name: threading.Lock() for name in MODEL_LOADERS}
+# Replicas made so far, and those not checked out
+_replicas = {name: 0 for name in MODEL_LOADERS}
+_idle = {name: [] for name in MODEL_LOADERS}
+_idle_changed = threading.Condition()
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Not Linux: peak RSS is the closest thing available (KiB)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _import_loader(path: str):
+    module_name, func_name = path.split(":")
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def get_model(name: str):
+    """
+    Returns the loaded model, loading it on first use. Concurrent first
+    callers wait for a single load.
+    """
+    if name in _models:
+        return _models[name]
+
+    if name not in MODEL_LOADERS:
+        raise KeyError(f"Unknown model: {name}")
+
+    with _locks[name]:
+        if name not in _models:
+            rss_before = _rss_bytes()
+            started = time.perf_counter()
+
+            print(f"Loading model '{name}'...")
+            _models[name] = _import_loader(MODEL_LOADERS[name])()
+
+            _stats[name] = {
+                "loaded_at": time.time(),
+                "load_seconds": round(time.perf_counter() - started, 3),
+                "rss_delta_bytes": _rss_bytes() - rss_before,
+            }
+    return _models[name]
+
+
+@contextmanager
+def checkout(name: str):
+    """
+    Holds one replica of the model for the caller's thread alone, up to
+    MODEL_REPLICAS[name] at once; further callers wait for one to come
+    back. The first replica is get_model(name) itself.
+    """
+    limit = MODEL_REPLICAS.get(name, 1)
+    with _idle_changed:
+        while not _idle[name] and _replicas[name] >= limit:
+            _idle_changed.wait()
+        model = _idle[name].pop() if _idle[name] else None
+        if model is None:
+            _replicas[name] += 1
+            first = _replicas[name] == 1
+
+    if model is None:
+        try:
+            model = get_model(name) if first else _import_loader(MODEL_LOADERS[name])()
+        except BaseException:
+            with _idle_changed:
+                _replicas[name] -= 1
+                _idle_changed.notify()
+            raise
+
+    try:
+        yield model
+    finally:
+        with _idle_changed:
+            _idle[name].append(model)
+            _idle_changed.notify()
+
+
+def warm_up(names=None):
+    for name in names or WARMUP_MODELS:
+        get_model(name)
+
+
+def model_stats():
+    return {
+        name: {"loaded": name in _models, "replicas": _replicas[name], **_stats.get(name, {})}
+        for name in MODEL_LOADERS
+    }
@@ -0,0 +1,60 @@
+import os
+import shutil
+
+from app.audio_utils import link_or_copy
+
+# Where task inputs and outputs travel between the API host and the
+# workers. OBJECT_STORE is a URL:
+#   file:///shared/objects   a directory every node mounts (the default
+#                            is a local one, for single-box setups)
+# Other backends implement the same four methods.
+
+OBJECT_STORE = os.getenv("OBJECT_STORE", "file://outputs/objects")
+
+
+class LocalObjectStore:
+    """Objects are files under root; keys are relative paths."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"Key outside the store: {key}")
+        return path
+
+    def put(self, local_path: str, key: str) -> str:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.part"
+        link_or_copy(local_path, temp_path)
+        os.replace(temp_path, path)
+        return key
+
+    def get(self, key: str, local_path: str) -> str:
+        os.makedirs(os.path.dirname(local_path) or ".", exist_ok=True)
+        temp_path = f"{local_path}.part"
+        link_or_copy(self._path(key), temp_path)
+        os.replace(temp_path, local_path)
+        return local_path
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def delete_prefix(self, prefix: str):
+        path = self._path(prefix)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def get_object_store(url: str = None):
+    url = url or OBJECT_STORE
+    scheme, sep, rest = url.partition("://")
+    if not sep:
+        return LocalObjectStore(url)
+    if scheme == "file":
+        return LocalObjectStore(rest)
+    raise ValueError(f"Unsupported object store: {url}")
@@ -1,52 +1,352 @@
 import os
 import json
 import uuid
-import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from app.audio_utils import normalize_audio
-from app.diarization import run_diarization
-from app.separation_concat import separate_by_speaker_concat
+from app.audio_utils import wav_duration, link_or_copy
+from app.tasks import normalize_audio, diarize, separate_by_speaker_concat
+from app.extraction_engine import separate_by_speaker_mmap, separate_by_speaker_aligned
+from app.models import DIARIZATION_MODEL
+from app.metrics import JobProfile, bind_stages, SEGMENT_CUTS_SAVED
+from app import job_store, speaker_index
+from app.segments import SegmentTable, clean, params as segment_params
+from app.previews import generate_speaker_previews, PREVIEW_SECONDS, PREVIEW_FORMAT
+from app.pipeline import Pipeline, digest, file_digest
 
 BASE_DIR = "outputs/jobs"
 
+# Long recordings are diarized in windows; each finished window appends
+# its segments here as one JSON line until diarization.npz exists.
+PARTIAL_DIARIZATION = "diarization.partial.jsonl"
+# Turns as a SegmentTable: straight from the model, and cleaned up
+RAW_SEGMENTS_FILE = "diarization.raw.npz"
+SEGMENTS_FILE = "diarization.npz"
+# What jobs from before SegmentTable wrote instead, read but never written
+LEGACY_SEGMENTS_FILE = "diarization.json"
+# The arguments a job was started with, for resume_pipeline
+REQUEST_FILE = "request.json"
 
-def process_audio_pipeline(audio_path: str):
-    job_id = f"job_{uuid.uuid4().hex[:8]}"
+# "mmap" slices the normalized WAV in-process, "ffmpeg" is the legacy
+# one-subprocess-per-segment path kept for comparison.
+EXTRACTION_ENGINE = os.getenv("EXTRACTION_ENGINE", "mmap")
+
+# Speakers extracted at once; each writes its own file
+EXTRACTION_WORKERS = int(
+    os.getenv("EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1)))
+)
+
+EXTRACTORS = {
+    "mmap": separate_by_speaker_mmap,
+    "ffmpeg": separate_by_speaker_concat,
+}
+
+# How speaker tracks are laid out: "concat" joins each speaker's turns
+# back to back, "aligned" keeps every track on the original timeline
+LAYOUTS = ("concat", "aligned")
+
+# Everything that changes the output for identical input audio. Part of
+# the result cache key.
+PIPELINE_PARAMS = {
+    "diarization_model": DIARIZATION_MODEL,
+    "extraction_engine": EXTRACTION_ENGINE,
+    "segments": segment_params(),
+}
+
+
+def _no_progress(stage: str, fraction: float, **events):
+    pass
+
+
+def _write_json(path: str, value):
+    with open(f"{path}.part", "w") as f:
+        json.dump(value, f)
+    os.replace(f"{path}.part", path)
+
+
+def _read_json(path: str):
+    with open(path) as f:
+        return json.load(f)
+
+
+def process_audio_pipeline(
+    audio_path: str,
+    job_id: str = None,
+    progress=None,
+    normalized_path: str = None,
+    diarizer=None,
+    layout: str = "concat",
+    content_hash: str = None
+):
+    """
+    Runs the speech pipeline for one upload. When the upload was already
+    normalized while it streamed in, pass normalized_path and audio_path
+    is ignored. diarizer defaults to the shared inference process.
+    layout is one of LAYOUTS. content_hash identifies the input; it is
+    computed from the file when not given.
+
+    Every stage is checkpointed in the job folder (see app.pipeline), so
+    calling this again for the same job, e.g. after a crash, picks up
+    after the last finished stage.
+
+    Partial results go out through progress as they exist: the segments
+    once diarization is done, the previews, then each speaker as its
+    track is written.
+    """
+    progress = progress or _no_progress
+    diarizer = diarizer or diarize
+
+    job_id = job_id or f"job_{uuid.uuid4().hex[:8]}"
     job_dir = os.path.join(BASE_DIR, job_id)
+    os.makedirs(job_dir, exist_ok=True)
+
+    source = normalized_path or audio_path
+    content_hash = content_hash or file_digest(source)
+    # Enough to run the job again after a restart
+    _write_json(os.path.join(job_dir, REQUEST_FILE), {
+        "audio_path": audio_path,
+        "normalized_path": normalized_path,
+        "layout": layout,
+        "content_hash": content_hash,
+    })
+
+    profile = JobProfile()
+    job_normalized = os.path.join(job_dir, "normalized.wav")
+    # An upload normalized while it streamed in is the job's input, not
+    # something the normalize stage may delete and redo
+    streamed = normalized_path is not None and (
+        os.path.abspath(normalized_path) == os.path.abspath(job_normalized)
+    )
+
+    def normalize():
+        if normalized_path is None:
+            progress("normalize", 0.0)
+            normalize_audio(audio_path, job_normalized)
+        elif not streamed:
+            link_or_copy(normalized_path, job_normalized)
+        # The source hash carries a new input into every later stage's key
+        return {"audio_seconds": round(wav_duration(job_normalized), 2), "source": content_hash}
+
+    def run_diarize(normalized):
+        progress("diarize", 0.1)
+        partial_path = os.path.join(job_dir, PARTIAL_DIARIZATION)
+        raw_segments, embeddings = diarizer(job_normalized, partial_path, return_embeddings=True)
+        SegmentTable.from_list(raw_segments).save(os.path.join(job_dir, RAW_SEGMENTS_FILE))
+        # Kept with the job so its speakers can be enrolled later
+        speaker_index.save_job_embeddings(job_dir, embeddings)
+        return {"digest": digest([raw_segments, embeddings])}
+
+    def run_postprocess(normalized, diarized):
+        # Fewer, longer turns: fewer cuts to make and smoother tracks
+        raw = SegmentTable.load(os.path.join(job_dir, RAW_SEGMENTS_FILE))
+        table, report = clean(raw, duration=normalized["audio_seconds"])
+        SEGMENT_CUTS_SAVED.inc(report["cuts_saved"])
+        table.save(os.path.join(job_dir, SEGMENTS_FILE))
+        return {"digest": digest(table.to_columns()), "report": report}
+
+    def identify(diarized):
+        # Against the speaker index as it is now, so never checkpointed
+        return speaker_index.identify(speaker_index.load_job_embeddings(job_dir))
+
+    def preview(processed):
+        # Cheap, so they go out before any full track is written
+        segments = load_table().to_list()
+        return generate_speaker_previews(job_normalized, segments, os.path.join(job_dir, "previews"))
 
     speakers_dir = os.path.join(job_dir, "speakers")
-    os.makedirs(speakers_dir, exist_ok=True)
+    announced = {}
 
-    normalized_path = normalize_audio(audio_path)
-    shutil.copy(normalized_path, os.path.join(job_dir, "normalized.wav"))
+    def load_table():
+        return SegmentTable.load(os.path.join(job_dir, SEGMENTS_FILE))
 
-    segments = run_diarization(normalized_path)
-    with open(os.path.join(job_dir, "diarization.json"), "w") as f:
-        json.dump(segments, f, indent=2)
+    def speaker_entry(speaker_id, audio, stats):
+        entry = {
+            "speaker_id": speaker_id,
+            "duration": stats[speaker_id]["talk_seconds"],
+            "audio": audio,
+            "preview": pipeline.results["preview"].get(speaker_id),
+            "turns": stats[speaker_id]["turns"],
+            "overlap_ratio": stats[speaker_id]["overlap_ratio"]
+        }
+        known = pipeline.results["identify"]
+        if speaker_id in known:
+            entry["name"] = known[speaker_id]["name"]
+            entry["known_speaker_id"] = known[speaker_id]["speaker_id"]
+            entry["similarity"] = known[speaker_id]["similarity"]
+        return entry
 
-    speaker_files = separate_by_speaker_concat(
-        normalized_path,
-        segments,
-        speakers_dir
-    )
+    def announce(speaker_id, audio, stats):
+        announced[speaker_id] = speaker_entry(speaker_id, audio, stats)
+        progress(
+            "extract", 0.8 + 0.2 * len(announced) / len(stats),
+            speaker=announced[speaker_id]
+        )
+
+    def extract(normalized, processed):
+        table = load_table()
+        stats = table.speaker_stats()
+        os.makedirs(speakers_dir, exist_ok=True)
+        audio = {}
+
+        if layout == "aligned":
+            # One pass over the recording writes every track at once
+            for speaker_id, path in separate_by_speaker_aligned(job_normalized, table.to_list(), speakers_dir).items():
+                audio[speaker_id] = path
+                announce(speaker_id, path, stats)
+            return audio
+
+        by_speaker = table.by_speaker()
 
-    metadata = []
-    for speaker_id, file_path in speaker_files.items():
-        duration = sum(
-            s["end"] - s["start"]
-            for s in segments if s["speaker"] == speaker_id
+        # Each extractor call gets one speaker's segments, so speakers are
+        # written side by side and each is announced as soon as it is done
+        run_extractor = bind_stages(EXTRACTORS[EXTRACTION_ENGINE])
+        workers = max(1, min(EXTRACTION_WORKERS, len(by_speaker)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extract") as pool:
+            futures = {
+                pool.submit(run_extractor, job_normalized, segs, speakers_dir): speaker_id
+                for speaker_id, segs in by_speaker.items()
+            }
+            for future in as_completed(futures):
+                speaker_id = futures[future]
+                audio[speaker_id] = future.result()[speaker_id]
+                announce(speaker_id, audio[speaker_id], stats)
+        return audio
+
+    def package(normalized, processed, previews, known, audio):
+        # One vectorized pass for every speaker's talk time and turns;
+        # ordered by first appearance in the recording
+        stats = load_table().speaker_stats()
+        metadata = [speaker_entry(speaker_id, audio[speaker_id], stats) for speaker_id in stats]
+
+        job_store.record_artifacts(
+            job_id, "speech", speakers_dir,
+            [
+                (m["audio"], "speaker", normalized["audio_seconds"] if layout == "aligned" else m["duration"])
+                for m in metadata
+            ],
+            audio_seconds=normalized["audio_seconds"],
+            owned_paths=[job_dir]
         )
 
-        metadata.append({
-            "speaker_id": speaker_id,
-            "duration": round(duration, 2),
-            "audio": file_path
+        result = {
+            "job_id": job_id,
+            "layout": layout,
+            "speakers": metadata,
+            "segments": processed["report"]
+        }
+        _write_json(os.path.join(job_dir, "metadata.json"), {
+            **result,
+            "profile": {**profile.as_dict(), "resumed_stages": list(pipeline.skipped)}
         })
+        return result
+
+    def on_stage(name, result, skipped):
+        if name == "normalize":
+            profile.audio_seconds = result["audio_seconds"]
+        elif name == "postprocess":
+            # Only now: until diarization.npz exists it backs load_segments
+            partial_path = os.path.join(job_dir, PARTIAL_DIARIZATION)
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            progress("extract", 0.75, segments={"segments": load_table().to_list(), "complete": True})
+        elif name == "preview":
+            progress("extract", 0.8, previews=result)
+        elif name == "extract" and skipped:
+            stats = load_table().speaker_stats()
+            for speaker_id in stats:
+                announce(speaker_id, result[speaker_id], stats)
+
+    pipeline = Pipeline(job_dir, profile=profile, on_stage=on_stage)
+    pipeline.stage(
+        "normalize", normalize,
+        params={"source": content_hash},
+        outputs=() if streamed else ("normalized.wav",)
+    )
+    pipeline.stage(
+        "diarize", run_diarize, after=("normalize",),
+        params={"model": DIARIZATION_MODEL},
+        outputs=(RAW_SEGMENTS_FILE, speaker_index.JOB_EMBEDDINGS),
+        # A crashed run's windows must not be appended to
+        scratch=(PARTIAL_DIARIZATION,)
+    )
+    pipeline.stage(
+        "postprocess", run_postprocess, after=("normalize", "diarize"),
+        params=segment_params(),
+        outputs=(SEGMENTS_FILE,)
+    )
+    pipeline.stage("identify", identify, after=("diarize",), checkpoint=False)
+    pipeline.stage(
+        "preview", preview, after=("postprocess",),
+        params={"seconds": PREVIEW_SECONDS, "format": PREVIEW_FORMAT},
+        outputs=("previews",)
+    )
+    pipeline.stage(
+        "extract", extract, after=("normalize", "postprocess"),
+        params={"engine": EXTRACTION_ENGINE, "layout": layout},
+        outputs=("speakers",)
+    )
+    pipeline.stage(
+        "package", package, after=("normalize", "postprocess", "preview", "identify", "extract"),
+        params={"layout": layout},
+        outputs=("metadata.json",)
+    )
+
+    return pipeline.run()["package"]
+
+
+def job_request(job_id: str):
+    """
+    The arguments job_id was started with, or None when its input is
+    gone and it cannot be run again.
+    """
+    request_path = os.path.join(BASE_DIR, job_id, REQUEST_FILE)
+    if not os.path.exists(request_path):
+        return None
+    request = _read_json(request_path)
+    source = request["normalized_path"] or request["audio_path"]
+    if not source or not os.path.exists(source):
+        return None
+    return request
+
+
+def resume_pipeline(job_id: str, progress=None, diarizer=None):
+    """
+    Runs a job again from what its folder holds, skipping the stages
+    that already finished. Returns None if the job cannot be resumed.
+    """
+    request = job_request(job_id)
+    if request is None:
+        return None
+
+    return process_audio_pipeline(
+        request["audio_path"], job_id=job_id, progress=progress,
+        normalized_path=request["normalized_path"], diarizer=diarizer,
+        layout=request["layout"], content_hash=request["content_hash"]
+    )
+
+
+def load_segments(job_id: str):
+    """
+    Returns (segments, complete). Before diarization has finished this
+    is whatever windows are done so far, with provisional labels.
+    """
+    job_dir = os.path.join(BASE_DIR, job_id)
 
-    with open(os.path.join(job_dir, "metadata.json"), "w") as f:
-        json.dump(metadata, f, indent=2)
+    final_path = os.path.join(job_dir, SEGMENTS_FILE)
+    if os.path.exists(final_path):
+        return SegmentTable.load(final_path).to_list(), True
+    legacy_path = os.path.join(job_dir, LEGACY_SEGMENTS_FILE)
+    if os.path.exists(legacy_path):
+        with open(legacy_path) as f:
+            return json.load(f), True
 
-    return {
-        "job_id": job_id,
-        "speakers": metadata
-    }
+    segments = []
+    partial_path = os.path.join(job_dir, PARTIAL_DIARIZATION)
+    if os.path.exists(partial_path):
+        with open(partial_path) as f:
+            for line in f:
+                # The last line may still be mid-write
+                try:
+                    segments.extend(json.loads(line))
+                except ValueError:
+                    break
+    return segments, False
@@ -0,0 +1,185 @@
+import os
+import struct
+
+import numpy as np
+
+from app.audio_utils import wav_layout
+
+# Waveform overviews, stored next to each track as <track>.peaks:
+#
+#   header   "PKS1", levels (H), sample_rate (I), samples_per_peak (I),
+#            frames (Q), then the peak count of every level (Q each)
+#   levels   int16 (min, max) pairs, finest first
+#
+# Level 0 has one pair per SAMPLES_PER_PEAK frames and every further
+# level halves the one before it, down to about MIN_LEVEL_PEAKS pairs.
+# All channels are folded into one pair, which is what a waveform shows.
+
+MAGIC = b"PKS1"
+HEADER = struct.Struct("<4sHIIQ")
+SAMPLES_PER_PEAK = 256
+MIN_LEVEL_PEAKS = 256
+BLOCK_FRAMES = 1 << 20
+
+
+def peaks_path(audio_path: str) -> str:
+    return f"{audio_path}.peaks"
+
+
+def _as_int16(block):
+    if block.dtype == np.int16:
+        return block
+    return (np.clip(block, -1.0, 1.0) * 32767).astype(np.int16)
+
+
+class PeakBuilder:
+    """
+    Folds audio into min/max peaks as it is written. Feed it the same
+    blocks that go to the WAV file, int16 or float in [-1, 1], shaped
+    (frames,) or (frames, channels).
+    """
+
+    def __init__(self, sample_rate: int, samples_per_peak: int = SAMPLES_PER_PEAK):
+        self.sample_rate = sample_rate
+        self.samples_per_peak = samples_per_peak
+        self.frames = 0
+        self._lows = []
+        self._highs = []
+        self._pending_low = np.zeros(0, dtype=np.int16)
+        self._pending_high = np.zeros(0, dtype=np.int16)
+
+    def add(self, block):
+        block = _as_int16(np.asarray(block))
+        if block.ndim == 2:
+            low, high = block.min(axis=1), block.max(axis=1)
+        else:
+            low = high = block
+        self.frames += len(low)
+
+        low = np.concatenate([self._pending_low, low])
+        high = np.concatenate([self._pending_high, high])
+        full = len(low) // self.samples_per_peak * self.samples_per_peak
+
+        if full:
+            self._lows.append(low[:full].reshape(-1, self.samples_per_peak).min(axis=1))
+            self._highs.append(high[:full].reshape(-1, self.samples_per_peak).max(axis=1))
+        self._pending_low = low[full:]
+        self._pending_high = high[full:]
+
+    def _levels(self):
+        lows = self._lows + ([self._pending_low.min(keepdims=True)] if len(self._pending_low) else [])
+        highs = self._highs + ([self._pending_high.max(keepdims=True)] if len(self._pending_high) else [])
+        level = np.stack([
+            np.concatenate(lows) if lows else np.zeros(0, dtype=np.int16),
+            np.concatenate(highs) if highs else np.zeros(0, dtype=np.int16),
+        ], axis=1)
+
+        levels = [level]
+        while len(level) > MIN_LEVEL_PEAKS:
+            if len(level) % 2:
+                level = np.concatenate([level, level[-1:]])
+            pairs = level.reshape(-1, 2, 2)
+            level = np.stack([pairs[:, :, 0].min(axis=1), pairs[:, :, 1].max(axis=1)], axis=1)
+            levels.append(level)
+        return levels
+
+    def write(self, path: str):
+        levels = self._levels()
+        temp_path = f"{path}.part"
+        with open(temp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(levels), self.sample_rate, self.samples_per_peak, self.frames))
+            f.write(struct.pack(f"<{len(levels)}Q", *(len(level) for level in levels)))
+            for level in levels:
+                f.write(level.astype("<i2").tobytes())
+        os.replace(temp_path, path)
+        return path
+
+
+def _pcm_blocks(path: str):
+    """Yields (frames, channels) int16 blocks of any 16/24/32-bit WAV."""
+    layout = wav_layout(path)
+    channels = layout["channels"]
+    bits = layout["bits"]
+    frames = layout["frames"]
+    if not frames:
+        return
+
+    if layout["format"] == 3:
+        dtype, shape = "<f4", (frames, channels)
+    elif bits == 16:
+        dtype, shape = "<i2", (frames, channels)
+    elif bits in (24, 32):
+        dtype, shape = np.uint8, (frames, channels, bits // 8)
+    else:
+        raise ValueError(f"Unsupported sample size {bits} in {path}")
+
+    samples = np.memmap(path, dtype=dtype, mode="r", offset=layout["data_offset"], shape=shape)
+    for start in range(0, frames, BLOCK_FRAMES):
+        block = samples[start:start + BLOCK_FRAMES]
+        if block.ndim == 3:
+            # Little-endian: the top two bytes are the sample at 16 bits
+            block = np.ascontiguousarray(block[..., -2:]).view("<i2")[..., 0]
+        yield block
+
+
+def build_peaks(audio_path: str) -> str:
+    """
+    Builds the peak index of a WAV some other program wrote (ffmpeg),
+    in one sequential read.
+    """
+    builder = PeakBuilder(wav_layout(audio_path)["sample_rate"])
+    for block in _pcm_blocks(audio_path):
+        builder.add(block)
+    return builder.write(peaks_path(audio_path))
+
+
+def read_peaks(path: str, width: int = None, level: int = None, start: float = 0.0, end: float = None):
+    """
+    Returns (info, pairs) for [start, end) seconds. Picks the coarsest
+    level that still has at least width peaks in that span, unless
+    level is given. pairs is an (n, 2) int16 array of (min, max); only
+    that slice is read from disk.
+    """
+    with open(path, "rb") as f:
+        magic, count, sample_rate, samples_per_peak, frames = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"Not a peaks file: {path}")
+        sizes = struct.unpack(f"<{count}Q", f.read(8 * count))
+
+    duration = frames / sample_rate if sample_rate else 0.0
+    end = duration if end is None else min(end, duration)
+    start = max(0.0, min(start, end))
+
+    def span(index):
+        per_peak = samples_per_peak << index
+        first = int(start * sample_rate) // per_peak
+        last = min(sizes[index], -(-int(end * sample_rate) // per_peak))
+        return first, max(first, last)
+
+    if level is None:
+        level = 0
+        if width:
+            for index in range(count):
+                first, last = span(index)
+                if last - first < width:
+                    break
+                level = index
+    level = max(0, min(level, count - 1))
+
+    offset = HEADER.size + 8 * count + 4 * sum(sizes[:level])
+    first, last = span(level)
+    if last > first:
+        pairs = np.fromfile(path, dtype="<i2", count=2 * (last - first), offset=offset + 4 * first)
+    else:
+        pairs = np.zeros(0, dtype="<i2")
+
+    info = {
+        "sample_rate": sample_rate,
+        "samples_per_peak": samples_per_peak << level,
+        "level": level,
+        "levels": count,
+        "start": first * (samples_per_peak << level) / sample_rate,
+        "duration": duration,
+        "peaks": last - first,
+    }
+    return info, pairs.reshape(-1, 2)
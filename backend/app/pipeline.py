@@ -0,0 +1,117 @@
+import os
+import json
+import hashlib
+
+from app.cleanup import delete_path
+
+# A job is a chain of named stages. Each finished stage leaves a
+# checkpoint in <work_dir>/checkpoints/<stage>.json:
+#
+#   key      hash of the stage name, its params and the results of the
+#            stages it reads from
+#   result   whatever the stage returned (JSON)
+#   outputs  the files and folders it wrote
+#
+# Running the same pipeline again skips every stage whose key still
+# matches and whose outputs are all on disk. Changing one stage's params
+# changes its key, and through its result the keys after it, so only
+# that stage and its dependents run again. Before a stage runs, its
+# outputs are deleted, so a half-written run never leaks into the next.
+
+CHECKPOINT_DIR = "checkpoints"
+
+
+def digest(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def file_digest(path: str, block: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(block), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Pipeline:
+    """
+    Stages run in the order they are added; each may only read from
+    stages added before it. on_stage(name, result, skipped) is called
+    after every stage, run or not.
+    """
+
+    def __init__(self, work_dir: str, profile=None, on_stage=None):
+        self.work_dir = work_dir
+        self.profile = profile
+        self.on_stage = on_stage
+        self.stages = []
+        self.results = {}
+        self.ran = []
+        self.skipped = []
+
+    def stage(
+        self, name: str, fn, after=(), params: dict = None, outputs=(), checkpoint: bool = True, scratch=()
+    ):
+        """
+        fn(*results of `after`) -> JSON-able result. outputs are the
+        paths fn writes, relative to work_dir. scratch paths are deleted
+        before fn runs too, but need not exist for the stage to be
+        skipped. Stages that read state from outside the job pass
+        checkpoint=False and run every time.
+        """
+        self.stages.append((name, fn, tuple(after), params or {}, tuple(outputs), checkpoint, tuple(scratch)))
+        return self
+
+    def _checkpoint_path(self, name: str) -> str:
+        return os.path.join(self.work_dir, CHECKPOINT_DIR, f"{name}.json")
+
+    def _load(self, name: str):
+        try:
+            with open(self._checkpoint_path(name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, name: str, checkpoint: dict):
+        path = self._checkpoint_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.part", "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(f"{path}.part", path)
+
+    def run(self) -> dict:
+        for name, fn, after, params, outputs, use_checkpoint, scratch in self.stages:
+            key = digest([name, params, [digest(self.results[dep]) for dep in after]])
+            paths = [os.path.join(self.work_dir, output) for output in outputs]
+
+            checkpoint = self._load(name) if use_checkpoint else None
+            if (
+                checkpoint and checkpoint["key"] == key
+                and all(os.path.exists(path) for path in paths)
+            ):
+                self.results[name] = checkpoint["result"]
+                self.skipped.append(name)
+                if self.on_stage:
+                    self.on_stage(name, checkpoint["result"], True)
+                continue
+
+            # Whatever an interrupted run left behind goes first
+            if os.path.exists(self._checkpoint_path(name)):
+                os.remove(self._checkpoint_path(name))
+            for path in paths + [os.path.join(self.work_dir, path) for path in scratch]:
+                delete_path(path)
+
+            inputs = [self.results[dep] for dep in after]
+            if self.profile is not None:
+                with self.profile.stage(name):
+                    result = fn(*inputs)
+            else:
+                result = fn(*inputs)
+
+            if use_checkpoint:
+                self._save(name, {"key": key, "result": result, "outputs": list(outputs)})
+            self.results[name] = result
+            self.ran.append(name)
+            if self.on_stage:
+                self.on_stage(name, result, False)
+        return self.results
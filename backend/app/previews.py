@@ -1,32 +1,137 @@
 import os
+import wave
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
-def generate_speaker_previews(audio_path, segments, output_dir, duration=5):
-    os.makedirs(output_dir, exist_ok=True)
+import numpy as np
+
+from app.audio_utils import read_wav_memmap
+from app.metrics import bind_stages
+
+# One short clip per speaker, cut from the span that best represents
+# them: among each speaker's PREVIEW_CANDIDATES longest turns, the
+# window of up to PREVIEW_SECONDS with the most speech energy. All clips
+# come from one memory map of the normalized recording, so a speaker
+# who first talks an hour in costs no more than one who opens it.
+
+PREVIEW_SECONDS = float(os.getenv("PREVIEW_SECONDS", "5"))
+# "opus", "mp3", or "wav" (no encoder needed)
+PREVIEW_FORMAT = os.getenv("PREVIEW_FORMAT", "opus")
+PREVIEW_CANDIDATES = 5
+PREVIEW_FADE_SECONDS = 0.02
+PREVIEW_WORKERS = min(4, os.cpu_count() or 1)
+
+PREVIEW_FORMATS = {
+    "opus": (["-c:a", "libopus", "-b:a", "32k", "-f", "ogg"], "opus"),
+    "mp3": (["-c:a", "libmp3lame", "-b:a", "64k", "-f", "mp3"], "mp3"),
+    "wav": (None, "wav"),
+}
+
+
+def pick_spans(segments, samples=None, sample_rate=None, seconds: float = PREVIEW_SECONDS):
+    """
+    {speaker: (start, end)} in seconds: a window of up to `seconds`
+    centred in one of the speaker's turns. With samples, the candidates
+    are ranked by length times RMS; without, by length alone.
+    """
+    if not segments:
+        return {}
+
+    names, codes = np.unique([s["speaker"] for s in segments], return_inverse=True)
+    starts = np.array([s["start"] for s in segments], dtype=np.float64)
+    ends = np.array([s["end"] for s in segments], dtype=np.float64)
+
+    # Each speaker's turns, longest first, and each turn's rank among them
+    order = np.lexsort((starts - ends, codes))
+    group_start = np.searchsorted(codes[order], codes[order])
+    rank = np.arange(len(order)) - group_start
+    candidates = order[rank < PREVIEW_CANDIDATES]
+
+    middles = (starts[candidates] + ends[candidates]) / 2
+    window_starts = np.maximum(starts[candidates], middles - seconds / 2)
+    window_ends = np.minimum(ends[candidates], window_starts + seconds)
+    scores = window_ends - window_starts
 
-    previews = {}
-    seen = set()
+    if samples is not None:
+        for i, (a, b) in enumerate(zip(window_starts, window_ends)):
+            # Every 4th frame is plenty to compare loudness
+            chunk = samples[int(a * sample_rate):int(b * sample_rate):4]
+            if len(chunk):
+                scores[i] *= np.sqrt(np.mean(np.square(chunk, dtype=np.float64)))
 
-    for seg in segments:
-        spk = seg["speaker"]
-        if spk in seen:
-            continue
+    # Best candidate of each speaker
+    best = np.lexsort((-scores, codes[candidates]))
+    first = np.flatnonzero(np.diff(codes[candidates][best], prepend=-1))
+    return {
+        str(names[codes[candidates[i]]]): (float(window_starts[i]), float(window_ends[i]))
+        for i in best[first]
+    }
 
-        preview = os.path.join(output_dir, f"{spk}_preview.wav")
 
-        subprocess.run(
-            [
-                "ffmpeg", "-y",
-                "-i", audio_path,
-                "-ss", str(seg["start"]),
-                "-t", str(duration),
-                preview
-            ],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
-        )
+def _faded(clip, sample_rate):
+    fade = min(int(PREVIEW_FADE_SECONDS * sample_rate), len(clip) // 2)
+    clip = clip.astype(np.float32)
+    if fade:
+        ramp = np.linspace(0.0, 1.0, fade, dtype=np.float32)[:, None]
+        clip[:fade] *= ramp
+        clip[len(clip) - fade:] *= ramp[::-1]
+    return np.rint(clip).astype("<i2")
+
+
+def _write_wav(clip, sample_rate: int, path: str) -> str:
+    with wave.open(path, "wb") as out:
+        out.setnchannels(clip.shape[1])
+        out.setsampwidth(2)
+        out.setframerate(sample_rate)
+        out.writeframes(clip.tobytes())
+    return path
+
+
+def write_preview(clip, sample_rate: int, path: str, fmt: str = PREVIEW_FORMAT) -> str:
+    """
+    Writes a (frames, channels) int16 clip as fmt, with short fades, and
+    returns its path. A preview is not worth failing a job over: if the
+    encoder is missing or fails, the clip is written as WAV next to
+    path instead.
+    """
+    args, _ = PREVIEW_FORMATS[fmt]
+    clip = _faded(np.asarray(clip), sample_rate)
+
+    if args is None:
+        return _write_wav(clip, sample_rate, path)
+
+    try:
+        subprocess.run([
+            "ffmpeg", "-y", "-v", "error",
+            "-f", "s16le", "-ar", str(sample_rate), "-ac", str(clip.shape[1]), "-i", "pipe:0",
+            *args, path
+        ], input=clip.tobytes(), check=True)
+        return path
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Could not encode {path} as {fmt} ({e}), writing WAV instead")
+        if os.path.exists(path):
+            os.remove(path)
+        return _write_wav(clip, sample_rate, f"{os.path.splitext(path)[0]}.wav")
+
+
+def generate_speaker_previews(audio_path, segments, output_dir, duration=PREVIEW_SECONDS, fmt=PREVIEW_FORMAT):
+    """
+    Writes {speaker}_preview.<ext> for every speaker in segments from
+    the 16-bit WAV at audio_path and returns {speaker: path}.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    samples, sample_rate = read_wav_memmap(audio_path)
+    spans = pick_spans(segments, samples, sample_rate, duration)
+    _, ext = PREVIEW_FORMATS[fmt]
 
-        previews[spk] = preview
-        seen.add(spk)
+    def cut(speaker):
+        start, end = spans[speaker]
+        clip = samples[int(start * sample_rate):int(end * sample_rate)]
+        return write_preview(clip, sample_rate, os.path.join(output_dir, f"{speaker}_preview.{ext}"), fmt)
 
-    return previews
+    if not spans:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(PREVIEW_WORKERS, len(spans)), thread_name_prefix="preview") as pool:
+        paths = pool.map(bind_stages(cut), spans)
+        return dict(zip(spans, paths))
@@ -0,0 +1,263 @@
+import os
+
+import numpy as np
+
+# Diarization turns come back as hundreds of short fragments per
+# speaker, and every fragment is one cut in the extractors. Between
+# diarization and extraction they are cleaned up, in this order:
+#   1. same-speaker turns closer than SEGMENT_MERGE_GAP are joined
+#   2. turns still shorter than SEGMENT_MIN_DURATION are dropped
+#   3. the rest are padded by SEGMENT_PAD on both sides (and re-joined
+#      where the padding makes them touch)
+#   4. overlaps between speakers are kept ("keep"), or cut out of every
+#      turn involved ("exclusive"), after which step 2 runs again on
+#      what is left of those turns
+# Everything works on start/end/speaker arrays; nothing loops per turn.
+#
+# Jobs keep their turns as a SegmentTable: one column each for start,
+# end and speaker code, plus the speaker names the codes index. On disk
+# that is a compressed .npz with times in integer milliseconds; the
+# list-of-dicts form is only built when a client asks for JSON.
+
+SEGMENT_MERGE_GAP = float(os.getenv("SEGMENT_MERGE_GAP", "0.5"))
+SEGMENT_MIN_DURATION = float(os.getenv("SEGMENT_MIN_DURATION", "0.3"))
+SEGMENT_PAD = float(os.getenv("SEGMENT_PAD", "0.05"))
+SEGMENT_OVERLAPS = os.getenv("SEGMENT_OVERLAPS", "keep")
+
+OVERLAP_MODES = ("keep", "exclusive")
+
+
+class SegmentTable:
+    """Turns as columns: starts and ends in seconds, codes into speakers."""
+
+    def __init__(self, starts, ends, codes, speakers):
+        self.starts = np.asarray(starts, dtype=np.float64)
+        self.ends = np.asarray(ends, dtype=np.float64)
+        self.codes = np.asarray(codes, dtype=np.int64)
+        self.speakers = np.asarray(speakers, dtype=str)
+
+    @classmethod
+    def from_list(cls, segments):
+        if not segments:
+            return cls([], [], [], [])
+        return cls(*_to_arrays(segments))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def to_list(self) -> list:
+        """[{speaker, start, end}] in order of start."""
+        return _to_segments(self.starts, self.ends, self.codes, self.speakers)
+
+    def to_columns(self) -> dict:
+        """The columns as JSON: far smaller and faster to parse than to_list()."""
+        order = np.lexsort((self.codes, self.starts))
+        return {
+            "speakers": [str(name) for name in self.speakers],
+            "start": np.round(self.starts[order], 2).tolist(),
+            "end": np.round(self.ends[order], 2).tolist(),
+            "speaker": self.codes[order].tolist(),
+        }
+
+    def speaker_order(self) -> list:
+        """Speaker names by first appearance in the recording."""
+        first = np.full(len(self.speakers), np.inf)
+        np.minimum.at(first, self.codes, self.starts)
+        present = np.flatnonzero(np.isfinite(first))
+        return [str(self.speakers[c]) for c in present[np.argsort(first[present], kind="stable")]]
+
+    def by_speaker(self) -> dict:
+        """{speaker: [{speaker, start, end}]}, speakers by first appearance."""
+        grouped = {speaker: [] for speaker in self.speaker_order()}
+        for segment in self.to_list():
+            grouped[segment["speaker"]].append(segment)
+        return grouped
+
+    def speaker_stats(self) -> dict:
+        """
+        {speaker: {talk_seconds, turns, overlap_seconds, overlap_ratio}},
+        speakers by first appearance. overlap_seconds is the time the
+        speaker talks while somebody else does too.
+        """
+        count = len(self.speakers)
+        talk = np.bincount(self.codes, weights=self.ends - self.starts, minlength=count)
+        turns = np.bincount(self.codes, minlength=count)
+
+        overlap = np.zeros(count)
+        if len(self):
+            edges, active = _coverage(self.starts, self.ends, self.codes, count)
+            crowded = active.sum(axis=0) > 1
+            overlap = active[:, crowded] @ np.diff(edges)[crowded]
+
+        index = {str(name): code for code, name in enumerate(self.speakers)}
+        stats = {}
+        for speaker in self.speaker_order():
+            c = index[speaker]
+            stats[speaker] = {
+                "talk_seconds": round(float(talk[c]), 2),
+                "turns": int(turns[c]),
+                "overlap_seconds": round(float(overlap[c]), 2),
+                "overlap_ratio": round(float(overlap[c] / talk[c]), 4) if talk[c] else 0.0,
+            }
+        return stats
+
+    def save(self, path: str):
+        # Milliseconds fit int32 for recordings of up to 24 days
+        with open(f"{path}.part", "wb") as f:
+            np.savez_compressed(
+                f,
+                start_ms=np.round(self.starts * 1000).astype(np.int32),
+                end_ms=np.round(self.ends * 1000).astype(np.int32),
+                speaker=self.codes.astype(np.uint16),
+                speakers=self.speakers,
+            )
+        os.replace(f"{path}.part", path)
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as data:
+            return cls(
+                data["start_ms"] / 1000.0,
+                data["end_ms"] / 1000.0,
+                data["speaker"],
+                data["speakers"],
+            )
+
+
+def _to_arrays(segments):
+    speakers, codes = np.unique([s["speaker"] for s in segments], return_inverse=True)
+    starts = np.array([s["start"] for s in segments], dtype=np.float64)
+    ends = np.array([s["end"] for s in segments], dtype=np.float64)
+    return starts, ends, codes.astype(np.int64), speakers
+
+
+def _to_segments(starts, ends, codes, speakers):
+    order = np.lexsort((codes, starts))
+    return [
+        {"speaker": str(speakers[c]), "start": round(float(s), 2), "end": round(float(e), 2)}
+        for s, e, c in zip(starts[order], ends[order], codes[order])
+    ]
+
+
+def merge_gaps(starts, ends, codes, gap: float):
+    """
+    Joins each speaker's turns that overlap or are less than gap apart.
+    Returns new (starts, ends, codes), sorted by speaker then start.
+    """
+    if not len(starts):
+        return starts, ends, codes
+
+    order = np.lexsort((starts, codes))
+    starts, ends, codes = starts[order], ends[order], codes[order]
+
+    # Shifting each speaker onto its own stretch of the time axis lets a
+    # single running maximum cover every speaker at once
+    shift = codes * (ends.max() + gap + 1.0)
+    reach = np.maximum.accumulate(ends + shift)
+    new = np.empty(len(starts), dtype=bool)
+    new[0] = True
+    new[1:] = (starts[1:] + shift[1:]) > reach[:-1] + gap
+
+    first = np.flatnonzero(new)
+    last = np.append(first[1:] - 1, len(starts) - 1)
+    return starts[first], reach[last] - shift[last], codes[first]
+
+
+def _coverage(starts, ends, codes, speakers: int):
+    """
+    The elementary spans between consecutive turn edges, and for each
+    speaker whether any of their turns covers each span.
+    Returns (edges, active) with active of shape (speakers, len(edges) - 1).
+    """
+    edges, inverse = np.unique(np.concatenate([starts, ends]), return_inverse=True)
+    first, last = inverse[:len(starts)], inverse[len(starts):]
+    delta = np.zeros((speakers, len(edges)), dtype=np.int64)
+    np.add.at(delta, (codes, first), 1)
+    np.add.at(delta, (codes, last), -1)
+    return edges, np.cumsum(delta, axis=1)[:, :-1] > 0
+
+
+def drop_overlaps(starts, ends, codes):
+    """
+    Removes every stretch where more than one speaker is talking.
+    Returns new (starts, ends, codes) of the single-speaker remainder.
+    """
+    if not len(starts):
+        return starts, ends, codes
+
+    edges, active = _coverage(starts, ends, codes, codes.max() + 1)
+
+    alone = active.sum(axis=0) == 1
+    spans = np.flatnonzero(alone)
+    owner = active[:, spans].argmax(axis=0)
+    return merge_gaps(edges[spans], edges[spans + 1], owner, 0.0)
+
+
+def clean(
+    table: SegmentTable,
+    merge_gap: float = None,
+    min_duration: float = None,
+    pad: float = None,
+    overlaps: str = None,
+    duration: float = None
+):
+    """
+    Cleans up diarization turns before extraction (see the steps above).
+    Returns (table, report), where report counts the turns going in
+    and out; each turn removed is one cut the extractors do not make.
+    """
+    merge_gap = SEGMENT_MERGE_GAP if merge_gap is None else merge_gap
+    min_duration = SEGMENT_MIN_DURATION if min_duration is None else min_duration
+    pad = SEGMENT_PAD if pad is None else pad
+    overlaps = overlaps or SEGMENT_OVERLAPS
+    if overlaps not in OVERLAP_MODES:
+        raise ValueError(f"overlaps must be one of {', '.join(OVERLAP_MODES)}")
+
+    report = {"turns_in": len(table)}
+    if not len(table):
+        return table, {**report, "turns_out": 0, "cuts_saved": 0, "dropped_seconds": 0.0}
+
+    starts, ends, codes = merge_gaps(table.starts, table.ends, table.codes, merge_gap)
+
+    keep = ends - starts >= min_duration
+    dropped = float((ends - starts)[~keep].sum())
+    starts, ends, codes = starts[keep], ends[keep], codes[keep]
+
+    if pad and len(starts):
+        starts = np.maximum(starts - pad, 0.0)
+        ends = ends + pad if duration is None else np.minimum(ends + pad, duration)
+        starts, ends, codes = merge_gaps(starts, ends, codes, 0.0)
+
+    if overlaps == "exclusive":
+        starts, ends, codes = drop_overlaps(starts, ends, codes)
+        keep = ends - starts >= min_duration
+        dropped += float((ends - starts)[~keep].sum())
+        starts, ends, codes = starts[keep], ends[keep], codes[keep]
+
+    order = np.lexsort((codes, starts))
+    cleaned = SegmentTable(
+        np.round(starts[order], 2), np.round(ends[order], 2), codes[order], table.speakers
+    )
+    report.update({
+        "turns_out": len(cleaned),
+        # Cutting overlaps out can split a turn into more pieces than went in
+        "cuts_saved": max(0, len(table) - len(cleaned)),
+        "dropped_seconds": round(dropped, 2),
+    })
+    return cleaned, report
+
+
+def postprocess(segments, **options):
+    """clean() for a list of {speaker, start, end}; returns (segments, report)."""
+    table, report = clean(SegmentTable.from_list(segments), **options)
+    return table.to_list(), report
+
+
+def params():
+    """The settings that change clean() output, for cache keys."""
+    return {
+        "merge_gap": SEGMENT_MERGE_GAP,
+        "min_duration": SEGMENT_MIN_DURATION,
+        "pad": SEGMENT_PAD,
+        "overlaps": SEGMENT_OVERLAPS,
+    }
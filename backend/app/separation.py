@@ -2,6 +2,9 @@ import os
 import subprocess
 from collections import defaultdict
 
+from app.audio_utils import read_wav_memmap
+from app.previews import write_preview, PREVIEW_FORMAT, PREVIEW_FORMATS
+
 OUTPUT_ROOT = os.path.join("outputs", "separation")
 PREVIEW_DURATION = 5
 
@@ -67,14 +70,12 @@ def separate_by_speaker(audio_path: str, segments: list):
 
         created_files.append(speaker_file)
 
-        # 5️⃣ Preview
-        preview_path = os.path.join(output_dir, f"{speaker}_preview.wav")
-        subprocess.run([
-            "ffmpeg", "-y",
-            "-i", speaker_file,
-            "-t", str(PREVIEW_DURATION),
-            preview_path
-        ], check=True)
+        # 5️⃣ Preview, straight from the file just written
+        samples, sample_rate = read_wav_memmap(speaker_file)
+        preview_path = os.path.join(
+            output_dir, f"{speaker}_preview.{PREVIEW_FORMATS[PREVIEW_FORMAT][1]}"
+        )
+        preview_path = write_preview(samples[:int(PREVIEW_DURATION * sample_rate)], sample_rate, preview_path)
 
         preview_files[speaker] = preview_path
 
@@ -2,6 +2,8 @@ import os
 import subprocess
 from collections import defaultdict
 
+from app.peaks import build_peaks
+
 def separate_by_speaker_concat(audio_path, segments, output_dir):
     os.makedirs(output_dir, exist_ok=True)
 
@@ -43,6 +45,9 @@ def separate_by_speaker_concat(audio_path, segments, output_dir):
             os.remove(os.path.join(output_dir, f"{speaker}_{i}.wav"))
         os.remove(list_file)
 
+        # ffmpeg wrote the track, so the peaks take one read of it
+        build_peaks(final_audio)
+
         outputs[speaker] = final_audio
 
     return outputs
@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import uuid
+import threading
+
+import numpy as np
+
+# Known voices across every job. Each enrolled speaker is one row: the
+# running sum of its unit-length embeddings, plus that sum normalized,
+# so a query is a single matrix-vector product over all speakers.
+#
+#   index.npz   vectors: (speakers, dim) float32 sums
+#               speakers: one JSON record per row, in row order
+#
+# Both live in one file replaced in a single rename, so a reader never
+# pairs new rows with old records; its mtime tells other web processes
+# when to reload. Every row has the diarization model's embedding size:
+# a voiceprint of another size (e.g. after a model change) is refused.
+
+SPEAKER_INDEX_DIR = "outputs/speakers"
+# Cosine similarity from which a job's speaker is labelled as a known one
+SPEAKER_MATCH_SIMILARITY = float(os.getenv("SPEAKER_MATCH_SIMILARITY", "0.6"))
+JOB_EMBEDDINGS = "embeddings.npz"
+
+_sums = None
+_units = None
+_speakers = []
+_loaded_mtime = None
+_lock = threading.Lock()
+
+
+def _index_path():
+    return os.path.join(SPEAKER_INDEX_DIR, "index.npz")
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return (vectors / np.where(norms == 0, 1, norms)).astype(np.float32)
+
+
+def _load():
+    global _sums, _units, _speakers, _loaded_mtime
+    index_path = _index_path()
+    try:
+        mtime = os.stat(index_path).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+
+    if _sums is not None and mtime == _loaded_mtime:
+        return
+
+    if mtime is None:
+        _sums, _speakers = None, []
+    else:
+        with np.load(index_path) as data:
+            _speakers = json.loads(str(data["speakers"]))
+            _sums = data["vectors"] if _speakers else None
+    _units = _normalize(_sums) if _sums is not None else None
+    _loaded_mtime = mtime
+
+
+def _save():
+    global _loaded_mtime
+    os.makedirs(SPEAKER_INDEX_DIR, exist_ok=True)
+    index_path = _index_path()
+
+    with open(f"{index_path}.part", "wb") as f:
+        np.savez(
+            f,
+            vectors=_sums if _sums is not None else np.zeros((0, 0), dtype=np.float32),
+            speakers=np.array(json.dumps(_speakers))
+        )
+    os.replace(f"{index_path}.part", index_path)
+    _loaded_mtime = os.stat(index_path).st_mtime_ns
+
+
+def _row(speaker_id: str) -> int:
+    for i, speaker in enumerate(_speakers):
+        if speaker["speaker_id"] == speaker_id:
+            return i
+    raise KeyError(speaker_id)
+
+
+def _check_dimension(vectors):
+    if _sums is not None and vectors.shape[-1] != _sums.shape[1]:
+        raise ValueError(
+            f"Voiceprint has {vectors.shape[-1]} dimensions, the index {_sums.shape[1]}"
+        )
+
+
+def enroll(name: str, embedding, speaker_id: str = None, source: dict = None) -> dict:
+    """
+    Adds a voice sample. With speaker_id it refines that speaker's
+    voiceprint; otherwise it creates a new speaker called name. Raises
+    ValueError if the embedding's size does not match the index.
+    """
+    global _sums, _units
+    unit = _normalize(np.asarray(embedding, dtype=np.float32))
+
+    with _lock:
+        _load()
+        _check_dimension(unit)
+        if speaker_id:
+            row = _row(speaker_id)
+            _sums[row] += unit
+            _units[row] = _normalize(_sums[row])
+            record = _speakers[row]
+            record["samples"] += 1
+            if name:
+                record["name"] = name
+        else:
+            record = {
+                "speaker_id": f"spk_{uuid.uuid4().hex[:8]}",
+                "name": name,
+                "samples": 1,
+                "created_at": time.time(),
+            }
+            _speakers.append(record)
+            _sums = unit[None] if _sums is None else np.vstack([_sums, unit])
+            _units = _normalize(_sums)
+
+        if source:
+            record.setdefault("sources", []).append(source)
+        _save()
+        return dict(record)
+
+
+def search(embeddings, top_k: int = 5):
+    """
+    Nearest enrolled speakers for each row of embeddings (queries, dim).
+    Returns one list of {speaker_id, name, similarity} per query; raises
+    ValueError if dim does not match the index.
+    """
+    queries = _normalize(np.atleast_2d(np.asarray(embeddings, dtype=np.float32)))
+    with _lock:
+        _load()
+        _check_dimension(queries)
+        units, speakers = _units, list(_speakers)
+
+    if units is None:
+        return [[] for _ in queries]
+
+    similarity = queries @ units.T
+    k = min(top_k, len(speakers))
+    # argpartition first: only k of the tens of thousands get sorted
+    best = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+
+    results = []
+    for row, candidates in zip(similarity, best):
+        ranked = candidates[np.argsort(-row[candidates])]
+        results.append([
+            {**_public(speakers[i]), "similarity": round(float(row[i]), 4)}
+            for i in ranked
+        ])
+    return results
+
+
+def identify(embeddings: dict) -> dict:
+    """
+    Maps a job's speaker labels to known speakers. Labels without a match
+    above SPEAKER_MATCH_SIMILARITY are left out.
+    """
+    labels = list(embeddings)
+    if not labels:
+        return {}
+
+    try:
+        results = search([embeddings[l] for l in labels], top_k=1)
+    except ValueError:
+        # Voiceprints from another model cannot match anyone enrolled
+        return {}
+
+    matches = {}
+    for label, found in zip(labels, results):
+        if found and found[0]["similarity"] >= SPEAKER_MATCH_SIMILARITY:
+            matches[label] = found[0]
+    return matches
+
+
+def _public(record: dict) -> dict:
+    return {k: record[k] for k in ("speaker_id", "name", "samples", "created_at")}
+
+
+def list_speakers():
+    with _lock:
+        _load()
+        return [_public(s) for s in _speakers]
+
+
+def remove_speaker(speaker_id: str):
+    global _sums, _units
+    with _lock:
+        _load()
+        row = _row(speaker_id)
+        del _speakers[row]
+        _sums = np.delete(_sums, row, axis=0) if _speakers else None
+        _units = _normalize(_sums) if _sums is not None else None
+        _save()
+
+
+def save_job_embeddings(job_dir: str, embeddings: dict):
+    # Silence, or speakers with no usable voiceprint, leave nothing to
+    # enroll; the file is still written, as the diarize stage's output
+    labels = sorted(embeddings)
+    if labels:
+        vectors = np.array([embeddings[l] for l in labels], dtype=np.float32).reshape(len(labels), -1)
+    else:
+        vectors = np.zeros((0, 0), dtype=np.float32)
+    np.savez(
+        os.path.join(job_dir, JOB_EMBEDDINGS),
+        labels=np.array(labels, dtype=str),
+        vectors=vectors
+    )
+
+
+def load_job_embeddings(job_dir: str) -> dict:
+    path = os.path.join(job_dir, JOB_EMBEDDINGS)
+    if not os.path.exists(path):
+        return {}
+    with np.load(path) as data:
+        return {str(label): vector for label, vector in zip(data["labels"], data["vectors"])}
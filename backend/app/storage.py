@@ -0,0 +1,210 @@
+import os
+import time
+import shutil
+import logging
+import threading
+
+from app import job_store
+from app.jobs import forget_job
+from app.cleanup import delete_path, path_size
+
+# One background thread sweeps storage every STORAGE_SWEEP_SECONDS:
+#   1. finished jobs not downloaded for JOB_TTL_HOURS lose their files
+#   2. while the disk is above DISK_HIGH_WATERMARK, the least recently
+#      downloaded jobs go first until it is back under DISK_LOW_WATERMARK.
+#      What each job frees is counted from its own files, and only the
+#      bytes the job store has recorded for jobs can be freed this way:
+#      when the rest of the disk alone is over the low watermark, nothing
+#      is evicted, since removing every job would not get it back under
+#   3. anything in the scratch folders that no job owns is removed once
+#      it is older than SCRATCH_TTL_HOURS
+# All state lives in the job store and on disk, so a restart just picks
+# up where the last sweep left off.
+
+STORAGE_SWEEP_SECONDS = int(os.getenv("STORAGE_SWEEP_SECONDS", "60"))
+JOB_TTL_HOURS = float(os.getenv("JOB_TTL_HOURS", "24"))
+SCRATCH_TTL_HOURS = float(os.getenv("SCRATCH_TTL_HOURS", "6"))
+DISK_HIGH_WATERMARK = float(os.getenv("DISK_HIGH_WATERMARK", "0.85"))
+DISK_LOW_WATERMARK = float(os.getenv("DISK_LOW_WATERMARK", "0.75"))
+STORAGE_ROOT = "outputs"
+
+# (folder, suffix) pairs whose entries are swept when nothing owns them
+SCRATCH_DIRS = [
+    ("uploads", None),
+    ("outputs/normalized", None),
+    ("outputs/transcoded", None),
+    ("outputs/batches", None),
+    ("outputs/jobs", None),
+    ("outputs/enhanced", None),
+    ("outputs/demucs/htdemucs", None),
+    ("outputs/demucs/htdemucs_ft", None),
+    # Loose archives written by zip_folder and friends
+    ("outputs", ".zip"),
+]
+
+BATCH_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+_stats = {"sweeps": 0, "expired_jobs": 0, "evicted_jobs": 0, "scratch_removed": 0, "last_sweep": None}
+_lock = threading.Lock()
+_stop = threading.Event()
+_thread = None
+
+
+def _remove_job(job_id: str):
+    for path in job_store.job_paths(job_id):
+        delete_path(path)
+    job_store.mark_expired(job_id)
+    forget_job(job_id)
+
+
+def _pinned_paths() -> set:
+    # Imported lazily: the cache imports cleanup, which this module uses too
+    from app.cache import pinned_paths
+    return pinned_paths()
+
+
+def _job_pinned(job_id: str, pinned: set) -> bool:
+    return any(os.path.normpath(path) in pinned for path in job_store.job_paths(job_id))
+
+
+def _expire_jobs(now: float, pinned: set) -> int:
+    cutoff = now - JOB_TTL_HOURS * 3600
+    expired = 0
+    skipped = set()
+
+    while True:
+        batch = [
+            job for job in job_store.least_recently_used(before=cutoff, limit=BATCH_SIZE + len(skipped))
+            if job["job_id"] not in skipped
+        ]
+        if not batch:
+            return expired
+
+        for job in batch:
+            # Cached results stay until the cache evicts them, or until
+            # the watermark below needs the space
+            if _job_pinned(job["job_id"], pinned):
+                skipped.add(job["job_id"])
+                continue
+            _remove_job(job["job_id"])
+            expired += 1
+
+
+def disk_usage_fraction(path: str = STORAGE_ROOT) -> float:
+    usage = shutil.disk_usage(path)
+    return usage.used / usage.total if usage.total else 0.0
+
+
+def _enforce_watermark() -> int:
+    usage = shutil.disk_usage(STORAGE_ROOT)
+    if not usage.total or usage.used / usage.total < DISK_HIGH_WATERMARK:
+        return 0
+
+    to_free = usage.used - DISK_LOW_WATERMARK * usage.total
+    others = usage.used - job_store.stored_bytes()
+    if others / usage.total > DISK_LOW_WATERMARK:
+        logger.warning(
+            "Disk is %.0f%% full, mostly outside the jobs' files; "
+            "evicting jobs would not bring it under %.0f%%",
+            100 * usage.used / usage.total, 100 * DISK_LOW_WATERMARK
+        )
+        return 0
+
+    evicted = 0
+    while to_free > 0:
+        batch = job_store.least_recently_used(limit=BATCH_SIZE)
+        if not batch:
+            break
+        for job in batch:
+            paths = job_store.job_paths(job["job_id"])
+            to_free -= sum(path_size(path) for path in paths if os.path.exists(path))
+            # A cache entry whose files are gone is dropped on its next lookup
+            _remove_job(job["job_id"])
+            evicted += 1
+            if to_free <= 0:
+                break
+    return evicted
+
+
+def _sweep_scratch(now: float, pinned: set) -> int:
+    cutoff = now - SCRATCH_TTL_HOURS * 3600
+    removed = 0
+
+    for folder, suffix in SCRATCH_DIRS:
+        if not os.path.isdir(folder):
+            continue
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if suffix and not (entry.is_file() and entry.name.endswith(suffix)):
+                    continue
+                try:
+                    if entry.stat(follow_symlinks=False).st_mtime >= cutoff:
+                        continue
+                except FileNotFoundError:
+                    continue
+                if job_store.path_owner(entry.path) or os.path.normpath(entry.path) in pinned:
+                    continue
+                delete_path(entry.path)
+                removed += 1
+    return removed
+
+
+def sweep() -> dict:
+    """Runs one full pass and returns what it removed."""
+    now = time.time()
+    pinned = _pinned_paths()
+    report = {
+        "expired_jobs": _expire_jobs(now, pinned),
+        "evicted_jobs": _enforce_watermark(),
+        "scratch_removed": _sweep_scratch(now, pinned),
+    }
+
+    with _lock:
+        _stats["sweeps"] += 1
+        _stats["last_sweep"] = now
+        for key, value in report.items():
+            _stats[key] += value
+    return report
+
+
+def _loop():
+    while not _stop.is_set():
+        try:
+            sweep()
+        except Exception:
+            # A bad sweep must not kill the manager for good
+            logger.exception("Storage sweep failed")
+        _stop.wait(STORAGE_SWEEP_SECONDS)
+
+
+def start():
+    global _thread
+    if _thread and _thread.is_alive():
+        return
+    os.makedirs(STORAGE_ROOT, exist_ok=True)
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, name="storage-manager", daemon=True)
+    _thread.start()
+
+
+def stop():
+    _stop.set()
+    if _thread:
+        _thread.join(timeout=5)
+
+
+def storage_stats():
+    with _lock:
+        stats = dict(_stats)
+    usage = shutil.disk_usage(STORAGE_ROOT) if os.path.isdir(STORAGE_ROOT) else None
+    return {
+        **stats,
+        "disk_used_bytes": usage.used if usage else None,
+        "disk_total_bytes": usage.total if usage else None,
+        "high_watermark": DISK_HIGH_WATERMARK,
+        "low_watermark": DISK_LOW_WATERMARK,
+        "job_ttl_hours": JOB_TTL_HOURS,
+        "scratch_ttl_hours": SCRATCH_TTL_HOURS,
+    }
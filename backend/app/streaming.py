@@ -0,0 +1,208 @@
+import os
+import uuid
+import hashlib
+import subprocess
+from email.utils import formatdate
+from urllib.parse import quote
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, StreamingResponse
+
+CHUNK_SIZE = 256 * 1024
+TRANSCODE_DIR = "outputs/transcoded"
+
+TRANSCODE_FORMATS = {
+    "opus": {
+        "args": ["-c:a", "libopus", "-b:a", "96k", "-f", "ogg"],
+        "ext": "opus",
+        "media_type": "audio/ogg",
+    },
+    "mp3": {
+        "args": ["-c:a", "libmp3lame", "-q:a", "2", "-f", "mp3"],
+        "ext": "mp3",
+        "media_type": "audio/mpeg",
+    },
+    "flac": {
+        "args": ["-c:a", "flac", "-f", "flac"],
+        "ext": "flac",
+        "media_type": "audio/flac",
+    },
+}
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def content_disposition(filename: str) -> str:
+    # Same header FileResponse would send
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def parse_range(header: str, size: int):
+    """
+    Parses a single "bytes=" range into (start, end) with end exclusive.
+    Returns None when the whole file should be sent instead.
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+
+    spec = header[len("bytes="):].strip()
+    if "," in spec:
+        # Multipart byteranges are not worth it for audio; players only
+        # ever ask for one range
+        return None
+
+    first, _, last = spec.partition("-")
+    try:
+        if first == "":
+            length = int(last)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            start, end = max(size - length, 0), size
+        else:
+            start = int(first)
+            end = int(last) + 1 if last else size
+    except ValueError:
+        return None
+
+    end = min(end, size)
+    if start >= size or start >= end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+class RangeFileResponse(Response):
+    """
+    FileResponse with single-range support. The body goes out through the
+    ASGI zero-copy extension (sendfile) when the server offers it, and
+    as pread() chunks otherwise.
+    """
+
+    def __init__(self, path: str, range_header: str = None, media_type: str = None, filename: str = None):
+        self.path = path
+        self.status_code = 200
+        self.media_type = media_type
+        self.background = None
+
+        stat = os.stat(path)
+        self.size = stat.st_size
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+        self.start, self.end = 0, self.size
+        headers = {
+            "accept-ranges": "bytes",
+            "etag": etag,
+            "last-modified": formatdate(stat.st_mtime, usegmt=True),
+        }
+        if filename:
+            headers["content-disposition"] = content_disposition(filename)
+
+        try:
+            byte_range = parse_range(range_header, self.size)
+        except RangeNotSatisfiable:
+            byte_range = None
+            self.status_code = 416
+            self.start = self.end = 0
+            headers["content-range"] = f"bytes */{self.size}"
+
+        if byte_range:
+            self.status_code = 206
+            self.start, self.end = byte_range
+            headers["content-range"] = f"bytes {self.start}-{self.end - 1}/{self.size}"
+
+        headers["content-length"] = str(self.end - self.start)
+        self.init_headers(headers)
+
+    async def __call__(self, scope, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+
+        if scope.get("method") == "HEAD" or self.end == self.start:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        with open(self.path, "rb") as f:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f,
+                    "offset": self.start,
+                    "count": self.end - self.start,
+                })
+                return
+
+            fd = f.fileno()
+            offset = self.start
+            while offset < self.end:
+                size = min(CHUNK_SIZE, self.end - offset)
+                chunk = await run_in_threadpool(os.pread, fd, size, offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": offset < self.end,
+                })
+            if offset < self.end:
+                # File shrank underneath us
+                await send({"type": "http.response.body", "body": b""})
+
+
+def transcoded_path(source: str, fmt: str) -> str:
+    stat = os.stat(source)
+    key = f"{os.path.abspath(source)}:{stat.st_mtime_ns}:{stat.st_size}:{fmt}"
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return os.path.join(TRANSCODE_DIR, f"{digest}.{TRANSCODE_FORMATS[fmt]['ext']}")
+
+
+def transcode_stream(source: str, fmt: str, filename: str = None) -> StreamingResponse:
+    """
+    Streams source through an ffmpeg encoder while writing the encoded
+    bytes to the transcode cache. The cache file only appears once the
+    whole encode finished, so a dropped client never leaves a truncated
+    file behind.
+    """
+    spec = TRANSCODE_FORMATS[fmt]
+    cache_path = transcoded_path(source, fmt)
+    os.makedirs(TRANSCODE_DIR, exist_ok=True)
+    # Concurrent first requests each encode to their own temp file
+    temp_path = f"{cache_path}.{uuid.uuid4().hex[:8]}.part"
+
+    async def body():
+        proc = subprocess.Popen(
+            ["ffmpeg", "-v", "error", "-i", source, "-vn", *spec["args"], "pipe:1"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        complete = False
+        try:
+            with open(temp_path, "wb") as out:
+                while True:
+                    chunk = await run_in_threadpool(proc.stdout.read, CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    await run_in_threadpool(out.write, chunk)
+                    yield chunk
+            complete = await run_in_threadpool(proc.wait) == 0
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            if complete:
+                os.replace(temp_path, cache_path)
+            elif os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    headers = {}
+    if filename:
+        headers["content-disposition"] = content_disposition(filename)
+
+    return StreamingResponse(body(), media_type=spec["media_type"], headers=headers)
@@ -0,0 +1,174 @@
+import os
+import uuid
+import shutil
+import tempfile
+
+from app import audio_utils, demucs_runner, denoise_runner, inference, separation_concat
+from app.broker import get_broker, new_task_id
+from app.object_store import get_object_store
+
+# The heavy stages as tasks a worker node can run (python -m app.worker).
+# A task reads its inputs from local paths and writes its files into one
+# output folder; it returns JSON that names those files relative to it.
+#
+# run_task() runs it right here when TASK_BROKER is unset. Otherwise the
+# inputs go to the object store under tasks/<task_id>/in, a worker picks
+# the task from the broker, and everything it wrote comes back through
+# tasks/<task_id>/out into the caller's output folder.
+#
+# The functions at the bottom keep the signatures of the ones they
+# stand in for, so callers switch by changing an import.
+
+TASK_PREFIX = "tasks"
+
+
+def _normalize_audio(inputs, out_dir, output_name):
+    audio_utils.normalize_audio(inputs["audio"], os.path.join(out_dir, output_name))
+    return output_name
+
+
+def _diarize(inputs, out_dir, return_embeddings=False):
+    return inference.diarize(inputs["audio"], None, return_embeddings)
+
+
+def _separate_by_speaker_concat(inputs, out_dir, segments):
+    tracks = separation_concat.separate_by_speaker_concat(inputs["audio"], segments, out_dir)
+    return {speaker: os.path.relpath(path, out_dir) for speaker, path in tracks.items()}
+
+
+def _run_demucs(inputs, out_dir):
+    stems = inference.separate_music(inputs["audio"], out_dir)
+    return {stem: os.path.relpath(path, out_dir) for stem, path in stems.items()}
+
+
+def _run_denoise(inputs, out_dir, output_name):
+    denoise_runner.denoise_file(inputs["audio"], os.path.join(out_dir, output_name))
+    return output_name
+
+
+TASKS = {
+    "normalize_audio": _normalize_audio,
+    "diarize": _diarize,
+    "separate_by_speaker_concat": _separate_by_speaker_concat,
+    "run_demucs": _run_demucs,
+    "run_denoise": _run_denoise,
+}
+
+
+def _files_under(root: str) -> list:
+    files = []
+    for folder, _, names in os.walk(root):
+        for name in names:
+            files.append(os.path.relpath(os.path.join(folder, name), root))
+    return sorted(files)
+
+
+def execute(task: str, payload: dict, scratch_dir: str):
+    """
+    Worker side: fetches the inputs, runs the task in scratch_dir and
+    uploads what it wrote. Returns {"data", "files"} for the broker.
+    """
+    store = get_object_store()
+    prefix = payload["prefix"]
+    in_dir = os.path.join(scratch_dir, "in")
+    out_dir = os.path.join(scratch_dir, "out")
+    os.makedirs(out_dir, exist_ok=True)
+    try:
+        inputs = {
+            name: store.get(key, os.path.join(in_dir, name, os.path.basename(key)))
+            for name, key in payload["inputs"].items()
+        }
+        data = TASKS[task](inputs, out_dir, **payload["args"])
+        files = _files_under(out_dir)
+        for rel in files:
+            store.put(os.path.join(out_dir, rel), f"{prefix}/out/{rel}")
+        return {"data": data, "files": files}
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def run_task(task: str, inputs: dict, out_dir: str, **args):
+    """
+    Runs task on {name: local path} inputs, leaving its files in out_dir.
+    Returns the task's JSON result.
+    """
+    if task not in TASKS:
+        raise ValueError(f"Unknown task: {task}")
+    os.makedirs(out_dir, exist_ok=True)
+
+    broker = get_broker()
+    if broker is None:
+        return TASKS[task](inputs, out_dir, **args)
+
+    store = get_object_store()
+    task_id = new_task_id()
+    prefix = f"{TASK_PREFIX}/{task_id}"
+    try:
+        keys = {
+            name: store.put(path, f"{prefix}/in/{name}/{os.path.basename(path)}")
+            for name, path in inputs.items()
+        }
+        broker.submit(task, {"inputs": keys, "args": args, "prefix": prefix}, task_id)
+        result = broker.wait(task_id)
+        for rel in result["files"]:
+            store.get(f"{prefix}/out/{rel}", os.path.join(out_dir, rel))
+        return result["data"]
+    finally:
+        store.delete_prefix(prefix)
+
+
+# --- Drop-in replacements for the callers ---
+
+def normalize_audio(input_path: str, output_path: str = None) -> str:
+    output_path = output_path or os.path.join(audio_utils.NORMALIZED_DIR, f"{uuid.uuid4().hex}.wav")
+    out_dir = os.path.dirname(output_path) or "."
+    return os.path.join(out_dir, run_task(
+        "normalize_audio", {"audio": input_path}, out_dir, output_name=os.path.basename(output_path)
+    ))
+
+
+def diarize(audio_path: str, partial_path: str = None, return_embeddings: bool = False):
+    if get_broker() is None:
+        return inference.diarize(audio_path, partial_path, return_embeddings)
+
+    # Window checkpoints stay on the worker; a retried task starts over
+    scratch_dir = tempfile.mkdtemp(prefix="diarize_")
+    try:
+        result = run_task("diarize", {"audio": audio_path}, scratch_dir, return_embeddings=return_embeddings)
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    return tuple(result) if return_embeddings else result
+
+
+def separate_by_speaker_concat(audio_path, segments, output_dir):
+    tracks = run_task("separate_by_speaker_concat", {"audio": audio_path}, output_dir, segments=segments)
+    return {speaker: os.path.join(output_dir, rel) for speaker, rel in tracks.items()}
+
+
+def run_demucs(input_audio: str, output_base: str = "outputs/demucs", name: str = None):
+    if get_broker() is None:
+        return demucs_runner.run_demucs(input_audio, output_base, name)
+    if not os.path.exists(input_audio):
+        raise FileNotFoundError(f"Audio not found: {input_audio}")
+
+    name = name or os.path.splitext(os.path.basename(input_audio))[0]
+    output_dir = os.path.join(output_base, demucs_runner.DEMUCS_MODEL, name)
+
+    print(f"Running Demucs on {input_audio}...")
+    stems = run_task("run_demucs", {"audio": input_audio}, output_dir)
+    return {stem: os.path.join(output_dir, rel) for stem, rel in stems.items()}
+
+
+def run_denoise(input_audio: str, output_base: str = "outputs/enhanced", job_id: str = None):
+    if get_broker() is None:
+        return denoise_runner.run_denoise(input_audio, output_base, job_id)
+    if not os.path.exists(input_audio):
+        raise FileNotFoundError(f"Audio not found: {input_audio}")
+
+    job_id = job_id or f"clean_{uuid.uuid4().hex[:8]}"
+    job_dir = os.path.join(output_base, job_id)
+    name, _ = os.path.splitext(os.path.basename(input_audio))
+
+    print(f"Running Audio Enhancement on {input_audio}...")
+    output_name = run_task("run_denoise", {"audio": input_audio}, job_dir, output_name=f"{name}_cleaned.wav")
+    return os.path.join(job_dir, output_name), job_id
@@ -0,0 +1,110 @@
+import os
+import socket
+import argparse
+import threading
+import traceback
+import uuid
+
+from app.broker import get_broker, HEARTBEAT_SECONDS
+from app.tasks import TASKS, execute
+
+# A worker node: python -m app.worker --tasks diarize run_demucs --slots 2
+#
+# Each slot is a thread that claims one task at a time from TASK_BROKER,
+# so a node never takes on more than it advertised. The heartbeat tells
+# the API host which tasks this node runs and how many slots are free,
+# and doubles as the sweep that requeues tasks of nodes that went silent.
+
+WORKER_SCRATCH_DIR = os.getenv("WORKER_SCRATCH_DIR", "outputs/worker")
+
+
+class Worker:
+    def __init__(self, tasks=None, slots: int = 1, scratch_dir: str = WORKER_SCRATCH_DIR):
+        self.broker = get_broker()
+        if self.broker is None:
+            raise SystemExit("TASK_BROKER is not set; tasks run in the API process")
+        unknown = set(tasks or ()) - set(TASKS)
+        if unknown:
+            raise SystemExit(f"Unknown task(s): {', '.join(sorted(unknown))}")
+
+        self.tasks = list(tasks or TASKS)
+        self.slots = slots
+        self.scratch_dir = scratch_dir
+        self.worker_id = f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}"
+        self.busy = 0
+        self._busy_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def capacity(self) -> dict:
+        with self._busy_lock:
+            busy = self.busy
+        return {
+            "host": socket.gethostname(),
+            "tasks": self.tasks,
+            "slots": self.slots,
+            "free": self.slots - busy,
+            "cpu_count": os.cpu_count(),
+        }
+
+    def _heartbeat(self):
+        while not self._stop.is_set():
+            try:
+                self.broker.heartbeat(self.worker_id, self.capacity())
+                requeued = self.broker.requeue_stale()
+                if requeued:
+                    print(f"Requeued {requeued} task(s) from silent workers")
+            except Exception:
+                traceback.print_exc()
+            self._stop.wait(HEARTBEAT_SECONDS)
+
+    def _slot(self):
+        while not self._stop.is_set():
+            claimed = self.broker.claim(self.worker_id, self.tasks, timeout=HEARTBEAT_SECONDS)
+            if claimed is None:
+                continue
+            task_id, task, payload = claimed
+            with self._busy_lock:
+                self.busy += 1
+            print(f"{task_id}: {task}")
+            try:
+                result = execute(task, payload, os.path.join(self.scratch_dir, task_id))
+            except Exception as e:
+                traceback.print_exc()
+                self.broker.fail(task_id, f"{type(e).__name__}: {e}")
+            else:
+                self.broker.complete(task_id, result)
+            finally:
+                with self._busy_lock:
+                    self.busy -= 1
+
+    def run(self):
+        # Announce before claiming, so a claim is never swept as stale
+        self.broker.heartbeat(self.worker_id, self.capacity())
+        threads = [threading.Thread(target=self._heartbeat, daemon=True)]
+        threads += [threading.Thread(target=self._slot, daemon=True) for _ in range(self.slots)]
+        for thread in threads:
+            thread.start()
+
+        print(f"Worker {self.worker_id} running {', '.join(self.tasks)} on {self.slots} slot(s)")
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._stop.set()
+            self.broker.leave(self.worker_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run pipeline tasks from the task broker.")
+    parser.add_argument("--tasks", nargs="+", choices=sorted(TASKS), help="defaults to all of them")
+    parser.add_argument("--slots", type=int, default=1, help="tasks run at once")
+    parser.add_argument("--scratch-dir", default=WORKER_SCRATCH_DIR)
+    args = parser.parse_args()
+
+    Worker(args.tasks, args.slots, args.scratch_dir).run()
+
+
+if __name__ == "__main__":
+    main()
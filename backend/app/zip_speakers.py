@@ -1,23 +1,28 @@
 import os
-import zipfile
 
-def zip_speakers_only(job_dir: str) -> str:
+from app.zipper import folder_entries, iter_zip_stream
+
+
+def speakers_only_entries(job_dir: str):
     """
-    Creates a ZIP containing ONLY final speaker audio files.
+    Lists ONLY the final speaker audio files, ready for iter_zip_stream.
     """
     speakers_dir = os.path.join(job_dir, "speakers")
-    zip_path = os.path.join(job_dir, "speakers_only.zip")
 
     if not os.path.exists(speakers_dir):
         raise FileNotFoundError("Speakers folder not found")
 
-    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-        for file in os.listdir(speakers_dir):
-            if file.endswith(".wav"):
-                full_path = os.path.join(speakers_dir, file)
-                zipf.write(
-                    full_path,
-                    arcname=os.path.join("speakers", file)
-                )
+    return folder_entries(speakers_dir, prefix="speakers", suffix=".wav")
+
+
+def zip_speakers_only(job_dir: str) -> str:
+    """
+    Creates a ZIP containing ONLY final speaker audio files.
+    """
+    zip_path = os.path.join(job_dir, "speakers_only.zip")
+
+    with open(zip_path, "wb") as f:
+        for chunk in iter_zip_stream(speakers_only_entries(job_dir)):
+            f.write(chunk)
 
     return zip_path
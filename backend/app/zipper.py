@@ -1,14 +1,190 @@
-import zipfile
 import os
+import time
+import zlib
+import struct
+
+# Entries are always ZIP_STORED: compressing audio is slow and saves
+# next to nothing. Sizes are known from stat() up front, so the exact
+# archive length is known before the first byte is sent; only the CRC
+# has to wait, and it goes into a data descriptor after each file.
+
+ZIP64_LIMIT = 0xFFFFFFFF
+# Placeholder stored in 32-bit fields whose real value is in the zip64 extra
+ZIP64_MARKER = 0xFFFFFFFF
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+CHUNK_SIZE = 1024 * 1024
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+
+def folder_entries(folder_path: str, prefix: str = "", suffix: str = None):
+    """
+    Lists (full_path, arcname, size, mtime) for every file under
+    folder_path, in a stable order.
+    """
+    entries = []
+    for root, dirs, files in os.walk(folder_path):
+        dirs.sort()
+        for file in sorted(files):
+            if suffix and not file.endswith(suffix):
+                continue
+            full_path = os.path.join(root, file)
+            arcname = os.path.relpath(full_path, folder_path)
+            if prefix:
+                arcname = os.path.join(prefix, arcname)
+            stat = os.stat(full_path)
+            entries.append((full_path, arcname.replace(os.sep, "/"), stat.st_size, stat.st_mtime))
+    return entries
+
+
+def _dos_datetime(mtime: float):
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+def _plan(entries):
+    """Lays out every record so sizes and offsets are known up front."""
+    records = []
+    offset = 0
+    for full_path, arcname, size, mtime in entries:
+        name = arcname.encode("utf-8")
+        zip64 = size >= ZIP64_LIMIT
+        local_size = 30 + len(name) + (20 if zip64 else 0)
+        descriptor_size = 24 if zip64 else 16
+        records.append({
+            "path": full_path,
+            "name": name,
+            "size": size,
+            "datetime": _dos_datetime(mtime),
+            "zip64": zip64,
+            "offset": offset,
+        })
+        offset += local_size + size + descriptor_size
+
+    central_size = 0
+    for record in records:
+        extra = 0
+        if record["zip64"]:
+            extra += 16
+        if record["offset"] >= ZIP64_LIMIT:
+            extra += 8
+        record["central_extra"] = 4 + extra if extra else 0
+        central_size += 46 + len(record["name"]) + record["central_extra"]
+
+    return records, offset, central_size
+
+
+def _needs_zip64_end(count: int, central_offset: int, central_size: int) -> bool:
+    return (
+        count >= ZIP_FILECOUNT_LIMIT
+        or central_offset >= ZIP64_LIMIT
+        or central_size >= ZIP64_LIMIT
+    )
+
+
+def zip_stream_size(entries) -> int:
+    records, central_offset, central_size = _plan(entries)
+    end_size = 22
+    if _needs_zip64_end(len(records), central_offset, central_size):
+        end_size += 56 + 20
+    return central_offset + central_size + end_size
+
+
+def iter_zip_stream(entries):
+    """
+    Yields a ZIP_STORED archive of entries chunk by chunk, without ever
+    writing it to disk. Its length is exactly zip_stream_size(entries).
+    """
+    records, central_offset, central_size = _plan(entries)
+
+    for record in records:
+        dos_time, dos_date = record["datetime"]
+        flags = FLAG_DATA_DESCRIPTOR | FLAG_UTF8
+        version = 45 if record["zip64"] else 20
+
+        if record["zip64"]:
+            extra = struct.pack("<HHQQ", 0x0001, 16, 0, 0)
+            header_size = ZIP64_MARKER
+        else:
+            extra = b""
+            header_size = 0
+
+        yield struct.pack(
+            "<4sHHHHHIIIHH",
+            b"PK\x03\x04", version, flags, 0, dos_time, dos_date,
+            0, header_size, header_size, len(record["name"]), len(extra)
+        ) + record["name"] + extra
+
+        crc = 0
+        remaining = record["size"]
+        with open(record["path"], "rb") as f:
+            while remaining:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise RuntimeError(f"{record['path']} shrank while zipping")
+                crc = zlib.crc32(chunk, crc)
+                remaining -= len(chunk)
+                yield chunk
+        record["crc"] = crc
+
+        if record["zip64"]:
+            yield struct.pack("<4sIQQ", b"PK\x07\x08", crc, record["size"], record["size"])
+        else:
+            yield struct.pack("<4sIII", b"PK\x07\x08", crc, record["size"], record["size"])
+
+    for record in records:
+        dos_time, dos_date = record["datetime"]
+        version = 45 if record["zip64"] or record["central_extra"] else 20
+
+        extra_values = []
+        size_field = record["size"]
+        offset_field = record["offset"]
+        if record["zip64"]:
+            extra_values += [record["size"], record["size"]]
+            size_field = ZIP64_MARKER
+        if record["offset"] >= ZIP64_LIMIT:
+            extra_values.append(record["offset"])
+            offset_field = ZIP64_MARKER
+
+        extra = b""
+        if extra_values:
+            extra = struct.pack(f"<HH{len(extra_values)}Q", 0x0001, 8 * len(extra_values), *extra_values)
+
+        yield struct.pack(
+            "<4sHHHHHHIIIHHHHHII",
+            b"PK\x01\x02", version, version, FLAG_DATA_DESCRIPTOR | FLAG_UTF8, 0,
+            dos_time, dos_date, record["crc"], size_field, size_field,
+            len(record["name"]), len(extra), 0, 0, 0, 0, offset_field
+        ) + record["name"] + extra
+
+    count = len(records)
+    if _needs_zip64_end(count, central_offset, central_size):
+        zip64_end_offset = central_offset + central_size
+        yield struct.pack(
+            "<4sQHHIIQQQQ",
+            b"PK\x06\x06", 44, 45, 45, 0, 0,
+            count, count, central_size, central_offset
+        )
+        yield struct.pack("<4sIQI", b"PK\x06\x07", 0, zip64_end_offset, 1)
+
+    yield struct.pack(
+        "<4sHHHHIIH",
+        b"PK\x05\x06", 0, 0,
+        min(count, ZIP_FILECOUNT_LIMIT), min(count, ZIP_FILECOUNT_LIMIT),
+        central_size if central_size < ZIP64_LIMIT else ZIP64_MARKER,
+        central_offset if central_offset < ZIP64_LIMIT else ZIP64_MARKER,
+        0
+    )
+
 
 def zip_folder(folder_path: str, zip_path: str):
-    # CHANGED: Use ZIP_STORED instead of ZIP_DEFLATED
-    # This skips compression (which is slow for audio) and just packages the files instantly.
-    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as zipf:
-        for root, _, files in os.walk(folder_path):
-            for file in files:
-                full_path = os.path.join(root, file)
-                arcname = os.path.relpath(full_path, folder_path)
-                zipf.write(full_path, arcname)
-
-    return zip_path
\ No newline at end of file
+    with open(zip_path, "wb") as f:
+        for chunk in iter_zip_stream(folder_entries(folder_path)):
+            f.write(chunk)
+
+    return zip_path
@@ -0,0 +1,8 @@
+"""
+Offline, CPU-only benchmarks for the audio pipeline.
+
+    cd backend
+    python -m benchmarks.run --duration 600 --speakers 4 --out before.json
+    python -m benchmarks.run --duration 600 --speakers 4 --out after.json
+    python -m benchmarks.run --compare before.json after.json
+"""
@@ -0,0 +1,124 @@
+import json
+import wave
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+def plan_turns(duration: float, speakers: int, turns_per_minute: float, seed: int = 0):
+    """
+    Deterministic speaker turns in the same shape run_diarization
+    returns: dicts with speaker/start/end rounded to 10 ms.
+    """
+    rng = np.random.default_rng(seed)
+    n_turns = max(1, int(round(duration / 60.0 * turns_per_minute)))
+
+    bounds = np.concatenate([[0.0], np.sort(rng.uniform(0, duration, n_turns - 1)), [duration]])
+
+    segments = []
+    previous = None
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        choices = [s for s in range(speakers) if s != previous] or [0]
+        speaker = int(rng.choice(choices))
+        previous = speaker
+
+        # Leave a short pause before the next speaker
+        end = max(start + 0.05, end - rng.uniform(0.0, min(0.3, (end - start) / 2)))
+        segments.append({
+            "speaker": f"SPEAKER_{speaker:02d}",
+            "start": round(float(start), 2),
+            "end": round(float(end), 2)
+        })
+    return segments
+
+
+def _voice(speaker: int, frames: int, offset: int, sample_rate: int, rng):
+    """A crude voiced sound: a few harmonics over a syllable-rate envelope."""
+    t = (np.arange(frames) + offset) / sample_rate
+    f0 = 110.0 + 35.0 * speaker
+    signal = np.zeros(frames)
+    for harmonic in range(1, 6):
+        signal += np.sin(2 * np.pi * f0 * harmonic * t) / harmonic
+    envelope = 0.55 + 0.45 * np.sin(2 * np.pi * 4.0 * t + speaker)
+    return signal * envelope * 0.2 + rng.normal(0, 0.01, frames)
+
+
+def synthesize(path: str, segments: list, duration: float,
+               sample_rate: int = SAMPLE_RATE, channels: int = 1, seed: int = 0):
+    """
+    Writes a 16-bit WAV where each segment is voiced by its speaker and
+    everything else is low-level noise. Generated turn by turn, so an
+    hours-long fixture never sits in memory at once.
+    """
+    rng = np.random.default_rng(seed + 1)
+    total = int(round(duration * sample_rate))
+
+    with wave.open(path, "wb") as out:
+        out.setnchannels(channels)
+        out.setsampwidth(2)
+        out.setframerate(sample_rate)
+
+        cursor = 0
+        for seg in segments:
+            start = int(round(seg["start"] * sample_rate))
+            end = min(int(round(seg["end"] * sample_rate)), total)
+
+            if start > cursor:
+                out.writeframes(_to_pcm(rng.normal(0, 0.01, start - cursor), channels))
+            if end > start:
+                speaker = int(seg["speaker"].rsplit("_", 1)[1])
+                out.writeframes(_to_pcm(_voice(speaker, end - start, start, sample_rate, rng), channels))
+            cursor = max(cursor, end)
+
+        if total > cursor:
+            out.writeframes(_to_pcm(rng.normal(0, 0.01, total - cursor), channels))
+
+
+def _to_pcm(signal, channels: int) -> bytes:
+    pcm = (np.clip(signal, -1.0, 1.0) * 32767).astype("<i2")
+    if channels > 1:
+        pcm = np.repeat(pcm[:, None], channels, axis=1)
+    return pcm.tobytes()
+
+
+def build_fixture(directory: str, duration: float, speakers: int,
+                  turns_per_minute: float, seed: int = 0):
+    """
+    Creates normalized.wav (16 kHz mono, what diarization sees), raw.wav
+    (44.1 kHz stereo, what users upload) and segments.json.
+    """
+    segments = plan_turns(duration, speakers, turns_per_minute, seed)
+
+    normalized = f"{directory}/normalized.wav"
+    raw = f"{directory}/raw.wav"
+    synthesize(normalized, segments, duration, seed=seed)
+    synthesize(raw, segments, duration, sample_rate=44100, channels=2, seed=seed)
+
+    with open(f"{directory}/segments.json", "w") as f:
+        json.dump(segments, f)
+
+    return {"normalized": normalized, "raw": raw, "segments": segments, "duration": duration}
+
+
+class FakeDiarizer:
+    """
+    Deterministic stand-in for the pyannote pipeline: returns the
+    fixture's ground-truth turns for any input, and a fixed random
+    voiceprint per speaker.
+    """
+
+    def __init__(self, segments: list, dim: int = 256):
+        self.segments = segments
+        self.dim = dim
+
+    def __call__(self, audio_path: str, partial_path: str = None, return_embeddings: bool = False):
+        segments = [dict(s) for s in self.segments]
+        if not return_embeddings:
+            return segments
+
+        embeddings = {}
+        for label in sorted({s["speaker"] for s in segments}):
+            rng = np.random.default_rng(int(label.rsplit("_", 1)[1]))
+            embeddings[label] = rng.normal(size=self.dim).tolist()
+        return segments, embeddings
@@ -0,0 +1,364 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.fixtures import build_fixture, FakeDiarizer
+
+# Every repetition runs in a fresh spawned process, so peak RSS is that
+# stage's own high-water mark rather than whatever ran before it, and the
+# app's relative outputs/ paths land in a throwaway directory.
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Slower than this much over the baseline p50 is reported as a regression
+REGRESSION_THRESHOLD = 0.10
+
+
+def _has_ffmpeg():
+    return shutil.which("ffmpeg") is not None
+
+
+def _has_module(name):
+    try:
+        __import__(name)
+        return True
+    except ImportError:
+        return False
+
+
+def _stage_normalize(fixture, workdir, profile):
+    from app.audio_utils import normalize_audio
+    with profile.stage("normalize_audio"):
+        normalize_audio(fixture["raw"], os.path.join(workdir, "normalized.wav"))
+
+
+def _stage_extract_ffmpeg(fixture, workdir, profile):
+    from app.separation_concat import separate_by_speaker_concat
+    with profile.stage("separate_by_speaker_concat"):
+        separate_by_speaker_concat(fixture["normalized"], fixture["segments"], os.path.join(workdir, "speakers"))
+
+
+def _stage_extract_mmap(fixture, workdir, profile):
+    from app.extraction_engine import separate_by_speaker_mmap
+    with profile.stage("separate_by_speaker_mmap"):
+        separate_by_speaker_mmap(fixture["normalized"], fixture["segments"], os.path.join(workdir, "speakers"))
+
+
+def _stage_extract_aligned(fixture, workdir, profile):
+    from app.extraction_engine import separate_by_speaker_aligned
+    with profile.stage("separate_by_speaker_aligned"):
+        separate_by_speaker_aligned(fixture["normalized"], fixture["segments"], os.path.join(workdir, "speakers"))
+
+
+def _stage_extract_pydub(fixture, workdir, profile):
+    from app.speaker_extraction import extract_speakers
+    with profile.stage("extract_speakers"):
+        extract_speakers(fixture["normalized"], fixture["segments"], os.path.join(workdir, "speakers"))
+
+
+def _stage_zip(fixture, workdir, profile):
+    from app.extraction_engine import separate_by_speaker_mmap
+    from app.zipper import zip_folder
+
+    speakers_dir = os.path.join(workdir, "speakers")
+    separate_by_speaker_mmap(fixture["normalized"], fixture["segments"], speakers_dir)
+    with profile.stage("zip_folder"):
+        zip_folder(speakers_dir, os.path.join(workdir, "speakers.zip"))
+
+
+def _stage_pipeline(fixture, workdir, profile):
+    # Without ffmpeg the pipeline starts from the already normalized file,
+    # and writes its previews as WAV
+    if not _has_ffmpeg():
+        os.environ["PREVIEW_FORMAT"] = "wav"
+    from app.orchestrator import process_audio_pipeline
+
+    normalized_path = None if _has_ffmpeg() else fixture["normalized"]
+    with profile.stage("process_audio_pipeline"):
+        process_audio_pipeline(
+            fixture["raw"],
+            job_id="bench",
+            normalized_path=normalized_path,
+            diarizer=FakeDiarizer(fixture["segments"])
+        )
+
+
+def _stage_denoise_serial(fixture, workdir, profile):
+    from app.denoise_runner import denoise_serial
+    with profile.stage("denoise_serial"):
+        denoise_serial(fixture["raw"], os.path.join(workdir, "cleaned.wav"))
+
+
+def _stage_denoise_chunked(fixture, workdir, profile):
+    from app.denoise_engine import enhance
+    with profile.stage("denoise_chunked"):
+        enhance(fixture["raw"], os.path.join(workdir, "cleaned.wav"))
+
+
+# name -> (run, requirement check, why it would be skipped)
+STAGES = {
+    "normalize_audio": (_stage_normalize, _has_ffmpeg, "ffmpeg not on PATH"),
+    "separate_by_speaker_concat": (_stage_extract_ffmpeg, _has_ffmpeg, "ffmpeg not on PATH"),
+    "separate_by_speaker_mmap": (_stage_extract_mmap, None, None),
+    "separate_by_speaker_aligned": (_stage_extract_aligned, None, None),
+    "extract_speakers": (_stage_extract_pydub, lambda: _has_module("pydub"), "pydub not installed"),
+    "zip_folder": (_stage_zip, None, None),
+    "process_audio_pipeline": (_stage_pipeline, None, None),
+    "denoise_serial": (_stage_denoise_serial, _has_ffmpeg, "ffmpeg not on PATH"),
+    "denoise_chunked": (_stage_denoise_chunked, _has_ffmpeg, "ffmpeg not on PATH"),
+}
+
+
+def _loudness(path, workdir):
+    import numpy as np
+    from app.audio_utils import decode_f32
+    from app.denoise_engine import measure_loudness, SAMPLE_RATE, CHANNELS
+
+    raw_path = os.path.join(workdir, os.path.basename(path) + ".f32")
+    samples = np.array(decode_f32(path, raw_path, SAMPLE_RATE, CHANNELS))
+    measured = measure_loudness(raw_path)
+    return samples, {
+        "integrated_lufs": measured["input_i"],
+        "true_peak_dbtp": measured["input_tp"],
+        "lra_lu": measured["input_lra"],
+    }
+
+
+def compare_denoise(fixture, workdir):
+    """
+    Runs both enhancement engines on the fixture and reports how far the
+    chunked output is from the serial one: loudness of each, and the
+    level of their difference relative to the serial output.
+    """
+    import numpy as np
+    from app.denoise_runner import denoise_serial
+    from app.denoise_engine import enhance
+
+    serial_path = denoise_serial(fixture["raw"], os.path.join(workdir, "serial.wav"))
+    chunked_path = enhance(fixture["raw"], os.path.join(workdir, "chunked.wav"))
+    serial, serial_loudness = _loudness(serial_path, workdir)
+    chunked, chunked_loudness = _loudness(chunked_path, workdir)
+
+    frames = min(len(serial), len(chunked))
+    reference = np.sqrt(np.mean(serial[:frames] ** 2)) if frames else 0.0
+    difference = np.sqrt(np.mean((chunked[:frames] - serial[:frames]) ** 2)) if frames else 0.0
+    return {
+        "denoise_serial": serial_loudness,
+        "denoise_chunked": chunked_loudness,
+        "frames": {"denoise_serial": len(serial), "denoise_chunked": len(chunked)},
+        "difference_db": round(20 * np.log10(difference / reference), 2) if difference and reference else None,
+    }
+
+
+def _compare_denoise_once(fixture, workdir):
+    # Runs inside the spawned child
+    os.chdir(workdir)
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    return compare_denoise(fixture, workdir)
+
+
+def _run_once(name, fixture, workdir):
+    # Runs inside the spawned child
+    os.chdir(workdir)
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+    from app.metrics import JobProfile
+
+    profile = JobProfile(audio_seconds=fixture["duration"])
+    STAGES[name][0](fixture, workdir, profile)
+    return profile.stages[name]
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = (len(ordered) - 1) * q
+    low = int(index)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (index - low)
+
+
+def summarize(records, audio_seconds):
+    walls = [r["wall_seconds"] for r in records]
+    p50 = _percentile(walls, 0.5)
+    return {
+        "runs": len(records),
+        "latency_seconds": {
+            "p50": round(p50, 4),
+            "p90": round(_percentile(walls, 0.9), 4),
+            "p99": round(_percentile(walls, 0.99), 4),
+            "min": round(min(walls), 4),
+            "max": round(max(walls), 4),
+        },
+        # Seconds of audio processed per second of wall time
+        "throughput_x_realtime": round(audio_seconds / p50, 2) if p50 else None,
+        "cpu_seconds": round(_percentile([r["cpu_seconds"] for r in records], 0.5), 4),
+        "subprocesses": max(r["subprocesses"] for r in records),
+        # Each run is a fresh process, so its peak is the stage's own
+        "peak_rss_bytes": max(r["process_peak_rss_bytes"] for r in records),
+        "bytes_written": max(r["bytes_written"] for r in records),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(duration, speakers, turns_per_minute, repeat, stages=None, seed=0):
+    names = stages or list(STAGES)
+    context = multiprocessing.get_context("spawn")
+
+    results = {
+        "meta": {
+            "created_at": time.time(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "fixture": {
+                "duration": duration,
+                "speakers": speakers,
+                "turns_per_minute": turns_per_minute,
+                "seed": seed,
+            },
+            "repeat": repeat,
+        },
+        "stages": {},
+    }
+
+    with tempfile.TemporaryDirectory(prefix="bench-") as root:
+        fixture_dir = os.path.join(root, "fixture")
+        os.makedirs(fixture_dir)
+        fixture = build_fixture(fixture_dir, duration, speakers, turns_per_minute, seed)
+        results["meta"]["fixture"]["segments"] = len(fixture["segments"])
+
+        for name in names:
+            _, available, reason = STAGES[name]
+            if available and not available():
+                results["stages"][name] = {"skipped": reason}
+                print(f"{name}: skipped ({reason})")
+                continue
+
+            records = []
+            for i in range(repeat):
+                workdir = os.path.join(root, f"{name}-{i}")
+                os.makedirs(workdir)
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    records.append(pool.submit(_run_once, name, fixture, workdir).result())
+                shutil.rmtree(workdir, ignore_errors=True)
+
+            summary = summarize(records, duration)
+            results["stages"][name] = summary
+            print(
+                f"{name}: p50 {summary['latency_seconds']['p50']:.3f}s "
+                f"p90 {summary['latency_seconds']['p90']:.3f}s "
+                f"{summary['throughput_x_realtime']}x realtime "
+                f"{summary['subprocesses']} subprocesses "
+                f"{summary['peak_rss_bytes'] / 1024 / 1024:.0f} MiB peak"
+            )
+
+        if {"denoise_serial", "denoise_chunked"} <= set(names) and _has_ffmpeg():
+            workdir = os.path.join(root, "denoise-comparison")
+            os.makedirs(workdir)
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                comparison = pool.submit(_compare_denoise_once, fixture, workdir).result()
+            results["denoise_comparison"] = comparison
+            print(
+                f"denoise_chunked vs denoise_serial: "
+                f"{comparison['denoise_chunked']['integrated_lufs']:.1f} vs "
+                f"{comparison['denoise_serial']['integrated_lufs']:.1f} LUFS, "
+                f"difference {comparison['difference_db']} dB"
+            )
+
+    return results
+
+
+def compare(baseline, candidate, threshold=REGRESSION_THRESHOLD):
+    """
+    Lines describing each stage's p50 change between two result files.
+    Returns (lines, regressed stage names).
+    """
+    lines = []
+    regressed = []
+    if baseline["meta"]["fixture"] != candidate["meta"]["fixture"]:
+        lines.append("warning: runs used different fixtures")
+
+    for name in sorted(set(baseline["stages"]) | set(candidate["stages"])):
+        old = baseline["stages"].get(name, {})
+        new = candidate["stages"].get(name, {})
+        if "latency_seconds" not in old or "latency_seconds" not in new:
+            lines.append(f"{name}: not comparable")
+            continue
+
+        old_p50 = old["latency_seconds"]["p50"]
+        new_p50 = new["latency_seconds"]["p50"]
+        change = (new_p50 - old_p50) / old_p50 if old_p50 else 0.0
+        marker = ""
+        if change > threshold:
+            marker = "  REGRESSION"
+            regressed.append(name)
+
+        lines.append(
+            f"{name}: p50 {old_p50:.3f}s -> {new_p50:.3f}s ({change:+.1%}), "
+            f"subprocesses {old['subprocesses']} -> {new['subprocesses']}, "
+            f"peak {old['peak_rss_bytes'] / 1024 / 1024:.0f} -> "
+            f"{new['peak_rss_bytes'] / 1024 / 1024:.0f} MiB{marker}"
+        )
+    return lines, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark pipeline stages on synthetic recordings."
+    )
+    parser.add_argument("--duration", type=float, default=300, help="fixture length in seconds")
+    parser.add_argument("--speakers", type=int, default=3)
+    parser.add_argument("--turns-per-minute", type=float, default=12)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stage", action="append", choices=list(STAGES), help="only run these stages")
+    parser.add_argument("--out", help="write results as JSON")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"),
+                        help="compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            candidate = json.load(f)
+        lines, regressed = compare(baseline, candidate)
+        print("\n".join(lines))
+        if regressed:
+            raise SystemExit(f"{len(regressed)} stage(s) regressed")
+        return
+
+    results = run_benchmarks(
+        args.duration, args.speakers, args.turns_per_minute,
+        args.repeat, stages=args.stage, seed=args.seed
+    )
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
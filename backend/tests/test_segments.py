@@ -0,0 +1,84 @@
+import pytest
+
+from app.segments import SegmentTable, clean, postprocess
+
+
+def turns(*rows):
+    return [{"speaker": speaker, "start": start, "end": end} for speaker, start, end in rows]
+
+
+def test_merge_joins_close_turns_of_one_speaker():
+    segments, report = postprocess(
+        turns(("A", 0.0, 1.0), ("A", 1.2, 2.0), ("B", 1.1, 1.9)),
+        merge_gap=0.5, min_duration=0.0, pad=0.0, overlaps="keep"
+    )
+    assert segments == turns(("A", 0.0, 2.0), ("B", 1.1, 1.9))
+    assert report["turns_in"] == 3
+    assert report["turns_out"] == 2
+    assert report["cuts_saved"] == 1
+
+
+def test_min_duration_drops_short_turns():
+    segments, report = postprocess(
+        turns(("A", 0.0, 2.0), ("B", 5.0, 5.1)),
+        merge_gap=0.0, min_duration=0.3, pad=0.0, overlaps="keep"
+    )
+    assert segments == turns(("A", 0.0, 2.0))
+    assert report["dropped_seconds"] == 0.1
+
+
+def test_pad_is_clamped_to_the_recording():
+    segments, _ = postprocess(
+        turns(("A", 0.02, 1.0), ("B", 2.0, 2.98)),
+        merge_gap=0.0, min_duration=0.0, pad=0.05, overlaps="keep", duration=3.0
+    )
+    assert segments == turns(("A", 0.0, 1.05), ("B", 1.95, 3.0))
+
+
+def test_pad_rejoins_turns_it_makes_touch():
+    segments, _ = postprocess(
+        turns(("A", 0.0, 1.0), ("A", 1.08, 2.0)),
+        merge_gap=0.0, min_duration=0.0, pad=0.05, overlaps="keep"
+    )
+    assert segments == turns(("A", 0.0, 2.05))
+
+
+def test_exclusive_cuts_out_overlaps():
+    segments, _ = postprocess(
+        turns(("A", 0.0, 3.0), ("B", 2.0, 5.0)),
+        merge_gap=0.0, min_duration=0.0, pad=0.0, overlaps="exclusive"
+    )
+    assert segments == turns(("A", 0.0, 2.0), ("B", 3.0, 5.0))
+
+
+def test_exclusive_drops_fragments_shorter_than_min_duration():
+    # B talks over all of A but its first tenth of a second
+    segments, report = postprocess(
+        turns(("A", 0.0, 2.0), ("B", 0.1, 3.0)),
+        merge_gap=0.0, min_duration=0.3, pad=0.0, overlaps="exclusive"
+    )
+    assert segments == turns(("B", 2.0, 3.0))
+    assert report["dropped_seconds"] == 0.1
+    assert report["cuts_saved"] == 1
+
+
+def test_exclusive_split_turn_saves_no_cuts():
+    # The interruption disappears, and splits A in two
+    segments, report = postprocess(
+        turns(("A", 0.0, 9.0), ("B", 2.0, 3.0)),
+        merge_gap=0.0, min_duration=0.0, pad=0.0, overlaps="exclusive"
+    )
+    assert segments == turns(("A", 0.0, 2.0), ("A", 3.0, 9.0))
+    assert report["cuts_saved"] == 0
+
+
+def test_table_round_trips_through_npz(tmp_path):
+    table = SegmentTable.from_list(turns(("A", 0.0, 1.25), ("B", 1.5, 2.0)))
+    path = str(tmp_path / "diarization.npz")
+    table.save(path)
+    assert SegmentTable.load(path).to_list() == table.to_list()
+
+
+def test_unknown_overlap_mode_is_rejected():
+    with pytest.raises(ValueError):
+        clean(SegmentTable.from_list(turns(("A", 0.0, 1.0))), overlaps="drop")
@@ -36,7 +36,9 @@ const App = () => {
     };
   }, []);
 
-  useEffect(() => { stopAudio(); }, [results, mode]);
+  // Keyed on the job, not the results: tracks arriving one by one must
+  // not interrupt the one already playing
+  useEffect(() => { stopAudio(); }, [results?.job_id, mode]);
 
   const stopAudio = () => {
     const audio = audioRef.current;
@@ -79,6 +81,32 @@ const App = () => {
     setProgress(0);
   };
 
+  // Resolves with the job result. Speaker tracks are shown as soon as
+  // each one is written, while the rest of the job is still running.
+  const followJob = (job_id) => new Promise((resolve, reject) => {
+    const events = new EventSource(`${API_BASE_URL}/jobs/${job_id}/events`);
+
+    events.addEventListener('speaker', (e) => {
+      const track = JSON.parse(e.data);
+      setResults(prev => {
+        const speakers = prev?.job_id === job_id ? prev.speakers : [];
+        if (speakers.some(t => t.speaker_id === track.speaker_id)) return prev;
+        return { job_id, speakers: [...speakers, track], partial: true };
+      });
+    });
+
+    events.onmessage = (e) => {
+      const status = JSON.parse(e.data);
+      if (status.status === 'done') {
+        events.close();
+        resolve(status.result);
+      } else if (status.status === 'failed' || status.status === 'expired') {
+        events.close();
+        reject(new Error(status.error || 'Processing failed'));
+      }
+    };
+  });
+
   const startProcessing = async (selectedFile) => {
     setIsProcessing(true);
     setProgress(0);
@@ -103,7 +131,10 @@ const App = () => {
       });
 
       if (!res.ok) throw new Error(`Server Error: ${res.statusText}`);
-      const data = await res.json();
+      const job = await res.json();
+
+      // Jobs run in the background; follow them until the worker reports back
+      const data = job.status === 'done' ? job.result : await followJob(job.job_id);
       
       clearInterval(interval);
       setProgress(100);
@@ -233,7 +264,9 @@ const App = () => {
 
               <div className="results-top-bar">
                 <h3 style={{fontSize: '1.5rem', fontWeight: 700}}>
-                    {mode === 'clean' ? 'Enhancement Complete' : 'Separation Complete'}
+                    {results.partial
+                      ? `Separating... ${results.speakers.length} track${results.speakers.length === 1 ? '' : 's'} ready`
+                      : mode === 'clean' ? 'Enhancement Complete' : 'Separation Complete'}
                 </h3>
                 <button onClick={() => { setFile(null); setResults(null); }} className="control-btn">
                     <X size={24} />
@@ -252,7 +285,8 @@ const App = () => {
                     
                     <div className="track-details">
                       <div className="track-name">
-                         {track.speaker_id}
+                         {track.name || track.speaker_id}
+                         {track.known_speaker_id && <span className="badge">KNOWN</span>}
                          {track.type === 'stem' && <span className="badge">STEM</span>}
                          {track.type === 'enhanced' && <span className="badge">CLEAN</span>}
                       </div>
@@ -277,7 +311,7 @@ const App = () => {
                 ))}
               </div>
 
-              <button className="btn-primary-action" onClick={handleDownloadAll}>
+              <button className="btn-primary-action" onClick={handleDownloadAll} disabled={results.partial}>
                   DOWNLOAD ALL TRACKS (ZIP)
               </button>
             </div>